@@ -3,6 +3,7 @@
 import argparse
 import os
 import glob 
+import sys
 import your
 import numpy as np
 import matplotlib.pyplot as plt
@@ -10,6 +11,8 @@ from matplotlib import gridspec
 from matplotlib.ticker import FixedLocator
 import scienceplots; plt.style.use(['science','ieee', 'no-latex'])
 from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
+import pyramid_utils
 
 fil_list = glob.glob('/datax2/projects/LOFTS/*/*/*0001*.fil')
 out_dir = '/datax2/projects/LOFTS/spectrum-stamps/'
@@ -21,6 +24,7 @@ def main():
     for fil in tqdm(fil_list):
         fil_obj = your.Your(fil)
         header = fil_obj.your_header
+        meta = pyramid_utils.load_meta(fil)
         
         # grab 10% segments of an observation 
         n_seg = 10
@@ -31,8 +35,14 @@ def main():
         segments = []
         for i in range(n_seg):
             strt_samp = i * seg_len
-            fil_data = fil_obj.get_data(nstart=strt_samp, nsamp=seg_len)
-            spectrum = np.mean(fil_data, axis=0)
+            if meta is not None:
+                # full channel resolution, coarsest time decimation available
+                pyr_data, _ = pyramid_utils.read_level(fil, 1, header.nchans, nstart=strt_samp,
+                                                       nsamp=seg_len, meta=meta)
+                spectrum = np.mean(pyr_data[:, 0, :], axis=0)
+            else:
+                fil_data = fil_obj.get_data(nstart=strt_samp, nsamp=seg_len)
+                spectrum = np.mean(fil_data, axis=0)
             # freq and power to .dat 
             freq = np.linspace(header.fch1, header.fch1 + header.foff * header.nchans, header.nchans)
             out_dat = np.column_stack((freq, spectrum))
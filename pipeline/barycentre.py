@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Lazy barycentric correction for LOFTS filterbanks, in place of barycentre_seti
+writing a corrected copy of every 0000 product.
+
+The barycentric velocity of the station towards the source is computed once per observation
+(astropy, from the header's tstart, src_raj/src_dej and the station site) and turned into a
+Doppler factor D, so that f_bary = D * f_topo with D = 1 / (1 + v/c). Because D is a pure
+scale, the corrected frequency axis is still uniform: fch1 and foff are multiplied by D and
+the samples are used as they are. Nothing is rewritten; the correction is applied when the
+product is read (open_corrected) or to the hits after a search (correct_dat).
+
+Each product's correction is cached next to it in <name>.fil.bary.json (checked against the
+source size/mtime like the pyramid sidecars), so no state is shared between targets and no file
+is dropped into the working directory.
+
+    barycentre.py info <file.fil> -s IE613|SE607          print v, D and the drift over the scan
+    barycentre.py correct-dat <hits.dat> <file.fil> -s IE613|SE607
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+
+import sigproc_utils
+
+C_MPS = 299792458.0
+# Geodetic (lat deg, lon deg, height m) of the LOFAR stations
+SITES = {'IE613': (53.0952, -7.9218, 75.0),
+         'SE607': (57.39885, 11.93029, 20.0)}
+SITE_CODES = {'n': 'IE613', 'p': 'SE607'}  # barycentre_seti -site codes
+N_SAMPLES = 5
+
+def sidecar_path(fil_path):
+    return fil_path + '.bary.json'
+
+def sigproc_angle(value, hours=False):
+    '''sigproc packed ddmmss.s (or hhmmss.s) -> degrees.'''
+    sign = -1 if value < 0 else 1
+    value = abs(value)
+    d, rest = divmod(value, 10000)
+    m, s = divmod(rest, 100)
+    deg = d + m / 60 + s / 3600
+    return sign * deg * (15 if hours else 1)
+
+def station_for(fil_path, station=None):
+    '''Station name from the argument (names or barycentre_seti codes), else from the path.'''
+    station = SITE_CODES.get(station, station)
+    if station is None:
+        station = next((name for name in SITES if name in os.path.abspath(fil_path)), None)
+    if station not in SITES:
+        raise ValueError(f"Unknown station for {fil_path}; give one of {', '.join(SITES)}")
+    return station
+
+def barycentric_velocity(mjds, ra_deg, dec_deg, station):
+    '''Barycentric radial velocity correction (m/s) of the station towards the source at each UTC MJD.'''
+    from astropy import units as u
+    from astropy.coordinates import EarthLocation, SkyCoord
+    from astropy.time import Time
+
+    lat, lon, height = SITES[station]
+    site = EarthLocation(lat=lat * u.deg, lon=lon * u.deg, height=height * u.m)
+    src = SkyCoord(ra=ra_deg * u.deg, dec=dec_deg * u.deg, frame='icrs')
+    times = Time(np.atleast_1d(mjds), format='mjd', scale='utc')
+    return src.radial_velocity_correction(kind='barycentric', obstime=times, location=site).to_value(u.m / u.s)
+
+def compute(hdr, station, n_samples=N_SAMPLES):
+    '''Correction for one observation: velocity at n_samples times across it, D at its midpoint.'''
+    duration = hdr['nspectra'] * hdr['tsamp']
+    offsets = np.linspace(0, duration, n_samples)
+    mjds = hdr['tstart'] + offsets / 86400
+    ra = sigproc_angle(hdr['src_raj'], hours=True)
+    dec = sigproc_angle(hdr['src_dej'])
+    v = barycentric_velocity(mjds, ra, dec, station)
+
+    factors = 1 / (1 + v / C_MPS)
+    mid = float(np.interp(duration / 2, offsets, factors))
+    slope = np.polyfit(offsets, factors, 1)[0] if n_samples > 1 else 0.0
+    return {'station': station, 'ra_deg': ra, 'dec_deg': dec,
+            'tstart': hdr['tstart'], 'duration_s': duration,
+            'mjds': mjds.tolist(), 'v_mps': v.tolist(),
+            'factor': mid,
+            # residual drift of a fixed topocentric tone that one factor for the whole scan leaves in
+            'drift_hz_s_at_fch1': slope * hdr['fch1'] * 1e6}
+
+def load_or_compute(fil_path, station=None, hdr=None, write=True):
+    '''The cached correction of fil_path, recomputed if the product changed since.'''
+    station = station_for(fil_path, station)
+    path = sidecar_path(fil_path)
+    if os.path.isfile(path):
+        with open(path) as f:
+            corr = json.load(f)
+        if (corr.get('station') == station and corr.get('source_size') == os.path.getsize(fil_path)
+                and corr.get('source_mtime', 0) >= os.path.getmtime(fil_path)):
+            return corr
+
+    hdr = hdr or sigproc_utils.read_header(fil_path)
+    corr = compute(hdr, station)
+    corr.update({'source_size': os.path.getsize(fil_path), 'source_mtime': os.path.getmtime(fil_path)})
+    if write:
+        tmp_path = path + '.partial'
+        with open(tmp_path, 'w') as f:
+            json.dump(corr, f, indent=2)
+        os.replace(tmp_path, path)
+    return corr
+
+def corrected_header(hdr, corr):
+    out = dict(hdr)
+    out['fch1'] = hdr['fch1'] * corr['factor']
+    out['foff'] = hdr['foff'] * corr['factor']
+    out['barycentric'] = 1
+    return out
+
+def open_corrected(fil_path, station=None):
+    '''(barycentric header, read-only memmap of the unchanged samples).'''
+    hdr = sigproc_utils.read_header(fil_path)
+    corr = load_or_compute(fil_path, station, hdr)
+    return corrected_header(hdr, corr), sigproc_utils.open_memmap(fil_path, hdr)
+
+def correct_dat(dat_path, corr, out_path=None):
+    '''
+    Sets Corrected_Frequency = D * Uncorrected_Frequency for every hit of a turboSETI .dat.
+    Idempotent (always derived from the uncorrected column). Returns the number of hits.
+    '''
+    out_path = out_path or dat_path
+    lines, n_hits = [], 0
+    with open(dat_path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                lines.append(line)
+                continue
+            fields = line.rstrip('\n').split('\t')
+            pad = fields[4][:len(fields[4]) - len(fields[4].lstrip())]
+            fields[4] = f"{pad}{float(fields[3]) * corr['factor']:.6f}"
+            lines.append('\t'.join(fields) + '\n')
+            n_hits += 1
+
+    tmp_path = out_path + '.partial'
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, out_path)
+    return n_hits
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Lazy barycentric correction of LOFTS filterbanks.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    info_p = sub.add_parser('info', help='Compute (or load) and print the correction of a product.')
+    info_p.add_argument('fil')
+    info_p.add_argument('-s', '--station', type=str, default=None, help='IE613 or SE607 (default: from the path).')
+    dat_p = sub.add_parser('correct-dat', help='Fill the Corrected_Frequency column of a turboSETI .dat.')
+    dat_p.add_argument('dat')
+    dat_p.add_argument('fil', help='The product the hits were found in.')
+    dat_p.add_argument('-s', '--station', type=str, default=None, help='IE613 or SE607 (default: from the path).')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    corr = load_or_compute(args.fil, args.station)
+    if args.cmd == 'info':
+        v = np.array(corr['v_mps'])
+        print(f"{args.fil} ({corr['station']}): v = {v.mean()/1e3:+.4f} km/s ({v.min()/1e3:+.4f} .. {v.max()/1e3:+.4f}), "
+              f"D = {corr['factor']:.12f}")
+        print(f"    residual drift at fch1 over {corr['duration_s']:.0f} s: {corr['drift_hz_s_at_fch1']:+.4e} Hz/s")
+        return
+    n_hits = correct_dat(args.dat, corr)
+    print(f"Corrected {n_hits} hit(s) in {args.dat} (D = {corr['factor']:.12f})")
+
+if __name__ == "__main__":
+    main()
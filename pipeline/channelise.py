@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: NumPy fine-channeliser from GUPPI RAW to sigproc filterbanks, for small custom
+products (e.g. a 1 kHz / 100 ms monitoring product) on nodes where rawspec is busy.
+
+Follows rawspec's conventions:
+  -f  fine channels per coarse channel (FFT length, fft-shifted so DC sits in the middle)
+  -t  spectra summed per output spectrum (runt integrations at the end are dropped)
+  -p  1 -> total power |X|^2 + |Y|^2; 4 -> XX*, YY*, Re(XY*), Im(XY*) as nifs 0..3
+Several products can be made in one pass over the blocks (-f 8,64 -t 16,3072 -p 1,4), written
+to <out_dir>/<stem>.npchan.NNNN.fil in the order given. PKTIDX gaps are zero-filled so the time
+axis stays aligned.
+
+FFTs are batched over groups of coarse channels and both polarisations, and the groups run on a
+thread pool (numpy's FFT releases the GIL). Memory is bounded by one block plus one block's
+worth of spectra per product, whatever the file length.
+
+    channelise.py <stem or .raw files> -f 1024 -t 20 -p 1 [-o OUT_DIR] [-w 8]
+    channelise.py bench <.raw> [--blocks 16] [--rawspec]     MB/s against rawspec
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import guppi_raw
+import sigproc_utils
+import telemetry
+
+# ===== Channelising =====
+def detect(spec, npol_out):
+    '''spec: complex (..., npol). Returns float32 (..., npol_out).'''
+    power = spec.real ** 2 + spec.imag ** 2
+    if npol_out == 1:
+        return power.sum(axis=-1, keepdims=True)
+    if spec.shape[-1] != 2:
+        raise ValueError("-p 4 needs two polarisations")
+    cross = spec[..., 0] * np.conj(spec[..., 1])
+    return np.stack([power[..., 0], power[..., 1], cross.real, cross.imag], axis=-1)
+
+def channelise_block(block, f, npol_out, pool, batch=16, flip=False):
+    '''
+    block: int8 view (nchan, ntime, npol, 2). Returns float32 spectra of shape
+    (ntime // f, npol_out, nchan * f) with coarse channels in order and fine channels fft-shifted.
+    '''
+    nchan, ntime, npol, _ = block.shape
+    nspec = ntime // f
+    out = np.empty((nspec, npol_out, nchan * f), dtype=np.float32)
+
+    def work(c0):
+        c1 = min(c0 + batch, nchan)
+        volts = guppi_raw.to_complex(block[c0:c1, :nspec * f])
+        spec = np.fft.fftshift(np.fft.fft(volts.reshape(c1 - c0, nspec, f, npol), axis=2), axes=2)
+        if flip:
+            spec = spec[:, :, ::-1]
+        power = detect(spec, npol_out)                       # (cb, nspec, f, npol_out)
+        out[:, :, c0 * f:c1 * f] = power.transpose(1, 3, 0, 2).reshape(nspec, npol_out, (c1 - c0) * f)
+
+    list(pool.map(work, range(0, nchan, batch)))
+    return out
+
+class Integrator:
+    '''Sums every t consecutive spectra, carrying partial sums across blocks.'''
+
+    def __init__(self, t):
+        self.t = t
+        self.acc = None
+        self.n = 0
+
+    def add(self, spectra):
+        '''Returns the completed integrations from spectra as an array (k, nifs, nchans).'''
+        done, i, n = [], 0, len(spectra)
+        if self.n:
+            m = min(self.t - self.n, n)
+            self.acc += spectra[:m].sum(axis=0)
+            self.n += m
+            i = m
+            if self.n == self.t:
+                done.append(self.acc[None])
+                self.acc, self.n = None, 0
+        full = (n - i) // self.t
+        if full:
+            done.append(spectra[i:i + full * self.t].reshape(full, self.t, *spectra.shape[1:]).sum(axis=1))
+            i += full * self.t
+        if i < n:
+            self.acc = spectra[i:].sum(axis=0)
+            self.n = n - i
+        return np.concatenate(done) if done else spectra[:0]
+
+# ===== Headers =====
+def sexagesimal(text):
+    '''"12:34:56.7" -> 123456.7 as sigproc stores src_raj/src_dej.'''
+    sign = -1 if text.strip().startswith('-') else 1
+    h, m, s = (abs(float(x)) for x in text.split(':'))
+    return sign * (h * 10000 + m * 100 + s)
+
+def fil_header(raw, f, t, npol_out, raw_path):
+    hdr = raw.header
+    nchan = int(hdr['OBSNCHAN'])
+    obsbw = float(hdr['OBSBW'])
+    chan_bw = obsbw / nchan
+    foff = chan_bw / f
+    tbin = float(hdr['TBIN'])
+
+    # time of the first sample: session start plus the first block's packet offset
+    tstart = float(hdr.get('STT_IMJD', 0)) + (float(hdr.get('STT_SMJD', 0)) + float(hdr.get('STT_OFFS', 0))) / 86400
+    ntime = raw.block_shape(0)[1]
+    if hdr.get('PIPERBLK') and len(raw):
+        tstart += raw.index['pktidx'][0] / hdr['PIPERBLK'] * ntime * tbin / 86400
+
+    out = {'telescope_id': int(hdr.get('TELESCOP_ID', 0)) if str(hdr.get('TELESCOP_ID', '')).isdigit() else 0,
+           'machine_id': 0, 'data_type': 1,
+           'rawdatafile': os.path.basename(raw_path), 'source_name': str(hdr.get('SRC_NAME', 'unknown')),
+           'tstart': tstart, 'tsamp': f * t * tbin,
+           'fch1': float(hdr['OBSFREQ']) - obsbw / 2 + chan_bw / 2 - (f // 2) * foff, 'foff': foff,
+           'nchans': nchan * f, 'nifs': npol_out, 'nbits': 32, 'nbeams': 1, 'ibeam': 0}
+    for key, card in (('src_raj', 'RA_STR'), ('src_dej', 'DEC_STR')):
+        if isinstance(hdr.get(card), str) and ':' in hdr[card]:
+            out[key] = sexagesimal(hdr[card])
+    return out
+
+# ===== Driver =====
+def raw_inputs(inputs):
+    paths = []
+    for item in inputs:
+        paths += [item] if item.endswith('.raw') else guppi_raw.scan_files(item)
+    if not paths:
+        raise FileNotFoundError(f"No .raw files found for {' '.join(inputs)}")
+    return paths
+
+def channelise(raw_paths, products, out_dir, stem, threads=8, batch=16, max_blocks=None, log=print):
+    '''
+    products: [(f, t, npol_out)]. One pass over the blocks of raw_paths (in order) feeds every
+    product. Returns {'blocks', 'bytes_in', 'seconds', 'outputs': [(path, nspectra)]}.
+    '''
+    raws = [guppi_raw.GuppiRaw(p) for p in raw_paths]
+    first = next((r for r in raws if len(r)), None)
+    if first is None:
+        raise ValueError(f"No complete GUPPI blocks in {' '.join(raw_paths)}")
+    nchan, ntime, npol, _ = first.block_shape(0)
+    for f, t, p in products:
+        if ntime % f:
+            raise ValueError(f"-f {f} does not divide the {ntime} samples in a block")
+        if p == 4 and npol != 2:
+            raise ValueError("-p 4 needs dual-polarisation input")
+    flip = float(first.header.get('OBSBW', 1)) < 0
+
+    os.makedirs(out_dir, exist_ok=True)
+    outputs, files, integrators, counts = [], [], [], []
+    for n, (f, t, p) in enumerate(products):
+        path = os.path.join(out_dir, f"{stem}.npchan.{n:04d}.fil")
+        fh = open(path, 'wb')
+        sigproc_utils.write_header(fh, fil_header(first, f, t, p, raw_paths[0]))
+        outputs.append(path); files.append(fh); integrators.append(Integrator(t)); counts.append(0)
+
+    strt = time.time()
+    blocks = bytes_in = 0
+    expected_step = first.header.get('PIPERBLK')
+    last_pktidx = None
+    zero_block = None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            for raw in raws:
+                for k in range(len(raw)):
+                    if max_blocks is not None and blocks >= max_blocks:
+                        break
+                    pktidx = int(raw.index['pktidx'][k])
+                    missing = 0
+                    if last_pktidx is not None and expected_step and pktidx - last_pktidx > expected_step:
+                        missing = (pktidx - last_pktidx) // expected_step - 1
+                    last_pktidx = pktidx
+
+                    block = raw.block(k)
+                    if missing:
+                        log(f"Zero-filling {missing} missing block(s) before block {k} of {raw.path}")
+                        zero_block = np.zeros_like(block) if zero_block is None else zero_block
+                    for feed in [zero_block] * missing + [block]:
+                        for n, (f, t, p) in enumerate(products):
+                            done = integrators[n].add(channelise_block(feed, f, p, pool, batch, flip))
+                            if len(done):
+                                files[n].write(np.ascontiguousarray(done, dtype=np.float32).tobytes())
+                                counts[n] += len(done)
+                    blocks += 1
+                    bytes_in += block.nbytes
+    finally:
+        for fh in files:
+            fh.close()
+
+    return {'blocks': blocks, 'bytes_in': bytes_in, 'seconds': time.time() - strt,
+            'outputs': list(zip(outputs, counts))}
+
+def parse_list(text):
+    return [int(x) for x in text.split(',')]
+
+def products_from(args):
+    fs, ts, ps = parse_list(args.fine), parse_list(args.integrations), parse_list(args.npol)
+    if not len(fs) == len(ts) == len(ps):
+        ps = ps * len(fs) if len(ps) == 1 else ps
+    if not len(fs) == len(ts) == len(ps):
+        raise SystemExit("-f, -t and -p need the same number of values")
+    return list(zip(fs, ts, ps))
+
+# ===== Benchmark =====
+def rawspec_telemetry_rate():
+    '''Median MB/s of successful rawspec stages in the telemetry records, or None.'''
+    files = sorted(glob.glob(os.path.join(telemetry.TELEMETRY_DIR, '*.jsonl')))
+    rates = [r['mb_per_s'] for r in telemetry.load_records(files)
+             if r.get('stage') == 'rawspec' and r.get('exit_status') == 0 and r.get('mb_per_s')]
+    return (float(np.median(rates)), len(rates)) if rates else None
+
+def bench(raw_path, products, n_blocks, threads, batch, run_rawspec):
+    raw = guppi_raw.GuppiRaw(raw_path)
+    n_blocks = min(n_blocks, len(raw))
+    tmp_dir = tempfile.mkdtemp(prefix='npchan_bench_')
+    try:
+        res = channelise([raw_path], products, tmp_dir, 'bench', threads, batch, max_blocks=n_blocks, log=lambda m: None)
+        rate = res['bytes_in'] / 1e6 / res['seconds']
+        print(f"channelise.py: {res['blocks']} block(s), {res['bytes_in']/1e9:.2f} GB in {res['seconds']:.1f} s "
+              f"-> {rate:.1f} MB/s ({threads} threads)")
+
+        if run_rawspec:
+            if not shutil.which('rawspec'):
+                print("rawspec not found on PATH; skipping the direct comparison.")
+            else:
+                # same input: the first n_blocks blocks copied into a stand-alone .raw
+                stem = os.path.join(tmp_dir, 'rs')
+                end = int(raw.index['data_offset'][n_blocks - 1] + raw.index['blocsize'][n_blocks - 1])
+                with open(raw_path, 'rb') as src, open(stem + '.0000.raw', 'wb') as dst:
+                    dst.write(src.read(end))
+                cmd = ['rawspec', '-f', ','.join(str(p[0]) for p in products), '-t', ','.join(str(p[1]) for p in products),
+                       '-p', ','.join(str(p[2]) for p in products), '-d', tmp_dir, stem]
+                strt = time.time()
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+                elapsed = time.time() - strt
+                print(f"rawspec:       same {end/1e9:.2f} GB in {elapsed:.1f} s -> {end/1e6/elapsed:.1f} MB/s "
+                      f"({rate * elapsed * 1e6 / end:.2f}x)")
+
+        tele = rawspec_telemetry_rate()
+        if tele:
+            print(f"rawspec stage in filterbank-gen-lofts telemetry: median {tele[0]:.1f} MB/s over {tele[1]} run(s)")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def get_args():
+    parser = argparse.ArgumentParser(description='NumPy fine-channeliser: GUPPI RAW -> sigproc filterbank.')
+    parser.add_argument('inputs', nargs='+', help='.raw files or a <stem> (reads <stem>.NNNN.raw); "bench <file.raw>" to benchmark.')
+    parser.add_argument('-f', '--fine', type=str, default='1024', help='Fine channels per coarse channel, comma-separated per product (default: 1024).')
+    parser.add_argument('-t', '--integrations', type=str, default='20', help='Spectra per integration, per product (default: 20).')
+    parser.add_argument('-p', '--npol', type=str, default='1', help='1 (total power) or 4 (full pol), per product (default: 1).')
+    parser.add_argument('-o', '--out-dir', type=str, default=None, help='Output directory (default: next to the input).')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='FFT threads (default: 8).')
+    parser.add_argument('--batch', type=int, default=16, help='Coarse channels per FFT batch (default: 16).')
+    parser.add_argument('--blocks', type=int, default=None, help='Stop after this many blocks (bench default: 16).')
+    parser.add_argument('--rawspec', action='store_true', help='bench: also time rawspec on the same blocks.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    products = products_from(args)
+
+    if args.inputs[0] == 'bench':
+        if len(args.inputs) != 2:
+            raise SystemExit("usage: channelise.py bench <file.raw> [-f ..] [-t ..] [-p ..] [--blocks N] [--rawspec]")
+        bench(args.inputs[1], products, args.blocks or 16, args.workers, args.batch, args.rawspec)
+        return
+
+    try:
+        raw_paths = raw_inputs(args.inputs)
+        stem = os.path.basename(raw_paths[0]).split('.')[0]
+        out_dir = args.out_dir or os.path.dirname(os.path.abspath(raw_paths[0]))
+        res = channelise(raw_paths, products, out_dir, stem, args.workers, args.batch, args.blocks)
+    except (FileNotFoundError, ValueError) as e:
+        raise SystemExit(f"Error: {e}")
+    print(f"Channelised {res['blocks']} block(s) ({res['bytes_in']/1e9:.2f} GB) in {res['seconds']:.1f} s "
+          f"({res['bytes_in']/1e6/max(res['seconds'], 1e-9):.1f} MB/s)")
+    for path, nspectra in res['outputs']:
+        print(f"    {path}: {nspectra} spectra")
+
+if __name__ == "__main__":
+    main()
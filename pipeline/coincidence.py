@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: IE613/SE607 coincidence of narrowband hits. A signal from the sky should be seen
+by both stations at the same barycentric frequency and a similar drift rate; local RFI is seen
+by one. Hits are read from the hit database (hitdb.py), so both stations' .dat files must have
+been ingested first.
+
+Matching is a sorted merge over all hits in the selected window: both stations' hits are
+sorted by barycentric frequency, each IE613 hit finds its SE607 frequency window with
+searchsorted, and the candidate pairs are expanded and filtered on drift rate and time
+(|dt| <= --time-tol-h, default 3 h, which covers the ~80 minute transit offset between the
+stations for the same zenith field). Work is done in chunks of IE613 hits to bound memory in
+RFI-dense bands. Each hit is classed coincident, ie_only or se_only.
+
+    coincidence.py --start 2024-07-22 [--days 7] [--freq-tol-hz 10] [--drift-tol 0.25] [-o out_dir]
+"""
+
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+import numpy as np
+
+import hitdb
+
+MJD_EPOCH = datetime(1858, 11, 17)
+NAMES = ['bary_freq', 'freq', 'drift', 'snr', 'mjd', 'target']
+
+def date_to_mjd(text):
+    return (datetime.strptime(text, '%Y-%m-%d') - MJD_EPOCH).total_seconds() / 86400
+
+def load_station(db, station, mjd0=None, mjd1=None, sessions=None):
+    '''Columns of one station's hits in [mjd0, mjd1), sorted by barycentric frequency.'''
+    cols, target_names, parts = db.load_all(NAMES, [station], sessions)
+    keep = np.ones(len(cols['mjd']), dtype=bool)
+    if mjd0 is not None:
+        keep &= cols['mjd'] >= mjd0
+    if mjd1 is not None:
+        keep &= cols['mjd'] < mjd1
+    order = np.flatnonzero(keep)[np.argsort(cols['bary_freq'][keep], kind='stable')]
+    cols = {name: col[order] for name, col in cols.items()}
+    cols['part'] = parts[order]
+    sessions = np.array([session for _, session in db.partitions([station], sessions)] or [''])
+    cols['session'] = sessions[cols['part']]
+    cols['target_name'] = np.array(target_names or [''])[cols['target']]
+    return cols
+
+def match(ie, se, freq_tol_hz=10.0, drift_tol=0.25, time_tol_h=3.0, chunk=1_000_000):
+    '''
+    (ie_index, se_index) of every pair within the tolerances. Both inputs sorted by bary_freq.
+    '''
+    se_freq = se['bary_freq']
+    tol_mhz = freq_tol_hz / 1e6
+    lo_all = np.searchsorted(se_freq, ie['bary_freq'] - tol_mhz, side='left')
+    hi_all = np.searchsorted(se_freq, ie['bary_freq'] + tol_mhz, side='right')
+
+    out_ie, out_se = [], []
+    n_ie = len(ie['bary_freq'])
+    # chunk by candidate-pair count rather than hit count, so dense bands stay bounded
+    cum = np.cumsum(hi_all - lo_all)
+    strt = 0
+    while strt < n_ie:
+        done = cum[strt - 1] if strt else 0
+        end = max(strt + 1, int(np.searchsorted(cum, done + chunk, side='right')))
+        lo, hi = lo_all[strt:end], hi_all[strt:end]
+        sizes = hi - lo
+        i = np.repeat(np.arange(strt, end), sizes)
+        j = hitdb.ragged_arange(lo, sizes)
+        ok = ((np.abs(ie['drift'][i] - se['drift'][j]) <= drift_tol)
+              & (np.abs(ie['mjd'][i] - se['mjd'][j]) * 24 <= time_tol_h))
+        out_ie.append(i[ok]); out_se.append(j[ok])
+        strt = end
+
+    if not out_ie:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(out_ie), np.concatenate(out_se)
+
+def classify(n_ie, n_se, pair_ie, pair_se):
+    '''Boolean coincidence masks for each station's hits.'''
+    ie_coincident = np.zeros(n_ie, dtype=bool)
+    se_coincident = np.zeros(n_se, dtype=bool)
+    ie_coincident[pair_ie] = True
+    se_coincident[pair_se] = True
+    return ie_coincident, se_coincident
+
+def write_hits(path, cols, rows, station):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['station', 'session', 'target', 'mjd', 'freq_mhz', 'bary_freq_mhz', 'drift_hz_s', 'snr'])
+        for r in rows:
+            writer.writerow([station, cols['session'][r], cols['target_name'][r], f"{cols['mjd'][r]:.6f}",
+                             f"{cols['freq'][r]:.6f}", f"{cols['bary_freq'][r]:.6f}",
+                             f"{cols['drift'][r]:.4f}", f"{cols['snr'][r]:.2f}"])
+
+def write_pairs(path, ie, se, pair_ie, pair_se):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ie_session', 'ie_target', 'se_session', 'se_target', 'ie_bary_freq_mhz', 'df_hz',
+                         'ie_drift_hz_s', 'ddrift_hz_s', 'dt_h', 'ie_snr', 'se_snr'])
+        order = np.lexsort((pair_se, pair_ie))
+        for i, j in zip(pair_ie[order], pair_se[order]):
+            writer.writerow([ie['session'][i], ie['target_name'][i], se['session'][j], se['target_name'][j],
+                             f"{ie['bary_freq'][i]:.6f}", f"{(se['bary_freq'][j] - ie['bary_freq'][i]) * 1e6:+.2f}",
+                             f"{ie['drift'][i]:.4f}", f"{se['drift'][j] - ie['drift'][i]:+.4f}",
+                             f"{(se['mjd'][j] - ie['mjd'][i]) * 24:+.3f}", f"{ie['snr'][i]:.2f}", f"{se['snr'][j]:.2f}"])
+
+def get_args():
+    parser = argparse.ArgumentParser(description='IE613/SE607 coincidence of narrowband hits from the hit database.')
+    parser.add_argument('--db', type=str, default=hitdb.HITDB_PATH, help=f'Hit database (default: {hitdb.HITDB_PATH}).')
+    parser.add_argument('--start', type=str, default=None, help='First UTC date, YYYY-MM-DD (default: all hits).')
+    parser.add_argument('--days', type=float, default=7, help='Days from --start (default: 7).')
+    parser.add_argument('--session', action='append', default=None, help='Only these sessions (repeatable).')
+    parser.add_argument('--freq-tol-hz', type=float, default=10.0, help='Barycentric frequency tolerance in Hz (default: 10).')
+    parser.add_argument('--drift-tol', type=float, default=0.25, help='Drift-rate tolerance in Hz/s (default: 0.25).')
+    parser.add_argument('--time-tol-h', type=float, default=3.0, help='Time tolerance in hours (default: 3).')
+    parser.add_argument('-o', '--out-dir', type=str, default=None, help='Write coincident.csv, ie_only.csv and se_only.csv here.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    db = hitdb.HitDB(args.db)
+    mjd0 = date_to_mjd(args.start) if args.start else None
+    mjd1 = mjd0 + args.days if mjd0 is not None else None
+
+    strt = time.time()
+    ie = load_station(db, 'IE613', mjd0, mjd1, args.session)
+    se = load_station(db, 'SE607', mjd0, mjd1, args.session)
+    loaded = time.time()
+    pair_ie, pair_se = match(ie, se, args.freq_tol_hz, args.drift_tol, args.time_tol_h)
+    ie_co, se_co = classify(len(ie['mjd']), len(se['mjd']), pair_ie, pair_se)
+    print(f"IE613: {len(ie_co)} hit(s), SE607: {len(se_co)} hit(s) (loaded in {loaded - strt:.1f} s)")
+    print(f"{len(pair_ie)} coincident pair(s): {ie_co.sum()} IE613 and {se_co.sum()} SE607 hit(s) coincident; "
+          f"{(~ie_co).sum()} IE-only, {(~se_co).sum()} SE-only (matched in {time.time() - loaded:.1f} s)")
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        write_pairs(os.path.join(args.out_dir, 'coincident.csv'), ie, se, pair_ie, pair_se)
+        write_hits(os.path.join(args.out_dir, 'ie_only.csv'), ie, np.flatnonzero(~ie_co), 'IE613')
+        write_hits(os.path.join(args.out_dir, 'se_only.csv'), se, np.flatnonzero(~se_co), 'SE607')
+        print(f"Written to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
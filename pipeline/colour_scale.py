@@ -0,0 +1,90 @@
+"""
+Code Purpose: Bounded-memory colour scaling for LOFTS dynamic spectra.
+QuantileSketch is a log-bucketed histogram (after DDSketch, Masson et al. 2019) that is filled
+as data streams in, so vmin/vmax cost O(samples read) instead of a full sort of a copy.
+
+Error bound: every quantile returned is within a relative error of rel_acc of a true sample
+value of that rank, i.e. |estimate - x_q| <= rel_acc * |x_q| (default 1%). Values with
+|x| < min_value are counted as zero. Memory is fixed by the value range, not the sample count:
+at most log(max/min_value) / log(gamma) buckets per sign (~8000 for float32 at 1%).
+Samples are added in chunks of ADD_CHUNK, so the float64 temporaries of add() stay a few
+tens of MB whatever the size of the block passed in.
+"""
+
+import numpy as np
+
+ADD_CHUNK = 1 << 20  # samples per chunk in QuantileSketch.add
+
+class QuantileSketch:
+
+    def __init__(self, rel_acc=0.01, min_value=1e-30):
+        self.rel_acc = rel_acc
+        self.gamma = (1 + rel_acc) / (1 - rel_acc)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.count = 0
+        self.zeros = 0
+        # bucket counts for positive / negative magnitudes, indexed from an offset
+        self.pos = np.zeros(0, dtype=np.int64); self.pos_offset = 0
+        self.neg = np.zeros(0, dtype=np.int64); self.neg_offset = 0
+
+    def _add_store(self, store, offset, magnitudes):
+        idx = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        lo = min(idx.min(), offset) if store.size else idx.min()
+        hi = max(idx.max() + 1, offset + store.size)
+
+        if store.size == 0 or lo < offset or hi > offset + store.size:
+            grown = np.zeros(hi - lo, dtype=np.int64)
+            grown[offset - lo:offset - lo + store.size] = store
+            store, offset = grown, lo
+
+        store += np.bincount(idx - offset, minlength=store.size)
+        return store, offset
+
+    def add(self, values):
+        '''Adds a block of samples (any shape); non-finite values are ignored.'''
+        values = np.asarray(values)
+        # Chunk by leading rows so a strided view (e.g. a column slice) is only copied ADD_CHUNK at a time
+        rows = values.reshape(len(values), -1) if values.ndim > 1 else values.reshape(-1, 1)
+        step = max(1, ADD_CHUNK // max(1, rows.shape[1]))
+        for strt in range(0, len(rows), step):
+            self._add_chunk(rows[strt:strt + step].reshape(-1))
+
+    def _add_chunk(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+
+        small = np.abs(values) < self.min_value
+        self.zeros += int(small.sum())
+        self.count += values.size
+
+        pos = values[(values > 0) & ~small]
+        neg = -values[(values < 0) & ~small]
+        if pos.size:
+            self.pos, self.pos_offset = self._add_store(self.pos, self.pos_offset, pos)
+        if neg.size:
+            self.neg, self.neg_offset = self._add_store(self.neg, self.neg_offset, neg)
+
+    def percentile(self, q):
+        '''Percentile(s) q in [0, 100], same convention as np.percentile.'''
+        if self.count == 0:
+            raise ValueError("QuantileSketch is empty.")
+
+        # Bucket i covers (gamma^(i-1), gamma^i]; this representative is within rel_acc of both ends
+        pos_vals = 2 * self.gamma ** (np.arange(self.pos.size) + self.pos_offset) / (self.gamma + 1)
+        neg_vals = 2 * self.gamma ** (np.arange(self.neg.size) + self.neg_offset) / (self.gamma + 1)
+
+        values = np.concatenate([-neg_vals[::-1], [0.0], pos_vals])
+        counts = np.concatenate([self.neg[::-1], [self.zeros], self.pos])
+        cumulative = np.cumsum(counts)
+
+        rank = np.asarray(q, dtype=np.float64) / 100 * (self.count - 1)
+        return values[np.searchsorted(cumulative, rank, side='right')]
+
+def colour_limits(data, percentiles=(5, 95), rel_acc=0.01):
+    '''vmin, vmax for imshow from a single block of data.'''
+    sketch = QuantileSketch(rel_acc=rel_acc)
+    sketch.add(data)
+    return sketch.percentile(percentiles)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import time
+import pyramid_utils
+
+def get_args():
+    # --- Parser ---
+    parser = argparse.ArgumentParser(description='Build multi-resolution preview pyramid sidecars for LOFTS filterbanks.')
+    parser.add_argument('fils', type=str, nargs='+', help='Filterbank file(s) to build pyramids for.')
+    parser.add_argument('--max-dim', type=int, help='Largest axis length of the base level (default: 4096).', required = False, default=4096)
+    parser.add_argument('--min-dim', type=int, help='Stop halving once both axes are this small (default: 32).', required = False, default=32)
+    parser.add_argument('-m', '--mem-budget', type=float, help='Memory budget (MB) for each streamed chunk (default: 512).', required = False, default=512)
+    parser.add_argument('--force', action='store_true', help='Rebuild even if an up-to-date sidecar exists.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+
+    for fil_path in args.fils:
+        if not args.force and pyramid_utils.load_meta(fil_path) is not None:
+            print(f"Pyramid already exists for {os.path.basename(fil_path)}. Skipping.")
+            continue
+
+        strt = time.time()
+        meta = pyramid_utils.build_pyramid(fil_path, max_dim=args.max_dim, min_dim=args.min_dim,
+                                           mem_budget=args.mem_budget)
+        levels = ', '.join(f"{lvl['nt']}x{lvl['nf']}" for lvl in meta['levels'])
+        print(f"Built pyramid for {os.path.basename(fil_path)} in {time.time() - strt:.1f} s: {levels}")
+
+if __name__ == "__main__":
+    main()
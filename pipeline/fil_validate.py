@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Validate rawspec filterbank products against their own headers.
+For every product the exact payload size follows from nchans, nbits and nifs (whole spectra),
+and the spectrum count follows from the number of GUPPI RAW blocks rawspec was fed. That block
+count comes from --nblocks or --duration, or failing that from the three products of a target
+checked against each other, since a truncated product implies fewer blocks than its siblings.
+The cross-check alone cannot see products that are uniformly short because the extractor stopped
+early, so anything that deletes voltages must pass --nblocks or --duration. The tail is checked
+for zero padding with a few sampled 1 MiB reads rather than a full pass over the file.
+
+Verdicts are JSON (one object per target) and the exit status is 0 only if every target is ok:
+    fil_validate.py /datax2/projects/LOFTS/2024-07-23/B1508+55 [--nblocks N | --duration 4780] [--json]
+
+Problems: missing, bad_header, geometry, partial_spectrum, short, long, zero_tail.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import rawspec_utils
+import sigproc_utils
+
+PRODUCTS = list(rawspec_utils.FILGEN_PRODUCTS)
+WINDOW_BYTES = 1 << 20
+TAIL_FRACTION = 0.05
+
+def product_geometry(hdr):
+    '''(f, t) rawspec was run with, recovered from nchans and tsamp; None if they do not fit.'''
+    f, rem = divmod(hdr['nchans'], rawspec_utils.COARSE_CHANS)
+    if rem or f <= 0 or hdr.get('tsamp', 0) <= 0:
+        return None
+    t = round(hdr['tsamp'] / (f * rawspec_utils.SAMPLE_TIME))
+    if t <= 0 or abs(t * f * rawspec_utils.SAMPLE_TIME - hdr['tsamp']) > 1e-6 * hdr['tsamp']:
+        return None
+    return f, t
+
+def zero_tail_windows(fil_path, hdr, n_windows=8):
+    '''
+    Reads n_windows windows spread over the last TAIL_FRACTION of the payload, the final one
+    ending at EOF. Returns how many consecutive windows at the end are entirely zero.
+    '''
+    payload = hdr['file_size'] - hdr['header_size']
+    if payload <= 0:
+        return 0
+    window = min(WINDOW_BYTES, payload)
+    tail_strt = hdr['file_size'] - max(window, int(payload * TAIL_FRACTION))
+    span = hdr['file_size'] - window - tail_strt
+    offsets = [tail_strt + span * i // max(1, n_windows - 1) for i in range(n_windows)]
+
+    zero_run = 0
+    with open(fil_path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            buf = f.read(window)
+            zero_run = zero_run + 1 if not buf.strip(b'\0') else 0
+    return zero_run
+
+def read_product(fil_path):
+    '''Header plus structural checks that need no block count.'''
+    result = {'path': fil_path, 'problems': []}
+    if not os.path.isfile(fil_path):
+        result['problems'].append('missing')
+        return result, None
+    try:
+        hdr = sigproc_utils.read_header(fil_path)
+    except (ValueError, OSError, KeyError) as e:
+        result['problems'].append('bad_header')
+        result['error'] = str(e)
+        return result, None
+
+    bps = sigproc_utils.bytes_per_spectrum(hdr)
+    result.update({'size': hdr['file_size'], 'header_size': hdr['header_size'], 'nchans': hdr['nchans'],
+                   'nbits': hdr['nbits'], 'nifs': hdr['nifs'], 'nspectra': hdr['nspectra']})
+    if (hdr['file_size'] - hdr['header_size']) % bps:
+        result['problems'].append('partial_spectrum')
+
+    geometry = product_geometry(hdr)
+    if geometry is None:
+        result['problems'].append('geometry')
+    else:
+        result['f'], result['t'] = geometry
+    return result, hdr
+
+def check_product(result, hdr, nblocks, tolerance=1, n_windows=8):
+    '''Adds expected size, short/long and zero-tail checks to a read_product() result.'''
+    if hdr is None:
+        return result
+    if nblocks is not None and 'f' in result:
+        f, t = result['f'], result['t']
+        expected = rawspec_utils.nspectra_from_blocks(f, t, nblocks)
+        lo = rawspec_utils.nspectra_from_blocks(f, t, max(0, nblocks - tolerance))
+        hi = rawspec_utils.nspectra_from_blocks(f, t, nblocks + tolerance)
+        result['expected_nspectra'] = expected
+        result['expected_size'] = hdr['header_size'] + expected * sigproc_utils.bytes_per_spectrum(hdr)
+        if hdr['nspectra'] < lo:
+            result['problems'].append('short')
+        elif hdr['nspectra'] > hi:
+            result['problems'].append('long')
+
+    result['zero_tail_windows'] = zero_tail_windows(result['path'], hdr, n_windows)
+    if result['zero_tail_windows']:
+        result['problems'].append('zero_tail')
+    return result
+
+def validate_target(output_dir, target=None, duration=None, tolerance=1, n_windows=8, pool=None, nblocks=None):
+    '''
+    Verdict for the three products of one target dir. The block count is nblocks if given, else
+    the voltage duration's, otherwise that of the product that implies the most blocks.
+    '''
+    target = target or os.path.basename(output_dir.rstrip('/'))
+    paths = {p: os.path.join(output_dir, f"{target}.rawspec.{p}.fil") for p in PRODUCTS}
+    mapper = pool.map if pool else map
+    products = dict(zip(paths, mapper(read_product, paths.values())))
+
+    if nblocks is not None:
+        source = 'nblocks'
+    elif duration is not None:
+        nblocks, source = rawspec_utils.n_blocks(duration), 'duration'
+    else:
+        implied = [rawspec_utils.blocks_for_nspectra(r['f'], r['t'], r['nspectra'])[0]
+                   for r, hdr in products.values() if hdr is not None and 'f' in r]
+        nblocks, source = (max(implied), 'products') if implied else (None, None)
+
+    checked = list(mapper(lambda item: check_product(*item, nblocks, tolerance, n_windows), products.values()))
+    verdict = {'output_dir': output_dir, 'target': target, 'nblocks': nblocks, 'nblocks_from': source,
+               'products': dict(zip(paths, checked))}
+    verdict['problems'] = sorted({p for r in checked for p in r['problems']})
+    verdict['verdict'] = 'ok' if not verdict['problems'] else 'bad'
+    return verdict
+
+def validate_dirs(output_dirs, duration=None, tolerance=1, n_windows=8, workers=8, nblocks=None):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # products are read on the pool; targets are walked in order so output is stable
+        return [validate_target(d, duration=duration, tolerance=tolerance, n_windows=n_windows, pool=pool,
+                                nblocks=nblocks)
+                for d in output_dirs]
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Validate rawspec products against their headers.')
+    parser.add_argument('dirs', type=str, nargs='+', help='Target output directories (<dir>/<target>.rawspec.000N.fil).')
+    parser.add_argument('-d', '--duration', type=float, help='Voltage seconds fed to rawspec (default: infer from the products).', required=False, default=None)
+    parser.add_argument('-n', '--nblocks', type=int, help='GUPPI RAW blocks fed to rawspec, e.g. from "ledger.py blocks" (overrides --duration).', required=False, default=None)
+    parser.add_argument('--tolerance', type=int, help='RAW blocks of slack on the expected length (default: 1).', required=False, default=1)
+    parser.add_argument('--windows', type=int, help='Sampled windows in the tail check (default: 8).', required=False, default=8)
+    parser.add_argument('-w', '--workers', type=int, help='Parallel file readers (default: 8).', required=False, default=8)
+    parser.add_argument('--json', action='store_true', help='Print one JSON verdict per line instead of a table.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    verdicts = validate_dirs([os.path.abspath(d) for d in args.dirs], args.duration, args.tolerance,
+                             args.windows, args.workers, args.nblocks)
+    for v in verdicts:
+        if args.json:
+            print(json.dumps(v))
+            continue
+        print(f"{v['target']:<30} {v['verdict']:<4} blocks={v['nblocks']} ({v['nblocks_from']}) {' '.join(v['problems'])}")
+        for p, r in v['products'].items():
+            print(f"    {p}: nspectra={r.get('nspectra')} expected={r.get('expected_nspectra')} "
+                  f"size={r.get('size')} expected_size={r.get('expected_size')} {' '.join(r['problems'])}")
+    sys.exit(0 if all(v['verdict'] == 'ok' for v in verdicts) else 1)
+
+if __name__ == "__main__":
+    main()
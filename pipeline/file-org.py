@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Organise all filterbanks generated by LOFTS based on date, into
+/datax2/projects/LOFTS/<YYYY-MM-DD>/<source>/ (the date is the UTC date of tstart, the
+source is the filename up to the first '.').
+
+Headers are parsed in-process with sigproc_utils (only the header bytes are read) on a thread
+pool. Every move is planned before any file is touched, and the plan is written to a JSON-lines
+journal. Moves are then made as atomic same-filesystem link+unlink pairs, which never overwrite
+an existing file; across filesystems the file is copied to <dst>.partial and renamed into place.
+Each finished move is journalled, so rerunning after an interruption completes the pending moves
+before planning new ones.
+
+    file-org.py <directory_path> [-w 16] [--dry-run] [--journal PATH]
+"""
+
+import argparse
+import errno
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import sigproc_utils
+
+PROJECT_DIR = '/datax2/projects/LOFTS'
+JOURNAL_PATH = os.path.join(PROJECT_DIR, 'logs', 'file-org.jsonl')
+MJD_EPOCH = datetime(1858, 11, 17)
+
+def mjd_to_date(mjd):
+    return (MJD_EPOCH + timedelta(days=mjd)).strftime('%Y-%m-%d')
+
+def find_filterbanks(path):
+    fils = []
+    for root, dirs, files in os.walk(os.path.abspath(path)):
+        fils += [os.path.join(root, name) for name in files if name.endswith('.fil')]
+    return sorted(fils)
+
+# ===== Journal =====
+class Journal:
+    '''Append-only JSON lines: {"op": "plan"|"done"|"skip", "src", "dst", ...}.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def pending(self):
+        '''Planned moves without a later done/skip record, in plan order.'''
+        if not os.path.isfile(self.path):
+            return []
+        moves = {}
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line of an interrupted run
+                if rec.get('op') == 'plan':
+                    moves[rec['src']] = rec
+                elif rec.get('op') in ('done', 'skip'):
+                    moves.pop(rec['src'], None)
+        return list(moves.values())
+
+    def write(self, op, sync=False, **rec):
+        if self.f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.f = open(self.path, 'a')
+        self.f.write(json.dumps({'op': op, 'time': time.time(), **rec}) + '\n')
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+# ===== Planning =====
+def destination(fil_path, project_path):
+    '''(destination path, date) for one filterbank, from its header.'''
+    hdr = sigproc_utils.read_header(fil_path)
+    if 'tstart' not in hdr:
+        raise ValueError(f"No tstart in the header of {fil_path}")
+    date = mjd_to_date(hdr['tstart'])
+    name = os.path.basename(fil_path)
+    return os.path.join(project_path, date, name.split('.')[0], name), date
+
+def plan_moves(fil_paths, project_path, workers=16):
+    '''
+    Returns (moves, skipped). moves: [{'src', 'dst', 'date'}]. skipped: [(src, reason)] for
+    unreadable headers, files already at their destination and destinations claimed twice.
+    '''
+    def work(path):
+        try:
+            return path, destination(path, project_path), None
+        except (OSError, ValueError, KeyError, UnicodeDecodeError) as e:
+            return path, None, f"bad header ({e})"
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(work, fil_paths))
+
+    moves, skipped, claimed = [], [], set()
+    for src, dest, error in results:
+        if error:
+            skipped.append((src, error))
+            continue
+        dst, date = dest
+        if os.path.abspath(src) == os.path.abspath(dst):
+            continue  # already organised
+        if os.path.lexists(dst):
+            skipped.append((src, f"file already exists: {dst}"))
+        elif dst in claimed:
+            skipped.append((src, f"another file is also moving to {dst}"))
+        else:
+            claimed.add(dst)
+            moves.append({'src': src, 'dst': dst, 'date': date})
+    return moves, skipped
+
+# ===== Moving =====
+def same_filesystem(src, dst_dir):
+    return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+
+def move(src, dst):
+    '''
+    Moves src to dst without ever overwriting dst. Returns 'moved', 'copied' or 'already'
+    (an interrupted link+unlink left both names on the same inode).
+    '''
+    dst_dir = os.path.dirname(dst)
+    os.makedirs(dst_dir, exist_ok=True)
+
+    if os.path.lexists(dst):
+        if os.path.exists(src) and os.path.samefile(src, dst):
+            os.unlink(src)
+            return 'already'
+        raise FileExistsError(errno.EEXIST, "Destination exists", dst)
+
+    if same_filesystem(src, dst_dir):
+        try:
+            os.link(src, dst)  # fails if dst appeared meanwhile
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+            os.rename(src, dst)  # filesystem without hard links
+            return 'moved'
+        os.unlink(src)
+        return 'moved'
+
+    partial = dst + '.partial'
+    shutil.copy2(src, partial)
+    if os.path.lexists(dst):
+        os.unlink(partial)
+        raise FileExistsError(errno.EEXIST, "Destination exists", dst)
+    os.rename(partial, dst)
+    os.unlink(src)
+    return 'copied'
+
+def run_moves(moves, journal, dry_run=False):
+    '''Executes moves in order, journalling each. Returns the number of files moved.'''
+    n_moved = 0
+    for rec in moves:
+        src, dst = rec['src'], rec['dst']
+        if dry_run:
+            print(f"Would move: {src} -> {os.path.dirname(dst)}")
+            continue
+        if not os.path.exists(src) and not os.path.exists(dst):
+            print(f"Source disappeared: {src}. Skipping.")
+            journal.write('skip', src=src, dst=dst, reason='source missing')
+            continue
+        if not os.path.exists(src):
+            journal.write('done', src=src, dst=dst, how='found at destination')
+            n_moved += 1
+            continue
+        try:
+            how = move(src, dst)
+        except FileExistsError:
+            print(f"File already exists: {dst}. Skipping.")
+            journal.write('skip', src=src, dst=dst, reason='destination exists')
+            continue
+        except OSError as e:
+            print(f"Failed to move {src}: {e}", file=sys.stderr)
+            continue  # stays pending for the next run
+        journal.write('done', src=src, dst=dst, how=how)
+        print(f"Moved: {src} -> {os.path.dirname(dst)}")
+        n_moved += 1
+    return n_moved
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Organise LOFTS filterbanks into <project>/<date>/<source>/ by header date.')
+    parser.add_argument('path', help='Directory to search (recursively) for .fil files.')
+    parser.add_argument('--project', type=str, default=PROJECT_DIR, help=f'Project directory (default: {PROJECT_DIR}).')
+    parser.add_argument('-w', '--workers', type=int, default=16, help='Header-parsing threads (default: 16).')
+    parser.add_argument('--journal', type=str, default=JOURNAL_PATH, help=f'Move journal (default: {JOURNAL_PATH}).')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Print the plan without moving anything.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    journal = Journal(args.journal)
+
+    try:
+        n_moved = 0
+        pending = journal.pending()
+        if pending:
+            print(f"Resuming {len(pending)} pending move(s) from {args.journal}")
+            n_moved += run_moves(pending, journal, args.dry_run)
+
+        fil_paths = find_filterbanks(args.path)
+        print(f"Number of filterbanks found: {len(fil_paths)}")
+        moves, skipped = plan_moves(fil_paths, args.project, args.workers)
+        for src, reason in skipped:
+            print(f"{reason}. Skipping {src}")
+
+        if not args.dry_run:
+            for n, rec in enumerate(moves):
+                journal.write('plan', sync=n == len(moves) - 1, **rec)
+        n_moved += run_moves(moves, journal, args.dry_run)
+    finally:
+        journal.close()
+
+    if args.dry_run:
+        print(f"{len(moves)} file(s) would be organised, {len(skipped)} skipped.")
+    else:
+        print(f"{n_moved} files organized successfully! ({len(skipped)} skipped)")
+
+if __name__ == "__main__":
+    main()
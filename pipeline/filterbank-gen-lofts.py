@@ -0,0 +1,749 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Filterbank generation for LOFTS sessions, run as a per-scan DAG.
+Each scan goes through extract -> rawspec -> {pyramid -> plot, cleanup}. Every stage has its
+own worker pool, so scan N+1 can run lofar_udp_extractor while scan N is in rawspec. The
+skip-if-output-exists checks, --dry-run and --skip behave as in the original bash loop.
+Scans are only admitted when the predicted bytes they will write keep free space on the
+output filesystem above a watermark; queued scans start as cleanup frees space.
+"""
+
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import fil_validate
+import guppi_raw
+import rawspec_utils
+import telemetry
+from ledger import LEDGER_PATH, Ledger
+
+PROJECT_DIR = '/datax2/projects/LOFTS'
+LOG_DIR = os.path.join(PROJECT_DIR, 'logs', 'filgen')
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+UDP_IMAGE = '/datax2/obs/singularity/lofar-upm_latest.simg'
+
+STATIONS = {'IE': ('1613', 'IE613_16130'),
+            'SE': ('1607', 'SE607_16070')}
+
+# stage: (dependencies, default worker count)
+STAGES = {'extract': ([], 1),
+          'rawspec': (['extract'], 1),
+          'pyramid': (['rawspec'], 2),
+          'plot':    (['pyramid'], 1),
+          'cleanup': (['rawspec'], 2)}
+
+PRODUCTS = ['0000', '0001', '0002']
+PYRAMID_PRODUCTS = ['0001', '0002']
+EXTRACT_SLACK = 30  # s of voltages the extractor may fall short of the .zst span
+
+class StageError(Exception):
+    pass
+
+# rusage of the commands run by the stage executing on this thread, for telemetry
+_stage_usage = threading.local()
+
+def get_args():
+    # --- Parser ---
+    parser = argparse.ArgumentParser(description='LOFTS filterbank generation (per-scan DAG).')
+    parser.add_argument('path', type=str, help='Session directory or a single scan_* directory.')
+    parser.add_argument('station', type=str, choices=['IE', 'SE'], help='Station prefix.')
+    parser.add_argument('-dry', '--dry-run', action='store_true', help='Print commands without executing.')
+    parser.add_argument('--skip', '--skip-target', action='append', default=[], metavar='LIST',
+                        help='Comma-separated targets (or glob patterns) to skip. Can be given multiple times.')
+    parser.add_argument('--watermark', type=float, default=200, help='Free space (GB) that must remain after admitting a scan (default: 200).')
+    parser.add_argument('--scan-duration', type=float, default=4800, help='Voltage duration (s) used to predict output sizes (default: 4800).')
+    parser.add_argument('--admission-poll', type=float, default=60, help='Seconds between free-space checks while scans are queued (default: 60).')
+    parser.add_argument('--stream-raw', action='store_true', help='EXPERIMENTAL, not verified with rawspec: pipe extractor output into rawspec through raw_stream.py instead of writing ~1.5 TB of .raw per scan.')
+    parser.add_argument('--ring-blocks', type=int, default=4, help='GUPPI blocks (~108 MB each) buffered by the stream broker (default: 4).')
+    parser.add_argument('--ledger', type=str, default=LEDGER_PATH, help=f'Processing state ledger (default: {LEDGER_PATH}).')
+    for stage, (_, workers) in STAGES.items():
+        parser.add_argument(f'--{stage}-workers', type=int, default=workers,
+                            help=f'Concurrent {stage} jobs (default: {workers}).')
+    return parser.parse_args()
+
+# ===== Logging =====
+class Logger:
+    '''Thread-safe tee of stdout/stderr lines into the filgen .out/.err logs.'''
+
+    def __init__(self, log_file, error_file, dry_run=False):
+        self.lock = threading.Lock()
+        self.out = open(log_file, 'a') if not dry_run else None
+        self.err = open(error_file, 'a') if not dry_run else None
+        self.log_file, self.error_file = log_file, error_file
+
+    def __call__(self, msg, scan=None, error=False):
+        line = f"[{scan['target']}] {msg}" if scan else msg
+        with self.lock:
+            print(line, file=sys.stderr if error else sys.stdout, flush=True)
+            for f in ([self.out, self.err] if error else [self.out]):
+                if f:
+                    f.write(line + '\n'); f.flush()
+
+# ===== Helpers =====
+def run(cmd, ctx, scan=None):
+    '''Runs a command (or prints it in dry-run), streaming its output into the log.'''
+    log = ctx['log']
+    if ctx['dry_run']:
+        log('[DRY-RUN] ' + ' '.join(cmd), scan)
+        return
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in proc.stdout:
+        log(line.rstrip(), scan)
+    exit_status, usage = telemetry.wait_usage(proc)
+    if getattr(_stage_usage, 'total', None) is not None:
+        telemetry.merge_usage(_stage_usage.total, usage)
+    if exit_status != 0:
+        raise StageError(f"{cmd[0]} exited with status {exit_status}")
+
+def extractor_cmd(scan, jump_time, zst_scan_path, metadata, output):
+    return ['singularity', 'exec', '--bind', '/datax,/datax2', UDP_IMAGE,
+            'lofar_udp_extractor', '-p', '30', '-t', jump_time, '-M', 'GUPPI',
+            '-S', '1', '-b', '0,412',
+            '-i', zst_scan_path,
+            '-o', output,
+            '-m', '4096', '-I', metadata]
+
+def rawspec_cmd(scan):
+    return ['rawspec', '-f', '65536,8,64', '-t', '54,16,3072', '-p', '1,1,4',
+            os.path.join(scan['output_dir'], scan['target'])]
+
+def set_permissions(ctx, scan, pattern=None):
+    if pattern:
+        paths = glob.glob(os.path.join(scan['output_dir'], pattern))
+        if paths:
+            try:
+                run(['chmod', 'o+r'] + paths, ctx, scan)
+            except StageError:
+                pass
+    run(['chown', '-R', '1000:1000', scan['output_dir']], ctx, scan)
+
+def is_done(scan, ctx, state, zst_scan_path=None):
+    '''
+    Asks the state ledger whether a state was reached and its outputs are still intact. If the
+    ledger has no record of the state (e.g. the scan predates the ledger), the outputs on disk
+    are checked instead and recorded when they pass, so the next check is a lookup.
+    '''
+    ledger = ctx['ledger']
+    if ledger is not None and ledger.state(scan['output_dir'], state) is not None:
+        return ledger.is_done(scan['output_dir'], state)
+    return backfill_state(scan, ctx, state, zst_scan_path)
+
+def backfill_state(scan, ctx, state, zst_scan_path=None):
+    '''On-disk is_done() for a state the ledger has no record of; marks the state if it holds.'''
+    out = scan['output_dir']
+    if state == 'channelised':
+        paths = [product_path(scan, p) for p in PRODUCTS]
+        if not all(os.path.isfile(path) for path in paths):
+            return False
+        verdict = fil_validate.validate_target(out, scan['target'], nblocks=raw_blocks(scan, ctx))
+        if verdict['verdict'] != 'ok':
+            ctx['log'](f"Existing rawspec products failed validation: {' '.join(verdict['problems'])}", scan)
+            return False
+        kwargs = {'detail': 'backfill'}
+    elif state == 'extracted':
+        paths = sorted(glob.glob(os.path.join(out, f"{scan['target']}*.raw")))
+        if not paths or zst_scan_path is None:
+            # without the .zst span the length cannot be checked, so this is only an estimate
+            return bool(paths)
+        try:
+            detail = extracted_detail(scan, ctx, sum(guppi_raw.count_blocks(p) for p in paths), zst_scan_path)
+        except StageError as e:
+            ctx['log'](f"Existing .raw files are incomplete, re-extracting: {e}", scan)
+            return False
+        kwargs = {'detail': detail + ' backfill', 'checksum': False}
+    elif state == 'plotted':
+        paths = sorted(glob.glob(os.path.join(out, '*.png')))
+        if not paths:
+            return False
+        kwargs = {'detail': 'backfill', 'checksum': False}
+    else:
+        return False
+
+    ctx['log'](f"Ledger has no '{state}' record; outputs on disk pass, recording them.", scan)
+    mark(scan, ctx, state, paths, **kwargs)
+    return True
+
+def mark(scan, ctx, state, paths=(), **kwargs):
+    if ctx['dry_run']:
+        ctx['log'](f"[DRY-RUN] ledger: {state}", scan)
+        return
+    ctx['ledger'].mark(scan['output_dir'], state, paths, session=ctx['session'], target=scan['target'],
+                       station=ctx['station'], **kwargs)
+
+def product_path(scan, product):
+    return os.path.join(scan['output_dir'], f"{scan['target']}.rawspec.{product}.fil")
+
+def should_skip_target(target, patterns):
+    # match full scan id OR base name; support globs
+    base_name = target.split('_', 1)[-1]
+    return any(fnmatch.fnmatchcase(target, pat) or fnmatch.fnmatchcase(base_name, pat) for pat in patterns)
+
+def find_first(directory, pattern, dirs=False):
+    if not directory or not os.path.isdir(directory):
+        return ''
+    for entry in sorted(os.listdir(directory)):
+        full = os.path.join(directory, entry)
+        if fnmatch.fnmatchcase(entry, pattern) and (os.path.isdir(full) if dirs else os.path.isfile(full)):
+            return full
+    return ''
+
+def discover_folders(path):
+    # Accept either a parent session dir or a single scan_* dir
+    if os.path.isdir(path) and os.path.basename(path.rstrip('/')).startswith('scan_'):
+        return [path]
+    folders = []
+    for root, dirs, _ in os.walk(path):
+        folders += [os.path.join(root, d) for d in dirs
+                    if fnmatch.fnmatchcase(d, 'scan_*') or fnmatch.fnmatchcase(d, '*scan_B*')]
+    return sorted(folders)
+
+def session_date(path, log):
+    # Extract YYYY-MM-DD from 'sidYYYYMMDD' anywhere in the path; fallback to today if missing
+    match = re.search(r'sid([0-9]{8})T', path)
+    if match:
+        sid = match.group(1)
+        return f"{sid[:4]}-{sid[4:6]}-{sid[6:]}"
+    date = datetime.now().strftime('%Y-%m-%d')
+    log(f"WARNING: Could not extract sidYYYYMMDD from path; using today: {date}")
+    return date
+
+def log_zst_path(log_file_scan, station_code, port_prefix):
+    # Path on line 4 of the scan log, with the port number templated out
+    with open(log_file_scan) as f:
+        lines = f.read().splitlines()
+    fields = lines[3].split() if len(lines) > 3 else []
+    zst_raw = fields[1] if len(fields) > 1 else ''
+    return re.sub(rf'(udp_{station_code}_{port_prefix})([0-9]{{1,2}})', r'\1[[port]]', zst_raw, count=1)
+
+def locate_inputs(scan, ctx):
+    '''Finds the metadata header and the [[port]] templated .zst path for the extractor.'''
+    log = ctx['log']
+    folder = scan['folder']
+    station_code, port_prefix = ctx['station_code'], ctx['port_prefix']
+
+    log_file_scan = find_first(folder, '*.log')
+    bfs_dir = find_first(folder, f'{station_code}_*_bfs', dirs=True)
+
+    # Clean up any double commas in path
+    if ',,' in bfs_dir:
+        if not ctx['dry_run']:
+            os.rename(bfs_dir, bfs_dir.replace(',,', ''))
+        bfs_dir = bfs_dir.replace(',,', '')
+
+    # 1) Prefer *_bfs.h, 2) any .h in BFS dir, 3) any .h in the scan folder
+    metadata = find_first(bfs_dir, '*_bfs.h') or find_first(bfs_dir, '*.h') or find_first(folder, '*.h')
+    if not metadata:
+        raise StageError(f"FATAL: No header (.h) file found (looked in {bfs_dir} and {folder}). Cannot run extractor.")
+    log(f"Metadata header: {metadata}", scan)
+
+    if bfs_dir:
+        udp_example = find_first(bfs_dir, f'udp_{station_code}_{port_prefix}*.blc*.zst')
+        if udp_example:
+            udp_template = re.sub(rf'(udp_{station_code}_{port_prefix})([0-2]?[0-9])', r'\1[[port]]',
+                                  os.path.basename(udp_example), count=1)
+            zst_scan_path = os.path.join(bfs_dir, udp_template)
+        elif log_file_scan:
+            zst_scan_path = log_zst_path(log_file_scan, station_code, port_prefix)
+            log("WARNING: Using log-derived path (no UDP .zst files found in *_bfs).", scan)
+        else:
+            raise StageError("FATAL: No UDP .zst files in *_bfs and no .log fallback. Skipping folder.")
+    elif log_file_scan:
+        zst_scan_path = log_zst_path(log_file_scan, station_code, port_prefix)
+        log("WARNING: Using log-derived path (no *_bfs directory found).", scan)
+    else:
+        raise StageError("FATAL: No *_bfs directory and no .log to derive .zst path. Skipping folder.")
+
+    log(f"Scan path with ports: {zst_scan_path}", scan)
+    return metadata, zst_scan_path
+
+# ===== Stages =====
+def stage_extract(scan, ctx):
+    out = scan['output_dir']
+    if is_done(scan, ctx, 'channelised'):
+        ctx['log'](f"Filterbank files already exist in {out}. Skipping lofar_udp_extractor...", scan)
+        return
+
+    metadata, zst_scan_path = locate_inputs(scan, ctx)
+
+    # --- Grabbing start time for skip ---
+    zst_start = zst_scan_path[-27:-8]
+    jump_time = (datetime.strptime(zst_start, '%Y-%m-%dT%H:%M:%S') + timedelta(seconds=20)).strftime('%Y-%m-%dT%H:%M:%S')
+
+    if is_done(scan, ctx, 'extracted', zst_scan_path):
+        ctx['log'](f"Raw files already exist in {out}. Skipping lofar_udp_extractor...", scan)
+        return
+
+    if ctx['stream_raw']:
+        stream_extract_rawspec(scan, ctx, extractor_cmd(scan, jump_time, zst_scan_path, metadata, '{fifo}'),
+                               zst_scan_path)
+        return
+
+    ctx['log']("Running lofar_udp_extractor...", scan)
+    run(extractor_cmd(scan, jump_time, zst_scan_path, metadata,
+                      os.path.join(out, f"{scan['target']}.[[iter]].raw")), ctx, scan)
+
+    # .raw files are intermediates, so record sizes only
+    raws = sorted(glob.glob(os.path.join(out, f"{scan['target']}*.raw")))
+    detail = None
+    if not ctx['dry_run']:
+        detail = extracted_detail(scan, ctx, sum(guppi_raw.count_blocks(p) for p in raws), zst_scan_path)
+    mark(scan, ctx, 'extracted', raws, checksum=False, detail=detail)
+
+    # Ensure ownership after extractor
+    set_permissions(ctx, scan)
+
+def stage_rawspec(scan, ctx):
+    if is_done(scan, ctx, 'channelised'):
+        ctx['log'](f"Filterbank files 0000.fil, 0001.fil, and 0002.fil exist in {scan['output_dir']}. Skipping rawspec...", scan)
+        return
+
+    ctx['log']("Running rawspec...", scan)
+    run(rawspec_cmd(scan), ctx, scan)
+    validate_products(scan, ctx)
+    mark(scan, ctx, 'channelised', [product_path(scan, p) for p in PRODUCTS])
+    set_permissions(ctx, scan, '*.fil')
+
+def release_fifo(fifo, flags, peer):
+    '''
+    Briefly opens the far end of a pipe, repeatedly, until the peer thread finishes, so a
+    process left blocked in open() or write() on it sees EOF or EPIPE instead of hanging.
+    '''
+    while peer.is_alive():
+        try:
+            fd = os.open(fifo, flags | os.O_NONBLOCK)
+        except OSError:
+            # no reader has opened the pipe yet
+            peer.join(timeout=0.1)
+            continue
+        peer.join(timeout=0.2)
+        os.close(fd)
+
+def zst_seconds(zst_scan_path):
+    '''
+    Seconds of voltages the extractor should produce: newest .zst mtime across the ports, minus
+    the start time in the file name and SKIP_START. None if no .zst is found or the span is implausible.
+    '''
+    paths = glob.glob(zst_scan_path.replace('[[port]]', '*'))
+    if not paths:
+        return None
+    strt = datetime.strptime(zst_scan_path[-27:-8], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    seconds = max(os.path.getmtime(p) for p in paths) - strt - rawspec_utils.SKIP_START
+    return seconds if 0 < seconds < 2 * rawspec_utils.SCAN_DURATION else None
+
+def extracted_detail(scan, ctx, nblocks, zst_scan_path):
+    '''
+    Ledger detail "blocks=N expected=M" for an extraction. Fails the stage if the extractor wrote
+    fewer blocks than the .zst span implies, as products made from them would validate as complete.
+    '''
+    seconds = zst_seconds(zst_scan_path)
+    if seconds is None:
+        ctx['log']("WARNING: Could not time the .zst span, so the extracted length is unchecked and "
+                   "voltage-cleaner.sh will not clean this scan without --duration.", scan, error=True)
+        return f"blocks={nblocks}"
+    expected = rawspec_utils.n_blocks(seconds)
+    if nblocks < expected - rawspec_utils.n_blocks(EXTRACT_SLACK):
+        raise StageError(f"lofar_udp_extractor stopped early: {nblocks} of ~{expected} RAW blocks "
+                         f"({seconds:.0f} s of .zst)")
+    ctx['log'](f"Extracted {nblocks} RAW blocks (~{expected} expected from the .zst span).", scan)
+    return f"blocks={nblocks} expected={expected}"
+
+def stream_extract_rawspec(scan, ctx, extract_cmd, zst_scan_path):
+    '''
+    Experimental: extractor -> raw_stream.py broker -> rawspec through two named pipes, so no
+    .raw file is written. Not verified against rawspec, which fails with ESPIPE if it seeks.
+    The extractor and broker run on side threads; rawspec runs on the stage thread.
+    Marks the scan channelised once all three succeed.
+    '''
+    stem = os.path.join(scan['output_dir'], scan['target'])
+    extract_fifo, rawspec_fifo, stats_path = f"{stem}.extract.fifo", f"{stem}.0000.raw", f"{stem}.stream.json"
+    extract_cmd = [arg.replace('{fifo}', extract_fifo) for arg in extract_cmd]
+    broker_cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'raw_stream.py'), 'broker',
+                  extract_fifo, rawspec_fifo, '--ring-blocks', str(ctx['ring_blocks']), '--stats', stats_path]
+
+    if ctx['dry_run']:
+        ctx['log'](f"[DRY-RUN] mkfifo {extract_fifo} {rawspec_fifo}", scan)
+        for cmd in (broker_cmd, extract_cmd, rawspec_cmd(scan)):
+            run(cmd, ctx, scan)
+        return
+
+    for fifo in (extract_fifo, rawspec_fifo):
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+
+    errors, usages = [], []
+    def run_side(cmd):
+        _stage_usage.total = {}
+        try:
+            run(cmd, ctx, scan)
+        except StageError as e:
+            errors.append(e)
+            if cmd is extract_cmd:
+                # the broker may still be waiting for a writer: give it EOF
+                release_fifo(extract_fifo, os.O_WRONLY, broker)
+        finally:
+            usages.append(_stage_usage.total)
+
+    ctx['log']("Streaming lofar_udp_extractor into rawspec...", scan)
+    broker = threading.Thread(target=run_side, args=(broker_cmd,))
+    extractor = threading.Thread(target=run_side, args=(extract_cmd,))
+    broker.start()
+    extractor.start()
+    try:
+        run(rawspec_cmd(scan), ctx, scan)
+    except StageError:
+        # the broker may still be waiting for a reader: give it EPIPE
+        release_fifo(rawspec_fifo, os.O_RDONLY, broker)
+        ctx['log']("rawspec failed reading from a pipe; if it reported 'Illegal seek' it cannot stream, "
+                   "so rerun this scan without --stream-raw.", scan, error=True)
+        raise
+    finally:
+        for t in (broker, extractor):
+            t.join()
+        for usage in usages:
+            if usage and getattr(_stage_usage, 'total', None) is not None:
+                telemetry.merge_usage(_stage_usage.total, usage)
+        for fifo in (extract_fifo, rawspec_fifo):
+            os.remove(fifo)
+    if errors:
+        raise errors[0]
+
+    with open(stats_path) as f:
+        nblocks = json.load(f)['blocks']
+    os.remove(stats_path)
+    # nothing is on disk to re-run rawspec from, so 'extracted' is only recorded alongside 'channelised'
+    detail = extracted_detail(scan, ctx, nblocks, zst_scan_path)
+    validate_products(scan, ctx, nblocks)
+    mark(scan, ctx, 'extracted', detail=detail + ' stream')
+    mark(scan, ctx, 'channelised', [product_path(scan, p) for p in PRODUCTS], detail='stream')
+    set_permissions(ctx, scan, '*.fil')
+
+def raw_blocks(scan, ctx):
+    '''RAW blocks rawspec was fed: from the ledger's extraction record, else the .raw files on disk.'''
+    ledger = ctx['ledger']
+    blocks = ledger.extracted_blocks(scan['output_dir']).get('blocks') if ledger is not None else None
+    if blocks is None:
+        raws = glob.glob(os.path.join(scan['output_dir'], f"{scan['target']}*.raw"))
+        blocks = sum(guppi_raw.count_blocks(p) for p in raws if os.path.isfile(p)) or None
+    return blocks
+
+def validate_products(scan, ctx, nblocks=None):
+    '''
+    Header-derived size and zero-tail checks against the RAW blocks rawspec was fed; a scan is
+    only channelised if all three pass, and never when that block count is unknown.
+    '''
+    if ctx['dry_run']:
+        return
+    nblocks = nblocks or raw_blocks(scan, ctx)
+    if nblocks is None:
+        raise StageError("RAW block count unknown (no extraction record or .raw files), so the products cannot be validated.")
+    verdict = fil_validate.validate_target(scan['output_dir'], scan['target'], nblocks=nblocks)
+    if verdict['verdict'] != 'ok':
+        raise StageError(f"rawspec products failed validation: {' '.join(verdict['problems'])}")
+    ctx['log'](f"Validated rawspec products ({verdict['nblocks']} RAW blocks).", scan)
+
+def stage_pyramid(scan, ctx):
+    if not is_done(scan, ctx, 'channelised') and not ctx['dry_run']:
+        return
+    # 0000 is skipped: its plot needs more frequency pixels than any level holds, so it always reads raw samples
+    ctx['log']("Building preview pyramids for 0001/0002...", scan)
+    run([sys.executable, os.path.join(SCRIPT_DIR, 'fil-pyramid.py')] + [product_path(scan, p) for p in PYRAMID_PRODUCTS], ctx, scan)
+    set_permissions(ctx, scan)
+
+def stage_plot(scan, ctx):
+    out = scan['output_dir']
+    if is_done(scan, ctx, 'plotted'):
+        ctx['log'](f"Found PNG plot(s) in {out}. Skipping plotting.", scan)
+        return
+
+    if not is_done(scan, ctx, 'channelised') and not ctx['dry_run']:
+        raise StageError(f"No .fil files found in {out}. Cannot generate plots.")
+
+    ctx['log'](f"No PNG plots found in {out}. Generating plots...", scan)
+    run([sys.executable, os.path.join(SCRIPT_DIR, 'plot-bandpass.py'), '-d', out, '-s', ctx['station'],
+         '--stream', '--pyramid', '--sample', '64'], ctx, scan)
+    mark(scan, ctx, 'plotted', sorted(glob.glob(os.path.join(out, '*.png'))))
+    scan['new_plots'] = True  # only plots made in this run go into the digest
+    set_permissions(ctx, scan, '*.png')
+
+def stage_cleanup(scan, ctx):
+    # ===== Cleanup raws if .fils exist =====
+    if is_done(scan, ctx, 'channelised'):
+        if ctx['ledger'] is not None:
+            raws = [out['path'] for out in ctx['ledger'].outputs(scan['output_dir'], kind='raw')
+                    if os.path.exists(out['path'])]
+        else:
+            # dry run without a ledger file
+            raws = sorted(glob.glob(os.path.join(scan['output_dir'], f"{scan['target']}*.raw")))
+        ctx['log']("Cleaning raw files...", scan)
+        if raws:
+            # guppi_raw leaves <name>.raw.blkidx.npy/.json next to every raw it has indexed
+            sidecars = [p for raw in raws for p in guppi_raw.index_paths(raw) if os.path.exists(p)]
+            run(['rm', '-f'] + raws + sidecars, ctx, scan)
+        mark(scan, ctx, 'cleaned', detail='raw')
+    set_permissions(ctx, scan, '*.fil')
+
+STAGE_FUNCS = {'extract': stage_extract, 'rawspec': stage_rawspec, 'pyramid': stage_pyramid,
+               'plot': stage_plot, 'cleanup': stage_cleanup}
+
+# ===== Admission control =====
+def scan_sizes(ctx, duration):
+    '''
+    Bytes per scan of .raw and of each product: the median of recent scans in the ledger where
+    it has enough of them, otherwise the block-geometry prediction for `duration` s of voltages.
+    '''
+    sizes = rawspec_utils.filgen_bytes(max(0, duration - rawspec_utils.SKIP_START))
+    observed = ctx['ledger'].typical_sizes(['raw'] + PRODUCTS) if ctx['ledger'] is not None else {}
+    sizes.update(observed)
+    ctx['log']("Scan size predictions: " + ', '.join(
+        f"{kind} {size/1e9:.1f} GB ({'ledger' if kind in observed else 'geometry'})" for kind, size in sizes.items()))
+    return sizes
+
+def predict_bytes(scan, ctx, sizes):
+    '''Bytes the remaining stages of a scan will write, following the ledger skip rules.'''
+    if is_done(scan, ctx, 'channelised'):
+        return 0
+
+    need = sum(sizes[p] for p in PRODUCTS)
+    if not is_done(scan, ctx, 'extracted') and not ctx['stream_raw']:
+        need += sizes['raw']
+    return need
+
+def dir_bytes(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+class DiskAdmission:
+    '''
+    Admits a scan only if: free space - unwritten bytes of scans in flight - this scan's
+    prediction >= watermark. Bytes already on disk for a scan in flight are taken off its
+    reservation, so the projection tightens as extractor and rawspec progress. A scan that does
+    not fit while nothing is in flight would wait forever, so it is rejected instead.
+    '''
+
+    def __init__(self, path, watermark, duration, ctx):
+        # nearest existing parent, so a session whose date dir is not yet made can be checked
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        self.path = path
+        self.watermark = watermark
+        self.sizes = scan_sizes(ctx, duration)
+        self.ctx = ctx
+        self.log = ctx['log']
+        self.dry_run = ctx['dry_run']
+        self.in_flight = []
+        self.waiting_logged = set()
+
+    def try_admit(self, scan):
+        need = predict_bytes(scan, self.ctx, self.sizes)
+        reserved = sum(max(0, s['predicted'] - dir_bytes(s['output_dir'])) for s in self.in_flight)
+        free = shutil.disk_usage(self.path).free
+        projected = free - reserved - need
+        summary = (f"predicted {need/1e9:.1f} GB, free {free/1e9:.1f} GB, reserved {reserved/1e9:.1f} GB, "
+                   f"projected {projected/1e9:.1f} GB (watermark {self.watermark/1e9:.1f} GB)")
+
+        if projected < self.watermark and not self.dry_run:
+            if not self.in_flight:
+                raise StageError(f"Not enough disk space and no scan in flight to free any: {summary}")
+            if scan['target'] not in self.waiting_logged:
+                self.log(f"Queued for disk space: {summary}", scan)
+                self.waiting_logged.add(scan['target'])
+            return False
+
+        self.log(f"Admitted: {summary}", scan)
+        scan['predicted'] = need
+        self.in_flight.append(scan)
+        return True
+
+    def release(self, scan):
+        if scan in self.in_flight:
+            self.in_flight.remove(scan)
+
+# ===== Scheduler =====
+def run_dag(scans, ctx, limits, admission=None, poll=60):
+    '''
+    Runs every scan through STAGES. A task is submitted to its stage pool as soon as all of
+    its dependencies for that scan have succeeded; pools are FIFO so earlier scans go first.
+    A failed stage skips everything downstream of it for that scan only.
+    With an admission controller, scans start in order as it admits them and are released
+    once none of their tasks are running; a scan it rejects fails at its first stage.
+    '''
+    log = ctx['log']
+    pools = {stage: ThreadPoolExecutor(max_workers=max(1, limits[stage]), thread_name_prefix=stage)
+             for stage in STAGES}
+    done = queue.Queue()
+    status = {(i, stage): 'pending' for i in range(len(scans)) for stage in STAGES}
+    timing = {}
+
+    def task(i, stage):
+        strt = time.time()
+        _stage_usage.total = {}
+        exit_status = 1
+        try:
+            STAGE_FUNCS[stage](scans[i], ctx)
+            exit_status = 0
+        finally:
+            timing[(i, stage)] = time.time() - strt
+            if not ctx['dry_run']:
+                # a telemetry failure is logged, never raised over the stage's own result
+                try:
+                    telemetry.record(ctx['session'], stage, timing[(i, stage)], exit_status=exit_status,
+                                     scan=scans[i]['target'], station=ctx['station'], **_stage_usage.total)
+                except Exception as e:
+                    log(f"Telemetry record for {stage} failed: {e}", scans[i], error=True)
+            _stage_usage.total = None
+
+    def submit(i, stage):
+        status[(i, stage)] = 'running'
+        future = pools[stage].submit(task, i, stage)
+        future.add_done_callback(lambda f, i=i, stage=stage: done.put((i, stage, f)))
+
+    waiting = list(range(len(scans)))
+    outstanding = 0
+
+    def admit_waiting():
+        nonlocal outstanding
+        while waiting:
+            try:
+                if admission is not None and not admission.try_admit(scans[waiting[0]]):
+                    break
+            except StageError as e:
+                i = waiting.pop(0)
+                log(str(e), scans[i], error=True)
+                for stage, (deps, _) in STAGES.items():
+                    if not deps:
+                        status[(i, stage)] = 'failed'
+                continue
+            i = waiting.pop(0)
+            for stage, (deps, _) in STAGES.items():
+                if not deps:
+                    submit(i, stage); outstanding += 1
+
+    admit_waiting()
+
+    while outstanding or waiting:
+        try:
+            i, stage, future = done.get(timeout=poll if waiting else None)
+        except queue.Empty:
+            admit_waiting()
+            continue
+        outstanding -= 1
+
+        if future.exception() is not None:
+            status[(i, stage)] = 'failed'
+            log(f"{stage} failed: {future.exception()}", scans[i], error=True)
+        else:
+            status[(i, stage)] = 'ok'
+            for child, (deps, _) in STAGES.items():
+                if stage in deps and status[(i, child)] == 'pending' and all(status[(i, d)] == 'ok' for d in deps):
+                    submit(i, child); outstanding += 1
+
+        if admission is not None and not any(status[(i, s)] == 'running' for s in STAGES):
+            admission.release(scans[i])
+        admit_waiting()
+
+    for pool in pools.values():
+        pool.shutdown()
+
+    for key, state in status.items():
+        if state == 'pending':
+            status[key] = 'skipped'
+
+    return status, timing
+
+def main():
+    args = get_args()
+
+    skip_targets = [item.strip() for arg in args.skip for item in arg.split(',') if item.strip()]
+    port_prefix, station_prefix = STATIONS[args.station]
+
+    # ===== Logging setup =====
+    time_now = datetime.now().strftime('%H:%M')
+    log_name = os.path.basename(args.path.rstrip('/'))
+    if not args.dry_run:
+        os.makedirs(LOG_DIR, exist_ok=True)
+    log = Logger(os.path.join(LOG_DIR, f"{log_name}_{time_now}.out"),
+                 os.path.join(LOG_DIR, f"{log_name}_{time_now}.err"), dry_run=args.dry_run)
+
+    log(f"===== Script started at {datetime.now()} =====")
+    log(f"Directory: {args.path}")
+    log(f"Station: {args.station}")
+    if args.dry_run:
+        log("Mode: DRY-RUN (side-effect commands will not execute)")
+    log(f"Skip list: {' '.join(skip_targets) or '(none)'}")
+
+    # A dry run reads an existing ledger but never creates or writes one
+    ledger = Ledger(args.ledger) if not args.dry_run or os.path.isfile(args.ledger) else None
+    log(f"State ledger: {args.ledger}")
+
+    ctx = {'log': log, 'dry_run': args.dry_run, 'station': args.station, 'session': log_name,
+           'station_code': station_prefix.split('_')[0], 'port_prefix': port_prefix, 'ledger': ledger,
+           'stream_raw': args.stream_raw, 'ring_blocks': args.ring_blocks}
+
+    folders = discover_folders(args.path)
+    date = session_date(args.path, log)
+    log(f"Number of folders found : {len(folders)}")
+    log(f"Date of observations: {date}")
+
+    scans = []
+    for folder in folders:
+        target = os.path.basename(folder)[5:]
+        if should_skip_target(target, skip_targets):
+            log(f"Skipping target '{target}' as requested.")
+            continue
+
+        scan = {'folder': folder, 'target': target,
+                'output_dir': os.path.join(PROJECT_DIR, date, target), 'new_plots': False}
+        if not os.path.isdir(scan['output_dir']):
+            log(f"Creating output directory: {scan['output_dir']}", scan)
+            if not args.dry_run:
+                os.makedirs(scan['output_dir'], exist_ok=True)
+            set_permissions(ctx, scan)
+        scans.append(scan)
+
+    limits = {stage: getattr(args, f'{stage}_workers') for stage in STAGES}
+    admission = DiskAdmission(os.path.join(PROJECT_DIR, date), args.watermark * 1e9, args.scan_duration, ctx)
+    status, timing = run_dag(scans, ctx, limits, admission=admission, poll=args.admission_poll)
+
+    # ===== Slack digest =====
+    plot_dirs = [scan['output_dir'] for scan in scans if scan['new_plots']]
+    if plot_dirs:
+        log(f"Uploading contact sheet digest of {len(plot_dirs)} target(s) to Slack...")
+        try:
+            run([sys.executable, os.path.join(SCRIPT_DIR, 'slack-bandpass.py'), '--digest',
+                 '-o', os.path.join(PROJECT_DIR, date, f"digest_{log_name}")] + plot_dirs, ctx)
+            for scan in scans:
+                if scan['new_plots']:
+                    mark(scan, ctx, 'uploaded', detail='digest')
+        except StageError as e:
+            log(f"Slack digest failed: {e}", error=True)
+
+    # ===== Summary =====
+    log("===== Stage summary =====")
+    for i, scan in enumerate(scans):
+        states = '  '.join(f"{stage}:{status[(i, stage)]}({timing.get((i, stage), 0):.0f}s)" for stage in STAGES)
+        log(f"{scan['target']:<24} {states}")
+
+    log(f"===== Script finished at {datetime.now()} =====")
+    if not args.dry_run:
+        print(f"Log written to: {log.log_file}")
+        print(f"Errors written to: {log.error_file}")
+
+    if any(state == 'failed' for state in status.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
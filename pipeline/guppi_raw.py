@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Memory-mapped reader for the GUPPI RAW files written by lofar_udp_extractor.
+Every block header is parsed once into a persistent block index, so block k is found in O(1)
+and its samples are returned as a zero-copy numpy view of the mmap. Nothing is read from disk
+until a view is sliced.
+
+Sidecars (the .json is written last, so a partial index is never used):
+    <name>.raw.blkidx.npy    structured array: header_offset, data_offset, blocsize, pktidx,
+                             obsnchan, npol, nbits (one row per complete block)
+    <name>.raw.blkidx.json   source size/mtime, bytes indexed and the first block's header
+An index is extended in place when the .raw has grown (e.g. while the extractor is still
+writing), parsing only the headers after the last indexed block.
+
+Block views have shape (obsnchan, ntime, npol, 2) int8 -> (channel, sample, pol, re/im).
+
+    guppi_raw.py info <file.raw>               build/refresh the index, print geometry and PKTIDX gaps
+    guppi_raw.py dump <file.raw> -b K [-c C]   power statistics of block K (optionally one channel)
+"""
+
+import argparse
+import json
+import mmap
+import os
+import numpy as np
+
+CARD = 80
+MAX_HEADER_CARDS = 1024
+DIRECTIO_ALIGN = 512
+INDEX_DTYPE = np.dtype([('header_offset', '<i8'), ('data_offset', '<i8'), ('blocsize', '<i8'),
+                        ('pktidx', '<i8'), ('obsnchan', '<i4'), ('npol', '<i4'), ('nbits', '<i4')])
+END_CARD = b'END'.ljust(CARD)
+MAX_HEADER_BYTES = MAX_HEADER_CARDS * CARD
+
+def parse_card(card):
+    key = card[:8].strip()
+    value = card[9:].lstrip('= ').strip() if len(card) > 8 else ''
+    if value.startswith("'"):
+        return key, value.strip("'").strip()
+    for cast in (int, float):
+        try:
+            return key, cast(value)
+        except ValueError:
+            pass
+    return key, value
+
+def padded(n, directio):
+    return -(-n // DIRECTIO_ALIGN) * DIRECTIO_ALIGN if directio else n
+
+def index_paths(raw_path):
+    return raw_path + '.blkidx.npy', raw_path + '.blkidx.json'
+
+def parse_header_at(buf, offset):
+    '''(header dict, header length in bytes before padding) for the header starting at offset.'''
+    end = offset
+    while True:
+        end = buf.find(END_CARD, end, offset + MAX_HEADER_BYTES)
+        if end < 0:
+            raise ValueError(f"No END card within {MAX_HEADER_BYTES} bytes of offset {offset}")
+        if (end - offset) % CARD == 0:
+            break
+        end += 1
+    text = bytes(buf[offset:end]).decode('ascii', errors='replace')
+    hdr = dict(parse_card(text[i:i + CARD]) for i in range(0, len(text), CARD))
+    return hdr, end + CARD - offset
+
+def scan_blocks(buf, size, offset=0):
+    '''Index rows for every complete block from offset; also returns the offset scanning stopped at.'''
+    rows, first = [], None
+    while offset + CARD <= size:
+        try:
+            hdr, hdr_len = parse_header_at(buf, offset)
+        except ValueError:
+            break
+        directio = int(hdr.get('DIRECTIO', 0)) == 1
+        data_offset = offset + padded(hdr_len, directio)
+        blocsize = int(hdr['BLOCSIZE'])
+        if data_offset + blocsize > size:
+            break  # partial block at the end of a file still being written
+        rows.append((offset, data_offset, blocsize, int(hdr.get('PKTIDX', -1)),
+                     int(hdr.get('OBSNCHAN', 0)), int(hdr.get('NPOL', 0)), int(hdr.get('NBITS', 0))))
+        first = first or hdr
+        offset = data_offset + padded(blocsize, directio)
+    return np.array(rows, dtype=INDEX_DTYPE), offset, first
+
+def count_blocks(raw_path):
+    '''
+    Complete blocks in a .raw file from its size and the stride of its first block, without
+    building an index. lofar_udp_extractor writes the same header cards in every block.
+    '''
+    size = os.path.getsize(raw_path)
+    with open(raw_path, 'rb') as f:
+        buf = f.read(MAX_HEADER_BYTES)
+    if not buf:
+        return 0
+    hdr, hdr_len = parse_header_at(buf, 0)
+    directio = int(hdr.get('DIRECTIO', 0)) == 1
+    return size // (padded(hdr_len, directio) + padded(int(hdr['BLOCSIZE']), directio))
+
+def build_index(raw_path, force=False):
+    '''
+    Returns (index, meta), building or extending the sidecar as needed. A valid index whose
+    source has only grown is extended from the last indexed byte.
+    '''
+    npy_path, json_path = index_paths(raw_path)
+    size = os.path.getsize(raw_path)
+    index, meta = None, None
+
+    if not force and os.path.isfile(json_path) and os.path.isfile(npy_path):
+        with open(json_path) as f:
+            meta = json.load(f)
+        if meta['source_size'] == size and meta['source_mtime'] >= os.path.getmtime(raw_path):
+            return np.load(npy_path), meta
+        if meta['source_size'] <= size:
+            index = np.load(npy_path)
+        else:
+            meta = None
+
+    with open(raw_path, 'rb') as f:
+        if size == 0:
+            rows, end, first = np.zeros(0, dtype=INDEX_DTYPE), 0, None
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                strt = meta['indexed_bytes'] if index is not None else 0
+                rows, end, first = scan_blocks(buf, size, strt)
+
+    index = rows if index is None else np.concatenate([index, rows])
+    meta = {'source': os.path.basename(raw_path), 'source_size': size,
+            'source_mtime': os.path.getmtime(raw_path), 'nblocks': int(len(index)),
+            'indexed_bytes': int(end), 'trailing_bytes': int(size - end),
+            'header': (meta or {}).get('header') or first}
+
+    np.save(npy_path, index)
+    with open(json_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return index, meta
+
+def block_npol(npol):
+    # GUPPI writes NPOL=4 for two complex polarisations
+    return 2 if npol == 4 else int(npol)
+
+class GuppiRaw:
+    '''Random access to the blocks of one GUPPI RAW file through its block index.'''
+
+    def __init__(self, raw_path, force_index=False):
+        self.path = raw_path
+        self.index, self.meta = build_index(raw_path, force=force_index)
+        self.header = self.meta['header'] or {}
+        size = self.meta['source_size']
+        self.mm = np.memmap(raw_path, dtype=np.uint8, mode='r', shape=(size,)) if size else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def block_header(self, k):
+        '''Full header dict of block k (parsed on demand from its indexed offset).'''
+        offset = int(self.index['header_offset'][k])
+        return parse_header_at(self.mm[offset:self.index['data_offset'][k]].tobytes(), 0)[0]
+
+    def block_shape(self, k):
+        row = self.index[k]
+        if row['nbits'] != 8:
+            raise ValueError(f"Only 8-bit blocks can be viewed (block {k} has NBITS={row['nbits']})")
+        npol = block_npol(row['npol'])
+        ntime = int(row['blocsize'] // (row['obsnchan'] * npol * 2))
+        return int(row['obsnchan']), ntime, npol, 2
+
+    def block(self, k):
+        '''Zero-copy int8 view of block k, shape (obsnchan, ntime, npol, 2).'''
+        k = range(len(self))[k]
+        row = self.index[k]
+        data = self.mm[row['data_offset']:row['data_offset'] + row['blocsize']]
+        return data.view(np.int8).reshape(self.block_shape(k))
+
+    def channels(self, k, c0, c1):
+        return self.block(k)[c0:c1]
+
+    @property
+    def ntime_per_block(self):
+        return self.block_shape(0)[1] if len(self) else 0
+
+    def iter_time(self, t0, t1, c0=0, c1=None):
+        '''
+        Yields (block number, zero-copy view) covering samples [t0, t1) of channels [c0, c1).
+        Samples are counted from the start of the file; block k holds [k*ntime, (k+1)*ntime).
+        '''
+        ntime = self.ntime_per_block
+        for k in range(t0 // ntime, min(len(self), -(-t1 // ntime))):
+            s0 = max(t0 - k * ntime, 0)
+            s1 = min(t1 - k * ntime, ntime)
+            yield k, self.block(k)[c0:c1, s0:s1]
+
+    def read_time(self, t0, t1, c0=0, c1=None):
+        '''Samples [t0, t1) of channels [c0, c1) joined across blocks (a copy when it spans blocks).'''
+        views = [view for _, view in self.iter_time(t0, t1, c0, c1)]
+        return views[0] if len(views) == 1 else np.concatenate(views, axis=1)
+
+    def pktidx_gaps(self):
+        '''(block numbers after a gap, missing packets before them) from the PKTIDX column.'''
+        pktidx = self.index['pktidx']
+        if len(pktidx) < 2:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        step = np.diff(pktidx)
+        expected = int(self.header.get('PIPERBLK') or np.median(step))
+        gaps = np.nonzero(step != expected)[0]
+        return gaps + 1, step[gaps] - expected
+
+def to_complex(view):
+    '''complex64 copy of an int8 (..., 2) view.'''
+    return view.astype(np.float32).view(np.complex64)[..., 0]
+
+def scan_files(stem):
+    '''The <stem>.NNNN.raw files of one extractor run, in order.'''
+    directory, base = os.path.split(stem)
+    return sorted(os.path.join(directory or '.', name) for name in os.listdir(directory or '.')
+                  if name.startswith(base + '.') and name.endswith('.raw'))
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Inspect GUPPI RAW files through a block index.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    info_p = sub.add_parser('info', help='Build/refresh the index and summarise the file(s).')
+    info_p.add_argument('raws', nargs='+')
+    info_p.add_argument('--force', action='store_true', help='Rebuild the index from scratch.')
+    dump_p = sub.add_parser('dump', help='Power statistics of one block.')
+    dump_p.add_argument('raw')
+    dump_p.add_argument('-b', '--block', type=int, default=0, help='Block number (negative counts from the end).')
+    dump_p.add_argument('-c', '--chan', type=int, default=None, help='Only this coarse channel.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    if args.cmd == 'info':
+        for raw_path in args.raws:
+            raw = GuppiRaw(raw_path, force_index=args.force)
+            after, missing = raw.pktidx_gaps()
+            print(f"{raw_path}: {len(raw)} block(s), {raw.meta['trailing_bytes']} trailing byte(s)")
+            if len(raw):
+                nchan, ntime, npol, _ = raw.block_shape(0)
+                print(f"    OBSNCHAN={nchan} NPOL={npol} samples/block={ntime} BLOCSIZE={raw.index['blocsize'][0]} "
+                      f"PKTIDX {raw.index['pktidx'][0]}..{raw.index['pktidx'][-1]}")
+            for k, n in zip(after, missing):
+                print(f"    PKTIDX gap before block {k}: {n:+d} packet(s)")
+        return
+
+    raw = GuppiRaw(args.raw)
+    view = raw.block(args.block) if args.chan is None else raw.channels(args.block, args.chan, args.chan + 1)
+    power = (view.astype(np.float32) ** 2).sum(axis=-1)  # (chan, time, pol)
+    print(f"Block {args.block} of {len(raw)}: header PKTIDX={raw.block_header(args.block).get('PKTIDX')}")
+    for pol in range(power.shape[2]):
+        p = power[..., pol]
+        print(f"    pol {pol}: mean {p.mean():.2f} std {p.std():.2f} zero-fraction {(p == 0).mean():.4f} "
+              f"clipped-fraction {(np.abs(view[..., pol, :]) >= 127).mean():.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Columnar store of turboSETI narrowband hits across the whole survey, for
+rejecting RFI by recurrence: LOFTS has no ON/OFF cadence, but a hit at the same topocentric
+frequency and drift in many unrelated zenith pointings is local interference.
+
+Layout, one partition per station and session (at $LOFTS_HITDB or /datax2/projects/LOFTS/hitdb):
+    <db>/<station>/<session>/<column>.npy   freq, bary_freq (MHz), drift (Hz/s), snr, coarse,
+                                            target, source (partition-local ids), mjd
+    <db>/<station>/<session>/index_bins.npy, index_offsets.npy
+                                            1 kHz frequency bins and where each starts
+    <db>/<station>/<session>/meta.json      targets, source .dat files with size/mtime
+Rows are sorted by frequency, so the index turns a frequency range into one slice of each
+memory-mapped column. Ingest keeps the rows of unchanged .dat files and re-parses only new or
+changed ones; a partition is written to a temporary directory and swapped in whole.
+
+Station, session and target of a .dat come from the state ledger (the scan its directory belongs
+to), else from --station/--session, else from the path.
+
+    hitdb.py ingest <.dat files or dirs>... [--station S] [--session S] [-w 8]
+    hitdb.py query --fmin 150.1 --fmax 150.2 [--station SE607]
+    hitdb.py recurrence [-k 3] [--freq-tol-hz 10] [--drift-tol 0.25] [--frame topo|bary] [-o flagged.csv]
+    hitdb.py stats
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from ledger import LEDGER_PATH, Ledger
+
+HITDB_PATH = os.environ.get('LOFTS_HITDB') or '/datax2/projects/LOFTS/hitdb'
+COLUMNS = {'freq': np.float64, 'bary_freq': np.float64, 'drift': np.float32, 'snr': np.float32,
+           'coarse': np.int32, 'target': np.int32, 'source': np.int32, 'mjd': np.float64}
+INDEX_BIN_MHZ = 0.001
+N_DAT_FIELDS = 12
+STATIONS = ('IE613', 'SE607')
+
+# ===== Parsing =====
+def parse_dat(dat_path):
+    '''Hit columns of one turboSETI .dat (plus the MJD from its header).'''
+    mjd, rows = np.nan, []
+    with open(dat_path) as f:
+        for line in f:
+            if line.startswith('#'):
+                match = re.search(r'MJD:\s*([0-9.]+)', line)
+                if match:
+                    mjd = float(match.group(1))
+            elif line.strip():
+                rows.append(line)
+
+    try:
+        values = np.array(''.join(rows).split(), dtype=np.float64) if rows else np.zeros(0)
+    except ValueError:
+        values = None
+    if values is None or values.size != len(rows) * N_DAT_FIELDS:
+        # a malformed line somewhere: fall back to parsing line by line, skipping bad ones
+        good = []
+        for line in rows:
+            try:
+                fields = [float(v) for v in line.split()]
+            except ValueError:
+                continue
+            if len(fields) == N_DAT_FIELDS:
+                good.append(fields)
+        values = np.array(good, dtype=np.float64)
+    values = values.reshape(-1, N_DAT_FIELDS)
+    # Top_Hit_#, Drift_Rate, SNR, Uncorrected_Frequency, Corrected_Frequency, Index, freq_start,
+    # freq_end, SEFD, SEFD_freq, Coarse_Channel_Number, Full_number_of_hits
+    return {'freq': values[:, 3], 'bary_freq': values[:, 4], 'drift': values[:, 1].astype(np.float32),
+            'snr': values[:, 2].astype(np.float32), 'coarse': values[:, 10].astype(np.int32),
+            'mjd': np.full(len(values), mjd)}
+
+def find_dats(paths):
+    dats = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.turboseti_')]  # shard outputs
+                dats += [os.path.join(root, name) for name in files if name.endswith('.dat')]
+        elif path.endswith('.dat'):
+            dats.append(path)
+    return sorted(os.path.abspath(p) for p in dats)
+
+def describe_dat(dat_path, ledger=None, station=None, session=None):
+    '''(station, session, target) of one .dat.'''
+    scan = ledger.scan(os.path.dirname(dat_path)) if ledger else None
+    scan = scan or {}
+    station = scan.get('station') or station or next((s for s in STATIONS if s in dat_path), 'unknown')
+    match = re.search(r'(sess_[^/]+)', dat_path)
+    session = scan.get('session') or session or (match.group(1) if match else 'unknown')
+    target = scan.get('target') or os.path.basename(dat_path).split('.')[0]
+    return station, session, target
+
+# ===== Store =====
+class HitDB:
+    def __init__(self, root=HITDB_PATH):
+        self.root = root
+
+    def partition_dir(self, station, session):
+        return os.path.join(self.root, station, session)
+
+    def partitions(self, stations=None, sessions=None):
+        '''(station, session) of every stored partition, optionally filtered.'''
+        parts = []
+        if not os.path.isdir(self.root):
+            return parts
+        for station in sorted(os.listdir(self.root)):
+            if stations and station not in stations:
+                continue
+            for session in sorted(os.listdir(os.path.join(self.root, station))):
+                # .partial and .old are write_partition's staging and swap dirs, not sessions
+                if session.endswith(('.partial', '.old')) or (sessions and session not in sessions):
+                    continue
+                if os.path.isfile(os.path.join(self.root, station, session, 'meta.json')):
+                    parts.append((station, session))
+        return parts
+
+    def meta(self, station, session):
+        path = os.path.join(self.partition_dir(station, session), 'meta.json')
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def columns(self, station, session, names=None, mmap=True):
+        part = self.partition_dir(station, session)
+        return {name: np.load(os.path.join(part, name + '.npy'), mmap_mode='r' if mmap else None)
+                for name in (names or COLUMNS)}
+
+    def write_partition(self, station, session, cols, meta):
+        '''Sorts by frequency, builds the bin index and swaps the partition in atomically.'''
+        order = np.argsort(cols['freq'], kind='stable')
+        part = self.partition_dir(station, session)
+        tmp = part + '.partial'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, dtype in COLUMNS.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.asarray(cols[name], dtype=dtype)[order])
+
+        bins = np.floor(cols['freq'][order] / INDEX_BIN_MHZ).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]]) if len(bins) else np.zeros(0, np.int64)
+        np.save(os.path.join(tmp, 'index_bins.npy'), bins[starts])
+        np.save(os.path.join(tmp, 'index_offsets.npy'), np.r_[starts, len(bins)].astype(np.int64))
+        meta['nhits'] = int(len(bins))
+        meta['updated'] = time.time()
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+        old = part + '.old'
+        if os.path.isdir(part):
+            os.replace(part, old)
+        os.replace(tmp, part)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def range_slice(self, station, session, fmin, fmax):
+        '''Row slice of one partition holding every hit with fmin <= freq < fmax (MHz).'''
+        part = self.partition_dir(station, session)
+        bins = np.load(os.path.join(part, 'index_bins.npy'))
+        offsets = np.load(os.path.join(part, 'index_offsets.npy'))
+        b0 = np.searchsorted(bins, np.floor(fmin / INDEX_BIN_MHZ), side='left')
+        b1 = np.searchsorted(bins, np.floor(fmax / INDEX_BIN_MHZ), side='right')
+        return slice(int(offsets[b0]), int(offsets[b1]))
+
+    def query(self, fmin, fmax, stations=None, sessions=None, names=None):
+        '''Hits with fmin <= freq < fmax across partitions, with station/session/target names.'''
+        out = []
+        for station, session in self.partitions(stations, sessions):
+            sl = self.range_slice(station, session, fmin, fmax)
+            cols = {name: np.asarray(col[sl]) for name, col in self.columns(station, session, names).items()}
+            keep = (cols['freq'] >= fmin) & (cols['freq'] < fmax)
+            targets = np.array(self.meta(station, session)['targets'])
+            for row in np.flatnonzero(keep):
+                rec = {name: col[row].item() for name, col in cols.items()}
+                rec.update({'station': station, 'session': session, 'target': targets[cols['target'][row]]})
+                out.append(rec)
+        return out
+
+    def load_all(self, names, stations=None, sessions=None):
+        '''
+        Concatenated columns of the selected partitions. 'target' becomes a survey-wide id
+        (same name -> same id); returns (columns, target names, partition of each row).
+        '''
+        cols, target_names, ids, part_ids = {name: [] for name in names}, [], {}, []
+        for n, (station, session) in enumerate(self.partitions(stations, sessions)):
+            meta = self.meta(station, session)
+            local = np.array([ids.setdefault(name, len(ids)) for name in meta['targets']], dtype=np.int32)
+            part = self.columns(station, session, set(names) | {'target'})
+            for name in names:
+                cols[name].append(local[part['target']] if name == 'target' else np.asarray(part[name]))
+            part_ids.append(np.full(meta['nhits'], n, dtype=np.int32))
+        target_names = sorted(ids, key=ids.get)
+        cols = {name: np.concatenate(v) if v else np.zeros(0, COLUMNS[name]) for name, v in cols.items()}
+        return cols, target_names, np.concatenate(part_ids) if part_ids else np.zeros(0, np.int32)
+
+# ===== Ingest =====
+def ingest(db, dat_paths, ledger=None, station=None, session=None, workers=8, log=print):
+    '''Adds or refreshes the given .dat files. Returns {(station, session): hits}.'''
+    groups = {}
+    for path in dat_paths:
+        st, se, target = describe_dat(path, ledger, station, session)
+        groups.setdefault((st, se), {})[path] = target
+
+    totals = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        for (st, se), sources in sorted(groups.items()):
+            meta = db.meta(st, se) or {'station': st, 'session': se, 'targets': [], 'sources': []}
+            old_cols = db.columns(st, se, mmap=False) if meta['sources'] else None
+
+            # keep the rows of sources that are unchanged on disk and not being re-ingested
+            keep_sources, targets = [], list(meta['targets'])
+            for n, src in enumerate(meta['sources']):
+                unchanged = (os.path.isfile(src['path']) and os.path.getsize(src['path']) == src['size']
+                             and os.path.getmtime(src['path']) == src['mtime'])
+                if unchanged:
+                    keep_sources.append((n, src))
+                    sources.pop(src['path'], None)
+                elif os.path.isfile(src['path']):
+                    sources.setdefault(src['path'], src['target'])  # rewritten since: parse again
+
+            new_sources = [{'path': p, 'target': t, 'size': os.path.getsize(p), 'mtime': os.path.getmtime(p)}
+                           for p, t in sorted(sources.items())]
+            parsed = list(pool.map(parse_dat, [s['path'] for s in new_sources], chunksize=8))
+
+            cols = {name: [] for name in COLUMNS}
+            all_sources = []
+            if old_cols is not None and keep_sources:
+                remap = np.full(len(meta['sources']), -1, dtype=np.int32)
+                for new_id, (old_id, src) in enumerate(keep_sources):
+                    remap[old_id] = new_id
+                    all_sources.append(src)
+                rows = remap[old_cols['source']] >= 0
+                for name in COLUMNS:
+                    cols[name].append(old_cols[name][rows])
+                cols['source'][-1] = remap[old_cols['source'][rows]]
+            for src, hits in zip(new_sources, parsed):
+                if src['target'] not in targets:
+                    targets.append(src['target'])
+                n = len(hits['freq'])
+                for name in ('freq', 'bary_freq', 'drift', 'snr', 'coarse', 'mjd'):
+                    cols[name].append(hits[name])
+                cols['target'].append(np.full(n, targets.index(src['target']), dtype=np.int32))
+                cols['source'].append(np.full(n, len(all_sources), dtype=np.int32))
+                src['nhits'] = n
+                all_sources.append(src)
+
+            cols = {name: np.concatenate(v) if v else np.zeros(0, COLUMNS[name]) for name, v in cols.items()}
+            meta.update({'targets': targets, 'sources': all_sources})
+            db.write_partition(st, se, cols, meta)
+            totals[(st, se)] = len(cols['freq'])
+            log(f"{st}/{se}: {len(new_sources)} new or changed .dat file(s), {len(keep_sources)} unchanged, "
+                f"{len(cols['freq'])} hit(s)")
+    return totals
+
+# ===== Recurrence =====
+def ragged_arange(starts, sizes):
+    '''concatenate([arange(s, s + n) for s, n in zip(starts, sizes)]) without the loop.'''
+    ends = np.cumsum(sizes)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - sizes - starts, sizes)
+
+def sorted_unique(values):
+    '''np.unique by sorting (much faster than hashing for millions of int64 keys).'''
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+def merge_searchsorted(a, v):
+    '''np.searchsorted(a, v) for sorted v too, as a linear merge of the two sorted runs.'''
+    order = np.argsort(np.concatenate([v, a]), kind='stable')
+    is_v = order < len(v)
+    return np.cumsum(~is_v)[is_v]
+
+def recurrence_counts(freq_hz, drift, target, freq_tol_hz=10.0, drift_tol=0.25):
+    '''
+    Number of distinct targets with a hit near each hit. Hits are gridded into cells of
+    freq_tol_hz x drift_tol; a hit counts every target with a hit in its own or an adjacent cell,
+    so hits within the tolerance are always counted (and some up to twice it).
+
+    Vectorised over all hits: the distinct (cell, target) pairs are sorted once. Cells are numbered
+    fbin * nd + dbin, so drift neighbours are adjacent in the sorted cell list and the frequency
+    neighbours are found with one searchsorted per side. Targets are only de-duplicated for cells
+    that actually have occupied neighbours (the RFI-dense ones).
+    '''
+    if len(freq_hz) == 0:
+        return np.zeros(0, dtype=np.int64)
+    fbin = np.floor(freq_hz / freq_tol_hz).astype(np.int64)
+    dbin = np.floor(drift / drift_tol).astype(np.int64)
+    fbin -= fbin.min() - 1
+    dbin -= dbin.min() - 1
+    nd = int(dbin.max()) + 2
+    nt = int(target.max()) + 1
+    cell = fbin * nd + dbin
+    del fbin, dbin
+
+    keys = cell * nt + target
+    order = np.argsort(keys)
+    keys = keys[order]
+    new_pair = np.r_[True, keys[1:] != keys[:-1]]
+    pairs = keys[new_pair]
+    pair_cell, pair_target = pairs // nt, pairs % nt
+    hit_cell = cell[order]
+    first = np.r_[True, pair_cell[1:] != pair_cell[:-1]]
+    cells, starts = pair_cell[first], np.flatnonzero(first)
+    sizes = np.diff(np.r_[starts, len(pairs)])
+    n = len(cells)
+    counts = sizes.astype(np.int64)  # own cell: targets are already distinct
+
+    # occupied neighbours of every occupied cell: (querying cell, neighbour cell) index pairs
+    query, neighbour = [], []
+    for step in (-1, 1):  # drift neighbours sit next to each other in the sorted list
+        i = np.arange(max(0, -step), n - max(0, step))
+        ok = cells[i + step] == cells[i] + step
+        query.append(i[ok]); neighbour.append(i[ok] + step)
+    for base in (-nd - 1, nd - 1):  # frequency neighbours: cell + base + {0, 1, 2}
+        idx = merge_searchsorted(cells, cells + base)
+        for k in range(3):  # any occupied cell in the window is at idx, idx + 1 or idx + 2
+            j = np.minimum(idx + k, n - 1)
+            offset = cells[j] - cells - base
+            ok = (offset >= 0) & (offset <= 2) & (idx + k < n)
+            query.append(np.flatnonzero(ok)); neighbour.append(j[ok])
+    query, neighbour = np.concatenate(query), np.concatenate(neighbour)
+
+    # de-duplicate targets across a crowded cell's neighbourhood
+    crowded = sorted_unique(query)
+    if len(crowded):
+        query = np.r_[crowded, query]
+        neighbour = np.r_[crowded, neighbour]
+        keys = sorted_unique(np.repeat(query, sizes[neighbour]) * nt
+                             + pair_target[ragged_arange(starts[neighbour], sizes[neighbour])])
+        counts[crowded] = np.bincount(keys // nt, minlength=n)[crowded]
+
+    out = np.empty(len(cell), dtype=np.int64)
+    out[order] = counts[np.cumsum(np.r_[True, hit_cell[1:] != hit_cell[:-1]]) - 1]
+    return out
+
+def write_flagged(path, cols, target_names, parts, part_names, counts, flagged):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['station', 'session', 'target', 'freq_mhz', 'bary_freq_mhz', 'drift_hz_s', 'snr', 'n_targets'])
+        for row in np.flatnonzero(flagged):
+            station, session = part_names[parts[row]]
+            writer.writerow([station, session, target_names[cols['target'][row]], f"{cols['freq'][row]:.6f}",
+                             f"{cols['bary_freq'][row]:.6f}", f"{cols['drift'][row]:.4f}", f"{cols['snr'][row]:.2f}",
+                             int(counts[row])])
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Survey-wide narrowband hit store with recurrence-based RFI flagging.')
+    parser.add_argument('--db', type=str, default=HITDB_PATH, help=f'Store directory (default: {HITDB_PATH}).')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    ingest_p = sub.add_parser('ingest', help='Load turboSETI .dat files (or directories of them).')
+    ingest_p.add_argument('paths', nargs='+')
+    ingest_p.add_argument('--station', type=str, default=None, help='Station when the ledger does not know it.')
+    ingest_p.add_argument('--session', type=str, default=None, help='Session when the ledger does not know it.')
+    ingest_p.add_argument('--ledger', type=str, default=LEDGER_PATH, help=f'State ledger (default: {LEDGER_PATH}).')
+    ingest_p.add_argument('-w', '--workers', type=int, default=8, help='Parsing processes (default: 8).')
+
+    for name, help_text in (('query', 'Hits in a frequency range.'), ('recurrence', 'Flag hits recurring across targets.'),
+                            ('stats', 'Partitions and hit counts.')):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--station', action='append', default=None, help='Only this station (repeatable).')
+        p.add_argument('--session', action='append', default=None, help='Only this session (repeatable).')
+        if name == 'query':
+            p.add_argument('--fmin', type=float, required=True, help='MHz')
+            p.add_argument('--fmax', type=float, required=True, help='MHz')
+        if name == 'recurrence':
+            p.add_argument('-k', type=int, default=3, help='Flag hits seen in more than k targets (default: 3).')
+            p.add_argument('--freq-tol-hz', type=float, default=10.0, help='Frequency tolerance in Hz (default: 10).')
+            p.add_argument('--drift-tol', type=float, default=0.25, help='Drift-rate tolerance in Hz/s (default: 0.25).')
+            p.add_argument('--frame', choices=['topo', 'bary'], default='topo',
+                           help='Match topocentric (RFI, default) or barycentric frequencies.')
+            p.add_argument('-o', '--output', type=str, default=None, help='Write the flagged hits to this CSV.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    db = HitDB(args.db)
+
+    if args.cmd == 'ingest':
+        dats = find_dats(args.paths)
+        print(f"Number of .dat files found: {len(dats)}")
+        ledger = Ledger(args.ledger) if os.path.isfile(args.ledger) else None
+        strt = time.time()
+        totals = ingest(db, dats, ledger, args.station, args.session, args.workers)
+        print(f"Ingested {len(totals)} partition(s), {sum(totals.values())} hit(s) in {time.time() - strt:.1f} s")
+    elif args.cmd == 'stats':
+        for station, session in db.partitions(args.station, args.session):
+            meta = db.meta(station, session)
+            print(f"{station}/{session}: {meta['nhits']} hit(s) from {len(meta['sources'])} file(s), "
+                  f"{len(meta['targets'])} target(s)")
+    elif args.cmd == 'query':
+        for rec in db.query(args.fmin, args.fmax, args.station, args.session):
+            print(f"{rec['station']} {rec['session']} {rec['target']}: {rec['freq']:.6f} MHz "
+                  f"drift {rec['drift']:+.4f} Hz/s SNR {rec['snr']:.1f}")
+    else:
+        strt = time.time()
+        names = ['freq', 'bary_freq', 'drift', 'snr', 'target']
+        cols, target_names, parts = db.load_all(names, args.station, args.session)
+        freq = cols['freq' if args.frame == 'topo' else 'bary_freq'] * 1e6
+        counts = recurrence_counts(freq, cols['drift'], cols['target'], args.freq_tol_hz, args.drift_tol)
+        flagged = counts > args.k
+        print(f"{flagged.sum()} of {len(counts)} hit(s) recur in more than {args.k} target(s) "
+              f"({len(target_names)} target(s), {time.time() - strt:.1f} s)")
+        if args.output:
+            write_flagged(args.output, cols, target_names, parts, db.partitions(args.station, args.session), counts, flagged)
+            print(f"Flagged hits written to {args.output}")
+
+if __name__ == "__main__":
+    main()
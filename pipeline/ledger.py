@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: SQLite-backed processing state ledger for the LOFTS pipeline.
+Each scan's stage transitions (extracted -> channelised -> plotted -> uploaded -> cleaned) are
+recorded atomically with the outputs they produced (size, mtime, checksum). Scripts ask the
+ledger what is done instead of walking /datax2 with find, and a stage only counts as done once
+its command finished successfully, so a half-written .fil is never taken as complete.
+
+Checksums are a sampled SHA-256: file size plus 64 KiB read from the start, the end and 16
+evenly spaced offsets. This catches truncation and overwrite without rereading 30 GB products.
+
+CLI (for the bash scripts):
+    ledger.py mark <output_dir> <state> [files...] [--detail D]
+    ledger.py check <output_dir> <state> [--deep]      exit 0 if done and outputs still match
+    ledger.py outputs <output_dir> [--kind raw]        recorded outputs that still exist
+    ledger.py blocks <output_dir>                      RAW blocks extracted, if checked against the .zst
+    ledger.py status [<output_dir>|<date dir>]
+    ledger.py backfill <date dir>                      register products made before the ledger
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+LEDGER_PATH = os.environ.get('LOFTS_LEDGER', '/datax2/projects/LOFTS/logs/ledger.sqlite')
+STATES = ['extracted', 'channelised', 'plotted', 'uploaded', 'cleaned']
+SAMPLE_BYTES = 1 << 16
+N_SAMPLES = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    output_dir TEXT PRIMARY KEY,
+    session    TEXT,
+    target     TEXT,
+    station    TEXT
+);
+CREATE TABLE IF NOT EXISTS states (
+    output_dir TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    ts         REAL NOT NULL,
+    detail     TEXT,
+    PRIMARY KEY (output_dir, state)
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    output_dir TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    ts         REAL NOT NULL,
+    detail     TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    path       TEXT PRIMARY KEY,
+    output_dir TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    kind       TEXT,
+    size       INTEGER,
+    mtime      REAL,
+    checksum   TEXT
+);
+CREATE INDEX IF NOT EXISTS outputs_dir ON outputs (output_dir, state);
+"""
+
+def sampled_checksum(path):
+    size = os.path.getsize(path)
+    sha = hashlib.sha256(str(size).encode())
+    offsets = {0, max(0, size - SAMPLE_BYTES)}
+    offsets.update(int(i * size / (N_SAMPLES + 1)) for i in range(1, N_SAMPLES + 1))
+    with open(path, 'rb') as f:
+        for offset in sorted(offsets):
+            f.seek(offset)
+            sha.update(f.read(SAMPLE_BYTES))
+    return sha.hexdigest()
+
+def output_kind(path):
+    name = os.path.basename(path)
+    if name.endswith('.raw'):
+        return 'raw'
+    for product in ['0000', '0001', '0002']:
+        if name.endswith(f'.{product}.fil'):
+            return product
+    return os.path.splitext(name)[1].lstrip('.') or 'file'
+
+class Ledger:
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # one connection per call so scheduler threads never share a connection
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def mark(self, output_dir, state, paths=(), detail=None, checksum=True, **scan_info):
+        '''
+        Records a state transition and its outputs in one transaction. Sizes and checksums
+        are computed before the transaction starts, so the write lock is held briefly.
+        '''
+        if state not in STATES:
+            raise ValueError(f"Unknown state '{state}'. Use one of {STATES}.")
+
+        rows = []
+        for path in paths:
+            st = os.stat(path)
+            rows.append((os.path.abspath(path), output_dir, state, output_kind(path), st.st_size, st.st_mtime,
+                         sampled_checksum(path) if checksum else None))
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO scans (output_dir, session, target, station) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT(output_dir) DO UPDATE SET session=COALESCE(excluded.session, session), '
+                         'target=COALESCE(excluded.target, target), station=COALESCE(excluded.station, station)',
+                         (output_dir, scan_info.get('session'), scan_info.get('target'), scan_info.get('station')))
+            conn.execute('INSERT OR REPLACE INTO states (output_dir, state, ts, detail) VALUES (?, ?, ?, ?)',
+                         (output_dir, state, now, detail))
+            conn.execute('INSERT INTO transitions (output_dir, state, ts, detail) VALUES (?, ?, ?, ?)',
+                         (output_dir, state, now, detail))
+            conn.executemany('INSERT OR REPLACE INTO outputs (path, output_dir, state, kind, size, mtime, checksum) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def scan(self, output_dir):
+        '''session, target and station recorded for output_dir, or None.'''
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM scans WHERE output_dir=?', (output_dir,)).fetchone()
+        return dict(row) if row else None
+
+    def state(self, output_dir, state):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM states WHERE output_dir=? AND state=?', (output_dir, state)).fetchone()
+        return dict(row) if row else None
+
+    def outputs(self, output_dir, state=None, kind=None):
+        query = 'SELECT * FROM outputs WHERE output_dir=?'
+        args = [output_dir]
+        if state:
+            query += ' AND state=?'; args.append(state)
+        if kind:
+            query += ' AND kind=?'; args.append(kind)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query + ' ORDER BY path', args)]
+
+    def typical_sizes(self, kinds, recent=20, min_scans=3):
+        '''
+        {kind: median bytes per scan} over the `recent` latest scans that recorded outputs of
+        that kind (a scan's .raw files are summed). Kinds seen in fewer than min_scans are left out.
+        '''
+        marks = ','.join('?' * len(kinds))
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT o.kind, SUM(o.size) AS size FROM outputs o JOIN states s '
+                                f'ON s.output_dir=o.output_dir AND s.state=o.state WHERE o.kind IN ({marks}) '
+                                f'GROUP BY o.output_dir, o.kind ORDER BY MAX(s.ts) DESC', list(kinds)).fetchall()
+        sizes = {}
+        for row in rows:
+            sizes.setdefault(row['kind'], []).append(row['size'])
+        typical = {}
+        for kind, values in sizes.items():
+            values = sorted(values[:recent])
+            if len(values) >= min_scans:
+                typical[kind] = values[len(values) // 2]
+        return typical
+
+    def extracted_blocks(self, output_dir):
+        '''
+        {'blocks': RAW blocks fed to rawspec, 'expected': blocks the scan's .zst span implies},
+        from the 'extracted' detail ("blocks=N expected=M"); keys that were not recorded are absent.
+        '''
+        row = self.state(output_dir, 'extracted')
+        fields = dict(tok.split('=', 1) for tok in (row['detail'] or '').split() if '=' in tok) if row else {}
+        return {key: int(fields[key]) for key in ('blocks', 'expected') if fields.get(key, '').isdigit()}
+
+    def forget_outputs(self, paths):
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM outputs WHERE path=?', [(os.path.abspath(p),) for p in paths])
+
+    def is_done(self, output_dir, state, deep=False):
+        '''True if the state was recorded and all of its outputs still exist unchanged.'''
+        if self.state(output_dir, state) is None:
+            return False
+        for out in self.outputs(output_dir, state=state):
+            if not os.path.isfile(out['path']) or os.path.getsize(out['path']) != out['size']:
+                return False
+            if deep and out['checksum'] and sampled_checksum(out['path']) != out['checksum']:
+                return False
+        return True
+
+    def status(self, prefix):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT output_dir, state, ts, detail FROM states WHERE output_dir LIKE ? '
+                                'ORDER BY output_dir, ts', (prefix.rstrip('/') + '%',)).fetchall()
+        table = {}
+        for row in rows:
+            table.setdefault(row['output_dir'], []).append(row['state'])
+        return table
+
+def backfill(ledger, date_dir):
+    '''Registers existing target dirs whose three rawspec products pass fil_validate.'''
+    import fil_validate
+    n_marked = 0
+    for target in sorted(os.listdir(date_dir)):
+        output_dir = os.path.join(date_dir, target)
+        fils = [os.path.join(output_dir, f"{target}.rawspec.{p}.fil") for p in ['0000', '0001', '0002']]
+        if not all(os.path.isfile(f) for f in fils) or ledger.state(output_dir, 'channelised'):
+            continue
+        verdict = fil_validate.validate_target(output_dir, target)
+        if verdict['verdict'] != 'ok':
+            print(f"Skipping {target}: {' '.join(verdict['problems'])}")
+            continue
+        ledger.mark(output_dir, 'channelised', fils, detail='backfill', target=target)
+        n_marked += 1
+        pngs = [os.path.join(output_dir, f) for f in sorted(os.listdir(output_dir)) if f.endswith('.png')]
+        if pngs:
+            ledger.mark(output_dir, 'plotted', pngs, detail='backfill', checksum=False, target=target)
+    return n_marked
+
+def get_args():
+    parser = argparse.ArgumentParser(description='LOFTS processing state ledger.')
+    parser.add_argument('--db', type=str, default=LEDGER_PATH, help=f'Ledger path (default: {LEDGER_PATH}).')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    mark_p = sub.add_parser('mark', help='Record a state transition.')
+    mark_p.add_argument('output_dir'); mark_p.add_argument('state', choices=STATES)
+    mark_p.add_argument('files', nargs='*', help='Outputs produced by this state.')
+    mark_p.add_argument('--detail', type=str, default=None)
+    mark_p.add_argument('--session', type=str, default=None)
+    mark_p.add_argument('--target', type=str, default=None)
+    mark_p.add_argument('--station', type=str, default=None)
+
+    check_p = sub.add_parser('check', help='Exit 0 if a state is done and its outputs are intact.')
+    check_p.add_argument('output_dir'); check_p.add_argument('state', choices=STATES)
+    check_p.add_argument('--deep', action='store_true', help='Also re-verify checksums.')
+
+    out_p = sub.add_parser('outputs', help='Print recorded outputs that still exist.')
+    out_p.add_argument('output_dir'); out_p.add_argument('--kind', type=str, default=None)
+
+    status_p = sub.add_parser('status', help='States recorded under a directory prefix.')
+    status_p.add_argument('prefix', nargs='?', default='/')
+
+    blocks_p = sub.add_parser('blocks', help='Print the RAW blocks extracted; exit 1 unless checked against the .zst span.')
+    blocks_p.add_argument('output_dir')
+
+    back_p = sub.add_parser('backfill', help='Register products generated before the ledger existed.')
+    back_p.add_argument('date_dir')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    ledger = Ledger(args.db)
+    output_dir = os.path.abspath(args.output_dir).rstrip('/') if hasattr(args, 'output_dir') else None
+
+    if args.cmd == 'mark':
+        ledger.mark(output_dir, args.state, args.files, detail=args.detail,
+                    session=args.session, target=args.target, station=args.station)
+    elif args.cmd == 'check':
+        sys.exit(0 if ledger.is_done(output_dir, args.state, deep=args.deep) else 1)
+    elif args.cmd == 'outputs':
+        for out in ledger.outputs(output_dir, kind=args.kind):
+            if os.path.exists(out['path']):
+                print(out['path'])
+    elif args.cmd == 'status':
+        for path, states in ledger.status(os.path.abspath(args.prefix)).items():
+            print(f"{path:<70} {' '.join(states)}")
+    elif args.cmd == 'blocks':
+        blocks = ledger.extracted_blocks(output_dir)
+        if 'blocks' not in blocks or 'expected' not in blocks:
+            sys.exit(1)
+        print(blocks['blocks'])
+    elif args.cmd == 'backfill':
+        print(f"Registered {backfill(ledger, os.path.abspath(args.date_dir))} target(s).")
+
+if __name__ == "__main__":
+    main()
@@ -7,32 +7,18 @@
 station=$1
 path=$2
 
-
-# Check the station and set appropriate values
-if [ "$station" = "IE613" ]; then 
-    station_argument='n'
-    barycenter_path='/home/obs/linux_64/BaryCentricCorrection/barycentre_seti'
-elif [ "$station" = "SE607" ]; then
-    station_argument='p'
-    barycenter_path='/home/owen/BaryCentricCorrection/barycentre_seti'
-else 
+# Check the station
+if [ "$station" != "IE613" ] && [ "$station" != "SE607" ]; then 
     echo "Invalid station name. Please specify IE613 or SE607."
     exit 1
 fi
 
-# Find filterbank files
-filterbank_paths=$(find "$path" -name "*0000.fil")
+# Find (topocentric) filterbank files
+filterbank_paths=$(find "$path" -name "*0000.fil" ! -name "*.bary.0000.fil")
 echo "Number of filterbanks found: $(echo "$filterbank_paths" | wc -w)"
+[ -z "$filterbank_paths" ] && exit 0
 
-# Loop through filterbank files and display their header
-for filterbank in $filterbank_paths; do 
-    target=$(basename $filterbank | awk -F'.' '{print $1}')
-    echo "Target : $target"
-    $barycenter_path $filterbank -site $station_argument -verbose >  $path/$target.bary.0000.fil
-
-    # remove .bar file after barycentering
-    rm polyco.bar 
-
-    # Run turboSETI 
-    turboSETI -g -n 412 -s 10 -M 4 $path/$target.bary.0000.fil
-done 
\ No newline at end of file
+# Run turboSETI on every product at once, sharded by coarse channel over a process pool (see turboseti-shard.py).
+# No barycentred copy is written: barycentre.py computes one Doppler factor per observation from the header
+# and fills in the Corrected_Frequency of the merged <name>.0000.dat/.log written next to each product.
+python3 $(dirname "$(readlink -f "$0")")/turboseti-shard.py --session "$(basename "$path")" -s "$station" --turboseti-args "-g -s 10 -M 4" $filterbank_paths
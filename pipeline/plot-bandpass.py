@@ -2,6 +2,9 @@
 
 import argparse
 import os
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import your
 import numpy as np
 import matplotlib.pyplot as plt
@@ -9,12 +12,29 @@ from matplotlib import gridspec
 from matplotlib.ticker import FixedLocator
 import scienceplots; plt.style.use(['science','ieee', 'no-latex'])
 from tqdm import tqdm
+import sigproc_utils
+import pyramid_utils
+from colour_scale import QuantileSketch, colour_limits
+
+COARSE_CHANS = 412 # Coarse channels per LOFTS product (-b 0,412)
+PREVIEW_PIXELS = (1024, 1024) # (time, frequency) tiles requested from the preview pyramid
+SAMPLE_COLS = 2048 # frequency bins of the --sample bandpass (the saved panel is ~1500 px wide)
+SAVE_DPI = 300
 
 def get_args():
     # --- Parser ---
     parser = argparse.ArgumentParser(description='Dynamic Spectra Plotter for LOFTS data.')
-    parser.add_argument('-f', '--fil', type=str, help='Path of the filterbank file.', required = True)
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('-f', '--fil', type=str, help='Path of the filterbank file.')
+    input_group.add_argument('-d', '--dir', type=str, help='Plot every 0000/0001/0002 product found under this directory.')
     parser.add_argument('-s', '--station', type=str, help='Station where observation was taken.', required = False, default='UNKNOWN')
+    parser.add_argument('--stream', action='store_true', help='Memory-mapped, coarse-channel blocked reduction for the 0000 product.')
+    parser.add_argument('--pyramid', action='store_true', help='Plot the whole observation from the preview pyramid sidecar, if one exists.')
+    parser.add_argument('-m', '--mem-budget', type=float, help='Peak memory budget (MB) for --stream mode (default: 1024).', required = False, default=1024)
+    parser.add_argument('--peak', action='store_true', help='Max-pool dynamic spectra onto the pixel grid so narrowband RFI stays visible (default: mean).')
+    parser.add_argument('-n', '--sample', type=int, help='Also plot a time-resolved bandpass from N evenly spaced windows across the whole observation.', required = False, default=0)
+    parser.add_argument('--io-budget', type=float, help='Fraction of the file read by --sample (default: 0.01).', required = False, default=0.01)
+    parser.add_argument('-w', '--workers', type=int, help='Worker processes for --dir mode (default: 3).', required = False, default=3)
     return parser.parse_args()
 
 def obs_slice(hdr, len):
@@ -29,6 +49,56 @@ def obs_slice(hdr, len):
 
     return (ctr_sample - len/2), (len)
 
+def pyramid_data(hdr, nt_px, nf_px):
+    '''
+    Whole-observation mean dynamic spectrum, shape (nt, nifs, nf), from the preview
+    pyramid level matching the pixel grid. Returns None if there is no up-to-date sidecar
+    or no level is fine enough for the grid (the 0000 base level is capped by --max-dim).
+    '''
+    meta = pyramid_utils.load_meta(hdr.filename)
+    if meta is None:
+        print(f"No up-to-date pyramid for {hdr.basename}. Reading raw samples.")
+        return None
+
+    data, level = pyramid_utils.read_level(hdr.filename, nt_px, nf_px, meta=meta, strict=True)
+    if level is None:
+        print(f"No pyramid level of {hdr.basename} resolves {nt_px} x {nf_px} pixels. Reading raw samples.")
+        return None
+    print(f"Using pyramid level {level['file']} ({level['nt']} x {level['nf']})")
+    return np.asarray(data)
+
+def panel_pixels(ax, dpi=SAVE_DPI):
+    # (rows, cols) of device pixels the axes will occupy in the saved figure
+    bbox = ax.get_position()
+    fig_w, fig_h = ax.figure.get_size_inches()
+    return max(1, int(bbox.height * fig_h * dpi)), max(1, int(bbox.width * fig_w * dpi))
+
+def block_reduce(data, nrows, ncols, peak=False):
+    '''
+    Block-reduces a 2D array to at most (nrows, ncols) by averaging, or by max-pooling
+    when peak=True. Axes already within the grid are left untouched.
+    '''
+    for axis, npix in ((0, nrows), (1, ncols)):
+        nin = data.shape[axis]
+        if nin <= npix:
+            continue
+        edges = np.arange(npix) * nin // npix
+        if peak:
+            data = np.maximum.reduceat(data, edges, axis=axis)
+        else:
+            counts = np.diff(np.r_[edges, nin])
+            data = np.add.reduceat(data, edges, axis=axis) / np.expand_dims(counts, 1 - axis)
+    return data
+
+def show_panel(ax, data, peak=False, **imshow_kwargs):
+    '''
+    imshow on the axes' real pixel grid rather than the full-width array. The extent keeps
+    the original sample/channel coordinates, so tick positions are computed as before.
+    '''
+    nrows, ncols = data.shape
+    reduced = block_reduce(np.asarray(data), *panel_pixels(ax), peak=peak)
+    return ax.imshow(reduced, extent=(-0.5, ncols - 0.5, -0.5, nrows - 0.5), **imshow_kwargs)
+
 def set_color(station):
     if station == 'IE':
         return 'Greens'
@@ -71,27 +141,112 @@ def set_yticks(hdr, data_shape, nend, nticks=8):
 
     return ytick_pos, ytick_vals
 
-def plot_0000(fil_obj, hdr, save_path, station='N/A'):
+def stream_0000(fil_path, nstrt, nsamp, nslices=9, ncols=1024, mem_budget=1024):
+    '''
+    Out-of-core reduction of the 0000 product for plot_0000. The file is memory-mapped and
+    walked in blocks of whole coarse channels, so peak memory is set by mem_budget (MB)
+    rather than by the ~27M channel width of the file. In one pass this accumulates:
+    - the time-averaged spectrum, binned to nslices * ncols points
+    - one (nsamp, ncols) block-averaged image per frequency slice
+    - a QuantileSketch per slice for the 5th/95th percentile colour scale
+    '''
+    hdr = sigproc_utils.read_header(fil_path)
+    fil_mm = sigproc_utils.open_memmap(fil_path, hdr)
+
+    nchans = hdr['nchans']
+    nstrt = int(nstrt)
+    nsamp = min(int(nsamp), hdr['nspectra'] - nstrt)
+    freq_slice = nchans // nslices
+    nbins = nslices * ncols
+
+    # Block width in whole coarse channels, counting the read block and its float64 working copy.
+    # The panel and slice selections below are slices of that copy (views), not further copies.
+    fine_per_coarse = max(1, nchans // COARSE_CHANS)
+    coarse_bytes = nsamp * fine_per_coarse * (fil_mm.itemsize + 8)
+    block_chans = max(1, int(mem_budget * 1024**2 // coarse_bytes)) * fine_per_coarse
+
+    spec_sum = np.zeros(nbins); spec_cnt = np.zeros(nbins)
+    img_sum = np.zeros((nsamp, nbins)); img_cnt = np.zeros(nbins)
+    sketches = [QuantileSketch() for _ in range(nslices)]
+
+    for c0 in tqdm(range(0, nchans, block_chans), desc='Streaming coarse-channel blocks'):
+        c1 = min(c0 + block_chans, nchans)
+        block = np.asarray(fil_mm[nstrt:nstrt + nsamp, 0, c0:c1], dtype=np.float64)
+        cols = np.arange(c0, c1)
+
+        # --- Mean spectrum ---
+        spec_bin = cols * nbins // nchans
+        spec_sum += np.bincount(spec_bin, weights=block.mean(axis=0), minlength=nbins)
+        spec_cnt += np.bincount(spec_bin, minlength=nbins)
+
+        # --- Slice images (columns past nslices * freq_slice are not shown, as before) ---
+        # Panels and slices are contiguous in channel, so plain slices keep these as views of block
+        n_in = max(0, min(c1, nslices * freq_slice) - c0)
+        if n_in == 0:
+            continue
+        pcols = cols[:n_in]
+        pblock = block[:, :n_in]
+        pix = (pcols // freq_slice) * ncols + (pcols % freq_slice) * ncols // freq_slice
+        starts = np.flatnonzero(np.r_[True, np.diff(pix) != 0])
+        img_sum[:, pix[starts]] += np.add.reduceat(pblock, starts, axis=1)
+        img_cnt[pix[starts]] += np.diff(np.r_[starts, len(pix)])
+
+        # --- Colour scale ---
+        for i in range(pcols[0] // freq_slice, pcols[-1] // freq_slice + 1):
+            s0 = max(i * freq_slice - c0, 0)
+            s1 = min((i + 1) * freq_slice - c0, n_in)
+            sketches[i].add(pblock[:, s0:s1])
+
+    spectrum = spec_sum / np.maximum(spec_cnt, 1)
+    images = img_sum / np.maximum(img_cnt, 1)
+    images = [images[:, i * ncols:(i + 1) * ncols] for i in range(nslices)]
+    limits = [sketch.percentile([5, 95]) for sketch in sketches]
+
+    return spectrum, images, limits
+
+def plot_0000(fil_obj, hdr, save_path, station='N/A', stream=False, mem_budget=1024, pyramid=False, peak=False):
     nstrt, nend = obs_slice(hdr, 16)
-    fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend)
+    stix_len = 9 # Number of frequency slices
 
-    print(fil_data.shape)
-    spectrum = np.mean(fil_data, axis=0)
+    pyr_data = pyramid_data(hdr, PREVIEW_PIXELS[0], stix_len * PREVIEW_PIXELS[1]) if pyramid else None
+
+    if pyr_data is not None:
+        nend = hdr.native_nspectra
+        pyr_data = pyr_data[:, 0, :]
+        print(pyr_data.shape)
+        spectrum = np.mean(pyr_data, axis=0)
+
+        slice_px = pyr_data.shape[1] // stix_len
+        images = [pyr_data[:, i * slice_px:(i + 1) * slice_px] for i in range(stix_len)]
+        limits = [colour_limits(data_slice) for data_slice in images]
+    elif stream:
+        spectrum, images, limits = stream_0000(hdr.filename, nstrt, nend, nslices=stix_len,
+                                               mem_budget=mem_budget)
+        print(images[0].shape)
+    else:
+        fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend)
 
-    stix_len = 9 # Number of frequency slices
-    freq_slice = fil_data.shape[1] // stix_len
+        print(fil_data.shape)
+        spectrum = np.mean(fil_data, axis=0)
+
+        freq_slice = fil_data.shape[1] // stix_len
+        images = [fil_data[:, i * freq_slice:(i + 1) * freq_slice] for i in range(stix_len)]
+        limits = [colour_limits(data_slice) for data_slice in images]
+
+    freq_slice = hdr.nchans // stix_len
 
     # --- Plotting ---
     fig = plt.figure(figsize=(10, 8))
     gs = gridspec.GridSpec(4, 3, figure=fig)
 
     ax0 = plt.subplot(gs[0, :])
-    ax0.plot(spectrum, color='k', lw=1)
+    spec_px = block_reduce(np.asarray(spectrum)[None, :], 1, panel_pixels(ax0)[1], peak=peak)[0]
+    ax0.plot(np.linspace(0, len(spectrum) - 1, len(spec_px)), spec_px, color='k', lw=1)
     ax0.set_yscale('log')
     # ax0.set_xlabel("Frequency [MHz]")
     ax0.set_ylabel("Power [Arb.]")
 
-    xtick_vals, tick_positions = set_xticks(hdr, fil_data.shape)
+    xtick_vals, tick_positions = set_xticks(hdr, (1, len(spectrum)))
     tick_labels = [str(int(round(val))) for val in xtick_vals]
     ax0.set_xticks(tick_positions)
     ax0.set_xticklabels(tick_labels)
@@ -101,9 +256,10 @@ def plot_0000(fil_obj, hdr, save_path, station='N/A'):
     for i, ax in tqdm(enumerate(axes), total=len(axes), desc='Plotting Frequency Slices'):
         strt_idx = i * freq_slice
         end_idx = strt_idx + freq_slice
-        data_slice = fil_data[:, strt_idx:end_idx]
-        ax.imshow(data_slice, aspect='auto', cmap=set_color(station), origin='lower',
-                  vmin=np.percentile(data_slice, 5), vmax=np.percentile(data_slice, 95))
+        data_slice = images[i]
+        vmin, vmax = limits[i]
+        show_panel(ax, data_slice, peak=peak, aspect='auto', cmap=set_color(station), origin='lower',
+                  vmin=vmin, vmax=vmax)
 
         top_freq = hdr.fch1 + strt_idx * hdr.foff
         bottom_freq = hdr.fch1 + (end_idx - 1) * hdr.foff
@@ -118,7 +274,7 @@ def plot_0000(fil_obj, hdr, save_path, station='N/A'):
             ax.set_xlabel("Frequency [MHz]")
 
         if i % 3 == 0:
-            ytick_pos, ytick_vals = set_yticks(hdr, fil_data.shape, nend, nticks=7)
+            ytick_pos, ytick_vals = set_yticks(hdr, data_slice.shape, nend, nticks=7)
             ax.set_yticks(ytick_pos[1:-1])
             ax.set_yticklabels([f"{val:.1f}" for val in ytick_vals[1:-1]])
             ax.set_ylabel("Time [s]")
@@ -131,13 +287,18 @@ def plot_0000(fil_obj, hdr, save_path, station='N/A'):
     ax0.text(0.5, 1.05, metadata, transform=ax0.transAxes, ha='left', va='bottom')
 
     # --- Save ---
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.savefig(save_path, dpi=SAVE_DPI, bbox_inches='tight')
     print(f"Saved plot to {save_path}")
 
-def plot_0001(fil_obj, hdr, save_path, station='N/A'):
+def plot_0001(fil_obj, hdr, save_path, station='N/A', pyramid=False, peak=False):
 
-    nstrt, nend = obs_slice(hdr, 1000)
-    fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend)
+    fil_data = pyramid_data(hdr, *PREVIEW_PIXELS) if pyramid else None
+    if fil_data is not None:
+        fil_data = fil_data[:, 0, :]
+        nend = hdr.native_nspectra
+    else:
+        nstrt, nend = obs_slice(hdr, 1000)
+        fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend)
     print(fil_data.shape)
 
     spectrum = np.mean(fil_data, axis=0)
@@ -155,8 +316,8 @@ def plot_0001(fil_obj, hdr, save_path, station='N/A'):
     ax0.tick_params(labelbottom=False)
 
     imshow_col = set_color(station)
-    vmin, vmax = np.percentile(fil_data, [5, 95])
-    ax1.imshow(fil_data, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
+    vmin, vmax = colour_limits(fil_data)
+    show_panel(ax1, fil_data, peak=peak, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
 
     xtick_vals, tick_positions = set_xticks(hdr, fil_data.shape)
     tick_labels = [str(int(round(val))) for val in xtick_vals]
@@ -173,13 +334,17 @@ def plot_0001(fil_obj, hdr, save_path, station='N/A'):
     ax0.text(0.5, 1.05, metadata, transform=ax0.transAxes, ha='left', va='bottom')
 
     # --- Save ---
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.savefig(save_path, dpi=SAVE_DPI, bbox_inches='tight')
     print(f"Saved plot to {save_path}")
 
-def plot_0002(fil_obj, hdr, save_path, station='N/A'):
+def plot_0002(fil_obj, hdr, save_path, station='N/A', pyramid=False, peak=False):
 
-    nstrt, nend = obs_slice(hdr, 256)
-    fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend, npoln=4)
+    fil_data = pyramid_data(hdr, *PREVIEW_PIXELS) if pyramid else None
+    if fil_data is not None:
+        nend = hdr.native_nspectra
+    else:
+        nstrt, nend = obs_slice(hdr, 256)
+        fil_data = fil_obj.get_data(nstart=nstrt, nsamp=nend, npoln=4)
     print(fil_data.shape)
 
     spec_I = np.mean(fil_data[0], axis=0)
@@ -211,8 +376,8 @@ def plot_0002(fil_obj, hdr, save_path, station='N/A'):
 
     # --- Dynamic Spectra : Stokes I ---
     stokesI = fil_data[:,0,:]
-    vmin, vmax = np.percentile(stokesI[0], [5, 95])
-    ax1.imshow(stokesI, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
+    vmin, vmax = colour_limits(stokesI[0])
+    show_panel(ax1, stokesI, peak=peak, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
 
     ytick_pos, ytick_vals = set_yticks(hdr, fil_data.shape, nend, nticks=7)
     ax1.set_yticks(ytick_pos[1:-1])
@@ -222,8 +387,8 @@ def plot_0002(fil_obj, hdr, save_path, station='N/A'):
 
     # --- Dynamic Spectra : Stokes Q ---
     stokesQ = fil_data[:,1,:]
-    vmin, vmax = np.percentile(stokesQ[0], [5, 95])
-    ax2.imshow(stokesQ, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
+    vmin, vmax = colour_limits(stokesQ[0])
+    show_panel(ax2, stokesQ, peak=peak, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
 
     ytick_pos, ytick_vals = set_yticks(hdr, fil_data.shape, nend, nticks=7)
     ax2.set_yticks(ytick_pos[1:-1])
@@ -233,8 +398,8 @@ def plot_0002(fil_obj, hdr, save_path, station='N/A'):
 
     # --- Dynamic Spectra : Stokes U ---
     stokesU = fil_data[:,2,:]
-    vmin, vmax = np.percentile(stokesU[0], [5, 95])
-    ax3.imshow(stokesU, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
+    vmin, vmax = colour_limits(stokesU[0])
+    show_panel(ax3, stokesU, peak=peak, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
 
     ytick_pos, ytick_vals = set_yticks(hdr, fil_data.shape, nend, nticks=7)
     ax3.set_yticks(ytick_pos[1:-1])
@@ -244,8 +409,8 @@ def plot_0002(fil_obj, hdr, save_path, station='N/A'):
 
     # --- Dynamic Spectra : Stokes V ---
     stokesV = fil_data[:,3,:]
-    vmin, vmax = np.percentile(stokesV[0], [5, 95])
-    ax4.imshow(stokesV, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
+    vmin, vmax = colour_limits(stokesV[0])
+    show_panel(ax4, stokesV, peak=peak, aspect='auto', cmap=imshow_col, origin='lower', vmin=vmin, vmax=vmax)
 
     ax4.set_yticks(ytick_pos[1:-1])
     ax4.set_yticklabels([f"{val:.1f}" for val in ytick_vals[1:-1]])
@@ -269,45 +434,187 @@ def plot_0002(fil_obj, hdr, save_path, station='N/A'):
     ax0.text(0.5, 1.05, metadata, transform=ax0.transAxes, ha='left', va='bottom')
 
     # --- Save ---
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.savefig(save_path, dpi=SAVE_DPI, bbox_inches='tight')
     print(f"Saved plot to {save_path}")
 
-def main():
-    args = get_args()
+def strided_bandpass(fil_path, nwindows, io_frac=0.01, threads=4, ncols=SAMPLE_COLS, mem_budget=1024):
+    '''
+    Mean spectrum of nwindows evenly spaced windows spanning the whole observation, with the
+    total read capped at io_frac of the file. Windows are read by a thread pool but submitted
+    and returned in file order. Each window is read in channel blocks sized from mem_budget (MB,
+    shared by the threads) and binned to at most ncols frequency bins, so memory does not grow
+    with the channel count. Returns (bandpass [nwindows, bins], window centres in spectra), or
+    None if the budget allows fewer than two windows (e.g. the ~83-spectrum 0000 product).
+    '''
+    hdr = sigproc_utils.read_header(fil_path)
+    fil_mm = sigproc_utils.open_memmap(fil_path, hdr)
+    nspectra, nchans = hdr['nspectra'], hdr['nchans']
+
+    budget = int(io_frac * nspectra)
+    if budget < 2:
+        print(f"I/O budget allows {budget} of {nspectra} spectra; too few for a time-resolved sample.")
+        return None
+    if budget < nwindows:
+        print(f"I/O budget allows {budget} spectra; reducing to {budget} window(s) of 1 spectrum.")
+        nwindows = budget
+    win_len = max(1, budget // nwindows)
+
+    starts = np.linspace(0, nspectra - win_len, nwindows).astype(int)
+    ncols = min(ncols, nchans)
+    col_bin = np.arange(nchans) * ncols // nchans
+    col_cnt = np.bincount(col_bin, minlength=ncols)
+    # read block plus its float64 mean, per thread
+    block_chans = max(1, int(mem_budget * 1024**2 / threads // (win_len * (fil_mm.itemsize + 8))))
+
+    def read_window(strt):
+        sums = np.zeros(ncols)
+        for c0 in range(0, nchans, block_chans):
+            c1 = min(c0 + block_chans, nchans)
+            mean = np.mean(fil_mm[strt:strt + win_len, 0, c0:c1], axis=0, dtype=np.float64)
+            sums += np.bincount(col_bin[c0:c1], weights=mean, minlength=ncols)
+        return sums / col_cnt
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        bandpass = np.stack(list(pool.map(read_window, starts)))
+
+    print(f"Read {nwindows} x {win_len} spectra ({100 * nwindows * win_len / nspectra:.2f}% of file)")
+    return bandpass, starts + win_len / 2
+
+def plot_sampled(hdr, save_path, station='N/A', nwindows=64, io_frac=0.01, peak=False, mem_budget=1024):
+    sampled = strided_bandpass(hdr.filename, nwindows, io_frac=io_frac, mem_budget=mem_budget)
+    if sampled is None:
+        print(f"Skipping the sampled bandpass of {hdr.basename}.")
+        return
+    bandpass, centres = sampled
+    median_bp = np.median(bandpass, axis=0)
+
+    # Each window relative to the median bandpass, so transient RFI stands out
+    ratio = bandpass / np.where(median_bp == 0, 1, median_bp)
 
-    # For interactive debugging
-    # args = {'fil': './B1508+55/B1508+55.rawspec.0000.fil',
-    #         'station': 'IE'}
+    # --- Plotting ---
+    fig = plt.figure(figsize=(5, 4))
+    gs = gridspec.GridSpec(2, 1, height_ratios=[1, 3], hspace=0)
+
+    ax0 = plt.subplot(gs[0])
+    ax1 = plt.subplot(gs[1], sharex=ax0)
 
-    # --- Loading filterbank data ---
-    fil_path = args.fil
-    station = args.station
-    # fil_path = args['fil']
-    # station = args['station']
+    spec_px = block_reduce(median_bp[None, :], 1, panel_pixels(ax0)[1], peak=peak)[0]
+    ax0.plot(np.linspace(0, len(median_bp) - 1, len(spec_px)), spec_px, color='k', lw=1)
+    ax0.set_yscale('log')
+    ax0.tick_params(labelbottom=False)
+
+    vmin, vmax = colour_limits(ratio)
+    show_panel(ax1, ratio, peak=peak, aspect='auto', cmap=set_color(station), origin='lower', vmin=vmin, vmax=vmax)
+
+    xtick_vals, tick_positions = set_xticks(hdr, ratio.shape)
+    ax1.set_xticks(tick_positions); ax1.set_xticklabels([str(int(round(val))) for val in xtick_vals])
+    ax1.set_xlabel('Frequency [MHz]')
+
+    ytick_pos = np.linspace(0, len(centres) - 1, min(len(centres), 6))
+    ax1.set_yticks(ytick_pos)
+    ax1.set_yticklabels([f"{np.interp(pos, np.arange(len(centres)), centres) * hdr.tsamp / 60:.1f}" for pos in ytick_pos])
+    ax1.set_ylabel('Time [min]')
+
+    # --- Metadata ---
+    metadata = get_metadata(hdr, station)
+    metadata += f"Sampled windows: {len(centres)}\n"
+    ax0.text(0.5, 1.05, metadata, transform=ax0.transAxes, ha='left', va='bottom')
+
+    # --- Save ---
+    plt.savefig(save_path, dpi=SAVE_DPI, bbox_inches='tight')
+    print(f"Saved plot to {save_path}")
+
+def plot_file(fil_path, station='UNKNOWN', stream=False, mem_budget=1024, pyramid=False, peak=False,
+              sample=0, io_budget=0.01):
+    '''
+    Plots a single product and returns the wall time taken. The header is read once
+    from the same your.Your object that serves the data.
+    '''
+    strt = time.time()
     save_plt = fil_path.replace('.fil', '.png')
 
-    header = your.Your(fil_path).your_header
     fil_obj = your.Your(fil_path)
+    header = fil_obj.your_header
 
     fil_basename = os.path.basename(fil_path)
     print('Plotting %s' % fil_basename)
 
     if '0000.fil' in fil_basename:
         print('Narrowband filterbank ingested.')
-        plot_0000(fil_obj, header, save_plt, station=station)
+        plot_0000(fil_obj, header, save_plt, station=station, stream=stream, mem_budget=mem_budget, pyramid=pyramid, peak=peak)
 
     elif '0001.fil' in fil_basename:
         print('Fast transient filterbank ingested.')
-        plot_0001(fil_obj, header, save_plt, station=station)
+        plot_0001(fil_obj, header, save_plt, station=station, pyramid=pyramid, peak=peak)
 
     elif '0002.fil' in fil_basename:
         print('Full stokes mid resoltution filterbank ingested.')
-        plot_0002(fil_obj, header, save_plt, station=station)
+        plot_0002(fil_obj, header, save_plt, station=station, pyramid=pyramid, peak=peak)
 
 
     else:
         raise ValueError("No BL data product detected.")
 
+    plt.close('all')
+
+    if sample > 0:
+        plot_sampled(header, fil_path.replace('.fil', '.sampled.png'), station=station,
+                     nwindows=sample, io_frac=io_budget, peak=peak, mem_budget=mem_budget)
+        plt.close('all')
+
+    return time.time() - strt
+
+def find_products(dir_path):
+    products = []
+    for product in ['0000', '0001', '0002']:
+        products += glob.glob(os.path.join(dir_path, '**', f'*.rawspec.{product}.fil'), recursive=True)
+    return sorted(products)
+
+def plot_dir(dir_path, workers, **plot_kwargs):
+    '''
+    Batch mode: imports are paid once and products are rendered through a bounded process
+    pool. A failure on one file is reported without stopping the rest of the batch.
+    '''
+    fil_paths = find_products(dir_path)
+    print(f"Number of filterbanks found: {len(fil_paths)}")
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {fil_path: pool.submit(plot_file, fil_path, **plot_kwargs) for fil_path in fil_paths}
+        for fil_path, future in futures.items():
+            try:
+                timings[fil_path] = future.result()
+            except Exception as e:
+                print(f"Plotting failed for {fil_path}: {e}")
+                timings[fil_path] = None
+
+    # --- Timing summary ---
+    print("===== Plot timings =====")
+    for fil_path, elapsed in timings.items():
+        status = f"{elapsed:8.1f} s" if elapsed is not None else "  FAILED"
+        print(f"{status}  {os.path.basename(fil_path)}")
+
+    n_failed = sum(elapsed is None for elapsed in timings.values())
+    return n_failed
+
+def main():
+    args = get_args()
+
+    # For interactive debugging
+    # args = {'fil': './B1508+55/B1508+55.rawspec.0000.fil',
+    #         'station': 'IE'}
+
+    plot_kwargs = {'station': args.station, 'stream': args.stream,
+                   'mem_budget': args.mem_budget, 'pyramid': args.pyramid, 'peak': args.peak,
+                   'sample': args.sample, 'io_budget': args.io_budget}
+
+    if args.dir:
+        n_failed = plot_dir(args.dir, args.workers, **plot_kwargs)
+        if n_failed:
+            raise SystemExit(f"{n_failed} file(s) failed to plot.")
+    else:
+        plot_file(args.fil, **plot_kwargs)
+
 
 if __name__ == "__main__":
     main()
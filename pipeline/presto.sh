@@ -21,11 +21,9 @@ if [ -f "${path}/${target}_prestomask/${target}_rfifind.mask" ]; then
     echo "Mask already exists. Exiting..."
 
 else
-    echo "Generating mask for $target using PRESTO"
-    docker run --rm -u root -v "$PWD":"$PWD" -w "$PWD" alex88ridolfi/presto5:latest rfifind -time 10 -ncpus 4 -noclip -freqsig 8 -timesig 8 -chanfrac 0.6 -intfrac 0.6 -o "${target}_prestomask/${target}" "$filterbank"
-
-    # Uncomment the following lines if you want to convert .ps files to .png
-    # for file in "${path}/${target}_prestomask/"*.ps; do
-    #     convert -density 300 -rotate 90 "$file" "${file%.ps}.png"
-    # done
+    echo "Generating mask for $target"
+    # rfifind -time 10 -noclip -freqsig 8 -timesig 8 -chanfrac 0.6 -intfrac 0.6, computed natively over all CPUs
+    # (see rfimask.py); writes the same PRESTO .mask, but none of rfifind's .ps/.stats/.rfi files
+    python3 $(dirname "$(readlink -f "$0")")/rfimask.py -t 10 --freqsig 8 --timesig 8 --chanfrac 0.6 --intfrac 0.6 \
+        -w $(nproc) -o "${path}/${target}_prestomask/${target}" "$filterbank"
 fi
@@ -0,0 +1,200 @@
+"""
+Code Purpose: Multi-resolution preview pyramid for LOFTS filterbank products.
+Each level stores the mean/min/max of every (time x frequency) tile at power-of-two
+decimations, written once per product to a <name>.pyramid/ sidecar of .npy files that
+are memory-mapped on read. Quick-looks then read the level matching their pixel grid
+instead of re-reading raw samples from the .fil.
+
+Sidecar layout:
+    <name>.pyramid/meta.json       source size/mtime, header values and level table
+    <name>.pyramid/L<tf>x<ff>.npy  float32, shape (3, nt, nifs, nf) -> mean, min, max
+"""
+
+import os
+import json
+import numpy as np
+import sigproc_utils
+
+STATS = ['mean', 'min', 'max']
+
+def sidecar_path(fil_path):
+    return os.path.splitext(fil_path)[0] + '.pyramid'
+
+def _tile_edges(n, factor):
+    edges = np.arange(0, n, factor)
+    counts = np.diff(np.r_[edges, n])
+    return edges, counts
+
+def _reduce(stats, counts, axis, factor):
+    # Merge tiles of a (sum, min, max) stack along one axis of (nt, nifs, nf); sums are kept
+    # un-normalised so partial end tiles stay exact
+    edges, _ = _tile_edges(stats.shape[axis + 1], factor)
+    return (np.stack([np.add.reduceat(stats[0], edges, axis=axis),
+                      np.minimum.reduceat(stats[1], edges, axis=axis),
+                      np.maximum.reduceat(stats[2], edges, axis=axis)]),
+            np.add.reduceat(counts, edges))
+
+def _base_factor(n, max_dim):
+    factor = 1
+    while -(-n // factor) > max_dim:
+        factor *= 2
+    return factor
+
+def _row_chunk(row_bytes, mem_budget, align=1):
+    return max(1, int(mem_budget * 1024**2 // row_bytes) // align) * align
+
+def build_pyramid(fil_path, max_dim=4096, min_dim=32, mem_budget=512):
+    '''
+    Streams the filterbank once to form the base level (each axis decimated by a power of
+    two until it is <= max_dim) and then halves both axes per level until they reach min_dim.
+    The un-normalised sum/min/max of each level is kept in a float64 scratch .npy in the
+    sidecar, so every pass (the .fil read, each level write and each halving) works on
+    chunks of rows bounded by mem_budget (MB) rather than on a whole level in memory.
+    '''
+    hdr = sigproc_utils.read_header(fil_path)
+    fil_mm = sigproc_utils.open_memmap(fil_path, hdr)
+    nspectra, nifs, nchans = fil_mm.shape
+
+    tf = _base_factor(nspectra, max_dim)
+    ff = _base_factor(nchans, max_dim)
+    f_edges, f_counts = _tile_edges(nchans, ff)
+    t_counts = _tile_edges(nspectra, tf)[1]
+
+    out_dir = sidecar_path(fil_path)
+    os.makedirs(out_dir, exist_ok=True)
+    # a rebuild must not leave the old meta.json describing the half-written new levels
+    meta_path = os.path.join(out_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # ===== Base level, streamed from the .fil =====
+    scratch_paths = [os.path.join(out_dir, f'scratch{i}.npy') for i in range(2)]
+    stats = np.lib.format.open_memmap(scratch_paths[0], mode='w+', dtype=np.float64,
+                                      shape=(3, len(t_counts), nifs, len(f_counts)))
+
+    chunk = _row_chunk(nifs * nchans * 8, mem_budget, tf)
+    for t0 in range(0, nspectra, chunk):
+        block = np.asarray(fil_mm[t0:t0 + chunk], dtype=np.float64)
+        t_edges, _ = _tile_edges(block.shape[0], tf)
+        r0 = t0 // tf; r1 = r0 + len(t_edges)
+        stats[0, r0:r1] = np.add.reduceat(np.add.reduceat(block, f_edges, axis=2), t_edges, axis=0)
+        stats[1, r0:r1] = np.minimum.reduceat(np.minimum.reduceat(block, f_edges, axis=2), t_edges, axis=0)
+        stats[2, r0:r1] = np.maximum.reduceat(np.maximum.reduceat(block, f_edges, axis=2), t_edges, axis=0)
+        del block
+
+    # ===== Levels, each written and halved in row chunks =====
+    levels = []
+    while True:
+        nt, nf = stats.shape[1], stats.shape[3]
+        # a chunk of float64 stats plus its reductions and float32 output stays within ~2x its size
+        rows = _row_chunk(2 * 3 * nifs * nf * 8, mem_budget, 2)
+
+        name = f"L{tf}x{ff}.npy"
+        level = np.lib.format.open_memmap(os.path.join(out_dir, name), mode='w+', dtype=np.float32,
+                                          shape=(3, nt, nifs, nf))
+        for r0 in range(0, nt, rows):
+            part = np.asarray(stats[:, r0:r0 + rows])
+            level[0, r0:r0 + rows] = part[0] / (t_counts[r0:r0 + rows, None, None] * f_counts[None, None, :])
+            level[1:, r0:r0 + rows] = part[1:]
+        level.flush()
+        del level
+        levels.append({'tf': tf, 'ff': ff, 'nt': int(nt), 'nf': int(nf), 'file': name})
+
+        if nt <= min_dim and nf <= min_dim:
+            break
+
+        halve_t, halve_f = nt > min_dim, nf > min_dim
+        scratch_paths.reverse()
+        nxt = np.lib.format.open_memmap(scratch_paths[0], mode='w+', dtype=np.float64,
+                                        shape=(3, -(-nt // 2) if halve_t else nt, nifs, -(-nf // 2) if halve_f else nf))
+        for r0 in range(0, nt, rows):
+            part = np.asarray(stats[:, r0:r0 + rows])
+            if halve_t:
+                part, _ = _reduce(part, t_counts[r0:r0 + rows], 0, 2)
+            if halve_f:
+                part, _ = _reduce(part, f_counts, 2, 2)
+            n0 = r0 // 2 if halve_t else r0
+            nxt[:, n0:n0 + part.shape[1]] = part
+        del stats
+        stats = nxt
+
+        if halve_t:
+            t_counts = np.add.reduceat(t_counts, _tile_edges(nt, 2)[0])
+            tf *= 2
+        if halve_f:
+            f_counts = np.add.reduceat(f_counts, _tile_edges(nf, 2)[0])
+            ff *= 2
+
+    del stats
+    for scratch_path in scratch_paths:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+    meta = {'source': os.path.basename(fil_path),
+            'source_size': hdr['file_size'],
+            'source_mtime': os.path.getmtime(fil_path),
+            'nspectra': nspectra, 'nifs': nifs, 'nchans': nchans,
+            'fch1': hdr['fch1'], 'foff': hdr['foff'], 'tsamp': hdr['tsamp'],
+            'levels': levels}
+
+    # meta.json is written last so a partial sidecar is never picked up as valid
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    return meta
+
+def load_meta(fil_path):
+    '''Returns the sidecar metadata, or None if missing or stale relative to the .fil.'''
+    meta_path = os.path.join(sidecar_path(fil_path), 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    if meta['source_size'] != os.path.getsize(fil_path) or \
+       meta['source_mtime'] < os.path.getmtime(fil_path):
+        return None
+
+    return meta
+
+def select_level(meta, nt_px, nf_px, nspectra=None, nchans=None, strict=False):
+    '''
+    Coarsest level that still has at least nt_px x nf_px tiles over the requested
+    span (defaults to the whole product; a request beyond the span asks for every sample).
+    Falls back to the finest stored level, or returns None if strict.
+    '''
+    nspectra = meta['nspectra'] if nspectra is None else nspectra
+    nchans = meta['nchans'] if nchans is None else nchans
+    nt_px = min(nt_px, nspectra); nf_px = min(nf_px, nchans)
+
+    for level in reversed(meta['levels']):
+        if nspectra / level['tf'] >= nt_px and nchans / level['ff'] >= nf_px:
+            return level
+
+    return None if strict else meta['levels'][0]
+
+def read_level(fil_path, nt_px, nf_px, nstart=0, nsamp=None, cstart=0, nchan=None, stat='mean', meta=None,
+               strict=False):
+    '''
+    Reads a (time, freq) window from the pyramid level matching the output pixel grid.
+    Returns a memmap slice of shape (nt, nifs, nf) and the level used. With strict, returns
+    (None, None) when no stored level is fine enough for the grid.
+    '''
+    if meta is None:
+        meta = load_meta(fil_path)
+        if meta is None:
+            raise FileNotFoundError(f"No up-to-date pyramid sidecar for {fil_path}")
+
+    nsamp = meta['nspectra'] - nstart if nsamp is None else nsamp
+    nchan = meta['nchans'] - cstart if nchan is None else nchan
+
+    level = select_level(meta, nt_px, nf_px, nsamp, nchan, strict=strict)
+    if level is None:
+        return None, None
+    pyr = np.load(os.path.join(sidecar_path(fil_path), level['file']), mmap_mode='r')
+
+    t0 = nstart // level['tf']; t1 = -(-(nstart + nsamp) // level['tf'])
+    c0 = cstart // level['ff']; c1 = -(-(cstart + nchan) // level['ff'])
+
+    return pyr[STATS.index(stat), t0:t1, :, c0:c1], level
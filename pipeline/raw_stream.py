@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Stream GUPPI RAW blocks from lofar_udp_extractor to rawspec through named pipes,
+so the .raw output never lands on disk.
+
+    extractor -> <stem>.extract.fifo -> broker (bounded ring of blocks) -> <stem>.0000.raw (fifo) -> rawspec
+
+The broker reads whole blocks (header cards up to END, then BLOCSIZE bytes of payload) and checks
+each one before passing it on:
+  - the header parses and ends with an END card;
+  - BLOCSIZE, OBSNCHAN, NPOL and NBITS stay constant, and BLOCSIZE matches the channel geometry;
+  - the payload is complete (a short read at EOF is a truncated block);
+  - PKTIDX advances by one block's worth of packets (gaps are counted, or fatal with --strict).
+Backpressure comes from the ring: when rawspec falls behind, the ring fills, the broker stops
+reading, and the extractor blocks on its pipe write. Memory is bounded by ring_blocks blocks.
+
+    raw_stream.py broker IN_FIFO OUT_FIFO [--ring-blocks 4] [--strict] [--stats stats.json]
+    raw_stream.py selftest [--blocks 64] [--corrupt gap|truncate|header] [--consumer-delay 0.01]
+
+selftest runs a synthetic producer and consumer through real FIFOs and checks that every block
+arrives intact and in order.
+
+EXPERIMENTAL: selftest uses a sequential consumer, not rawspec. If rawspec's reader lseek()s
+on its input it gets ESPIPE on the pipe, so check a real scan before relying on this mode.
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+from guppi_raw import CARD, MAX_HEADER_CARDS, parse_card, padded
+
+class BlockError(Exception):
+    pass
+
+# ===== GUPPI blocks =====
+def make_header(cards):
+    '''GUPPI header bytes for a dict of cards (used by the synthetic producer).'''
+    lines = []
+    for key, value in cards.items():
+        value = f"'{value:<8}'" if isinstance(value, str) else str(value)
+        lines.append(f"{key:<8}= {value:<70}"[:CARD])
+    lines.append('END'.ljust(CARD))
+    return ''.join(lines).encode('ascii')
+
+def read_exact(f, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = f.read(n - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+def read_block(f):
+    '''
+    Reads one block from a sequential stream. Returns (header dict, header bytes, payload bytes),
+    or None at a clean EOF between blocks. Raises BlockError on malformed or truncated blocks.
+    '''
+    raw_cards = []
+    for _ in range(MAX_HEADER_CARDS):
+        card = read_exact(f, CARD)
+        if not card and not raw_cards:
+            return None
+        if len(card) < CARD:
+            raise BlockError(f"truncated header ({len(raw_cards)} cards read)")
+        raw_cards.append(card)
+        if card[:8].strip() == b'END':
+            break
+    else:
+        raise BlockError(f"no END card in the first {MAX_HEADER_CARDS} header cards")
+
+    try:
+        hdr = dict(parse_card(card.decode('ascii')) for card in raw_cards[:-1])
+    except UnicodeDecodeError:
+        raise BlockError("header is not ASCII")
+    if not isinstance(hdr.get('BLOCSIZE'), int) or hdr['BLOCSIZE'] <= 0:
+        raise BlockError(f"missing or invalid BLOCSIZE: {hdr.get('BLOCSIZE')!r}")
+
+    directio = int(hdr.get('DIRECTIO', 0)) == 1
+    header = b''.join(raw_cards)
+    header += read_exact(f, padded(len(header), directio) - len(header))
+    payload_len = padded(hdr['BLOCSIZE'], directio)
+    payload = read_exact(f, payload_len)
+    if len(payload) < payload_len:
+        raise BlockError(f"truncated payload ({len(payload)} of {payload_len} bytes)")
+    return hdr, header, payload
+
+class BlockChecker:
+    '''Cross-block integrity checks; gaps are counted, everything else raises BlockError.'''
+
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.first = None
+        self.last_pktidx = None
+        self.pkt_step = None
+        self.gaps = 0
+        self.missing_blocks = 0
+
+    def check(self, hdr):
+        geometry = {k: hdr.get(k) for k in ('BLOCSIZE', 'OBSNCHAN', 'NPOL', 'NBITS')}
+        if self.first is None:
+            self.first = geometry
+            nchan, npol, nbits = hdr.get('OBSNCHAN'), hdr.get('NPOL'), hdr.get('NBITS')
+            if all(isinstance(v, int) and v > 0 for v in (nchan, npol, nbits)):
+                # complex samples: 2 * NBITS per pol per channel; NPOL=4 means two complex pols
+                sample_bytes = nchan * (2 if npol == 4 else npol) * 2 * nbits // 8
+                if hdr['BLOCSIZE'] % sample_bytes:
+                    raise BlockError(f"BLOCSIZE {hdr['BLOCSIZE']} is not a whole number of "
+                                     f"{nchan}-channel samples")
+            if isinstance(hdr.get('PIPERBLK'), int):
+                self.pkt_step = hdr['PIPERBLK']
+        elif geometry != self.first:
+            raise BlockError(f"block geometry changed from {self.first} to {geometry}")
+
+        pktidx = hdr.get('PKTIDX')
+        if not isinstance(pktidx, int):
+            return
+        if self.last_pktidx is not None:
+            step = pktidx - self.last_pktidx
+            if self.pkt_step is None and step > 0:
+                self.pkt_step = step
+            elif step != self.pkt_step:
+                if step <= 0 or self.strict:
+                    raise BlockError(f"PKTIDX went from {self.last_pktidx} to {pktidx} "
+                                     f"(expected +{self.pkt_step})")
+                self.gaps += 1
+                self.missing_blocks += step // self.pkt_step - 1
+        self.last_pktidx = pktidx
+
+# ===== Broker =====
+class Broker:
+    '''
+    Reader thread: blocks from src into a bounded queue. Writer (caller's thread): queue to dst.
+    A full queue stops the reader, which in turn stalls the producer on its pipe.
+    '''
+
+    def __init__(self, src, dst, ring_blocks=4, strict=False, log=print):
+        self.src, self.dst = src, dst
+        self.ring = queue.Queue(maxsize=max(1, ring_blocks))
+        self.checker = BlockChecker(strict)
+        self.log = log
+        self.stop = threading.Event()
+        self.error = None
+        self.blocks = 0
+        self.bytes = 0
+        self.stalls = 0
+        self.max_depth = 0
+
+    def _put(self, item):
+        if self.ring.full():
+            self.stalls += 1
+        while not self.stop.is_set():
+            try:
+                self.ring.put(item, timeout=0.5)
+                self.max_depth = max(self.max_depth, self.ring.qsize())
+                return
+            except queue.Full:
+                pass
+
+    def _read(self):
+        try:
+            with open(self.src, 'rb') as f:
+                while not self.stop.is_set():
+                    block = read_block(f)
+                    if block is None:
+                        break
+                    self.checker.check(block[0])
+                    self._put(block)
+        except (BlockError, OSError) as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def run(self):
+        '''Runs until the producer closes its end; raises BlockError on an integrity failure.'''
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+        strt = time.time()
+        try:
+            with open(self.dst, 'wb') as out:
+                while True:
+                    block = self.ring.get()
+                    if block is None:
+                        break
+                    _, header, payload = block
+                    out.write(header)
+                    out.write(payload)
+                    self.blocks += 1
+                    self.bytes += len(header) + len(payload)
+        except BrokenPipeError:
+            self.error = self.error or BlockError("consumer closed its pipe early")
+        finally:
+            # stop the reader; closing its pipe makes the producer's next write fail fast
+            self.stop.set()
+            reader.join()
+
+        elapsed = time.time() - strt
+        self.log(f"Broker: {self.blocks} block(s), {self.bytes/1e9:.2f} GB in {elapsed:.1f} s "
+                 f"({self.bytes/1e6/max(elapsed, 1e-9):.0f} MB/s), ring high-water {self.max_depth}/{self.ring.maxsize}, "
+                 f"{self.stalls} backpressure stall(s), {self.checker.gaps} PKTIDX gap(s) "
+                 f"({self.checker.missing_blocks} missing block(s))")
+        if self.error:
+            raise BlockError(str(self.error))
+
+# ===== Synthetic producer / consumer =====
+def synthetic_blocks(n_blocks, nchan=4, ntime=1024, npol=2, nbits=8, corrupt=None):
+    '''Yields block bytes whose payload starts with the block index; optionally injects one fault.'''
+    blocsize = nchan * ntime * npol * 2 * nbits // 8
+    for i in range(n_blocks):
+        pktidx = i * ntime
+        if corrupt == 'gap' and i >= n_blocks // 2:
+            pktidx += ntime
+        header = make_header({'BLOCSIZE': blocsize, 'OBSNCHAN': nchan, 'NPOL': npol, 'NBITS': nbits,
+                              'PIPERBLK': ntime, 'PKTIDX': pktidx, 'DIRECTIO': 0, 'SRC_NAME': 'SYNTH'})
+        payload = i.to_bytes(8, 'little') + bytes([i % 256]) * (blocsize - 8)
+        if corrupt == 'header' and i == n_blocks // 2:
+            header = header.replace(b'END ', b'XXX ')
+        if corrupt == 'truncate' and i == n_blocks - 1:
+            payload = payload[:blocsize // 2]
+        yield header + payload
+
+def selftest(n_blocks=64, ring_blocks=4, corrupt=None, consumer_delay=0.01, strict=False):
+    '''Producer -> FIFO -> Broker -> FIFO -> consumer. Returns True if the outcome is as expected.'''
+    tmp_dir = tempfile.mkdtemp(prefix='raw_stream_')
+    src, dst = os.path.join(tmp_dir, 'in.fifo'), os.path.join(tmp_dir, 'out.0000.raw')
+    os.mkfifo(src)
+    os.mkfifo(dst)
+    received, consumer_error = [], []
+
+    def produce():
+        try:
+            with open(src, 'wb') as f:
+                for block in synthetic_blocks(n_blocks, corrupt=corrupt):
+                    f.write(block)
+        except BrokenPipeError:
+            pass
+
+    def consume():
+        try:
+            with open(dst, 'rb') as f:
+                while (block := read_block(f)) is not None:
+                    received.append(int.from_bytes(block[2][:8], 'little'))
+                    time.sleep(consumer_delay)
+        except BlockError as e:
+            consumer_error.append(e)
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+    for t in threads:
+        t.start()
+    broker = Broker(src, dst, ring_blocks=ring_blocks, strict=strict)
+    try:
+        broker.run()
+        broker_error = None
+    except BlockError as e:
+        broker_error = e
+    for t in threads:
+        t.join()
+    for path in (src, dst):
+        os.remove(path)
+    os.rmdir(tmp_dir)
+
+    in_order = received == list(range(len(received)))
+    print(f"Consumer received {len(received)}/{n_blocks} block(s), in order: {in_order}; "
+          f"broker error: {broker_error}; consumer error: {consumer_error[0] if consumer_error else None}")
+    if corrupt in (None, 'gap') and not strict:
+        return broker_error is None and in_order and len(received) == n_blocks
+    # a corrupt block must stop the stream before it reaches the consumer
+    return broker_error is not None and in_order and len(received) < n_blocks
+
+# ===== CLI =====
+def get_args():
+    parser = argparse.ArgumentParser(description='Stream GUPPI RAW blocks between named pipes.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    broker_p = sub.add_parser('broker', help='Forward checked blocks from IN to OUT.')
+    broker_p.add_argument('src', help='Pipe (or file) the extractor writes to.')
+    broker_p.add_argument('dst', help='Pipe rawspec reads, named <stem>.0000.raw.')
+    broker_p.add_argument('--ring-blocks', type=int, default=4, help='Blocks buffered between reader and writer (default: 4).')
+    broker_p.add_argument('--strict', action='store_true', help='Treat PKTIDX gaps as fatal.')
+    broker_p.add_argument('--stats', type=str, default=None, help='Write blocks/bytes/gaps forwarded as JSON here on success.')
+
+    test_p = sub.add_parser('selftest', help='Synthetic producer and consumer through real FIFOs.')
+    test_p.add_argument('--blocks', type=int, default=64, help='Blocks to send (default: 64).')
+    test_p.add_argument('--ring-blocks', type=int, default=4, help='Ring size (default: 4).')
+    test_p.add_argument('--corrupt', choices=['gap', 'truncate', 'header'], default=None, help='Inject one fault.')
+    test_p.add_argument('--consumer-delay', type=float, default=0.01, help='Seconds per block in the consumer (default: 0.01).')
+    test_p.add_argument('--strict', action='store_true', help='Treat PKTIDX gaps as fatal.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    if args.cmd == 'broker':
+        try:
+            broker = Broker(args.src, args.dst, ring_blocks=args.ring_blocks, strict=args.strict)
+            broker.run()
+            if args.stats:
+                with open(args.stats, 'w') as f:
+                    json.dump({'blocks': broker.blocks, 'bytes': broker.bytes, 'gaps': broker.checker.gaps,
+                               'missing_blocks': broker.checker.missing_blocks}, f)
+        except BlockError as e:
+            print(f"Broker failed: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        ok = selftest(args.blocks, args.ring_blocks, args.corrupt, args.consumer_delay, args.strict)
+        print('PASS' if ok else 'FAIL')
+        sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import argparse
+import rawspec_utils
 
 def calculate_resolutions(t, f, bandwidth, coarse_channels, block_channels):
 
@@ -18,7 +19,7 @@ def calculate_resolutions(t, f, bandwidth, coarse_channels, block_channels):
     f_res = (bandwidth / coarse_channels) / f
     
     # Time resolution in seconds
-    t_res = 5.12e-6 * f * t
+    t_res = rawspec_utils.SAMPLE_TIME * f * t
 
     print(f"Bandwidth: {bandwidth/1e6} MHz")
     print(f"Coarse Channels: {coarse_channels}")
@@ -26,22 +27,91 @@ def calculate_resolutions(t, f, bandwidth, coarse_channels, block_channels):
 
     return f_res, t_res
 
+def parse_requirement(text):
+    '''"f_res<=4,t_res<=20,npol=1" -> {'f_res': 4.0, 't_res': 20.0, 'npol': 1}'''
+    req = {}
+    for item in text.split(','):
+        try:
+            if '<=' in item:
+                key, value = item.split('<=')
+                req[key.strip()] = float(value)
+            elif '=' in item:
+                key, value = item.split('=')
+                req[key.strip()] = int(value)
+            else:
+                raise ValueError
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Cannot parse requirement '{item}' (expected key<=value or key=value)")
+    unknown = set(req) - {'f_res', 't_res', 'npol'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown requirement key(s): {', '.join(sorted(unknown))}")
+    return req
+
+def print_plan(args):
+    duration = args.duration or rawspec_utils.SCAN_DURATION
+    grid = rawspec_utils.product_grid(duration, npols=(1, 4), max_t_res=args.max_t_res, bandwidth=args.bandwidth,
+                                      coarse_channels=args.coarse_channels, block_samples=args.block_channels)
+    budget = args.budget_gb * 1e9 if args.budget_gb else None
+    print(f"{len(grid['f'])} valid (f, t, npol) products for {duration:.0f} s of voltages")
+
+    sets = rawspec_utils.plan_products(args.require, budget, grid=grid, max_front=args.max_front)
+    if not sets:
+        print("No product set meets the requirements within the budget.")
+        return
+
+    print(f"{len(sets)} Pareto-optimal set(s); showing the {min(args.top, len(sets))} smallest")
+    for n, products in enumerate(sets[:args.top]):
+        total = sum(p['bytes'] for p in products)
+        flops = sum(p['flops'] for p in products)
+        print(f"\nSet {n + 1}: {total/1e9:.1f} GB per scan, {flops/1e12:.1f} TFLOP")
+        print(f"  rawspec -f {','.join(str(p['f']) for p in products)} -t {','.join(str(p['t']) for p in products)} "
+              f"-p {','.join(str(p['npol']) for p in products)}")
+        for p in products:
+            print(f"  f={p['f']:<6} t={p['t']:<6} p={p['npol']}  f_res={p['f_res']:.3f} Hz  t_res={p['t_res']:.6f} s  "
+                  f"rate={p['rate']/1e6:.2f} MB/s  size={p['bytes']/1e9:.2f} GB")
+
 def main():
     parser = argparse.ArgumentParser(description="Calculate frequency and time resolution")
     
-    parser.add_argument('-f', '--fine_channels', type=int, required=True, help="Number of fine channels")
-    parser.add_argument('-t', '--integrations', type=int, required=True, help="Number of integrations")
-    parser.add_argument('--bandwidth', type=float, default=90.0, help="Total bandwidth in MHz (default: 90 MHz)")
-    parser.add_argument('--coarse_channels', type=int, default=412, help="Number of coarse channels (default: 412)")
-    parser.add_argument('--block_channels', type=int, default=65536, help="Number of channels in GUPPI RAW block (default:65536)")
+    parser.add_argument('-f', '--fine_channels', type=int, help="Number of fine channels")
+    parser.add_argument('-t', '--integrations', type=int, help="Number of integrations")
+    parser.add_argument('--bandwidth', type=float, default=rawspec_utils.BANDWIDTH, help="Total bandwidth in MHz (default: 90 MHz)")
+    parser.add_argument('--coarse_channels', type=int, default=rawspec_utils.COARSE_CHANS, help="Number of coarse channels (default: 412)")
+    parser.add_argument('--block_channels', type=int, default=rawspec_utils.BLOCK_SAMPLES, help="Number of channels in GUPPI RAW block (default:65536)")
+    parser.add_argument('-p', '--npol', type=int, default=1, help="Output polarisation products, 1 or 4 (default: 1)")
+    parser.add_argument('-d', '--duration', type=float, help="Voltage duration in seconds; also print predicted .raw and .fil sizes")
     
+    # --- Planning ---
+    parser.add_argument('--plan', action='store_true', help="Search every valid -f/-t/-p for Pareto-optimal product sets")
+    parser.add_argument('--require', type=parse_requirement, action='append', default=[], metavar='SPEC',
+                        help="One product per SPEC, e.g. 'f_res<=4,t_res<=20,npol=1' (Hz, s). Give once per product")
+    parser.add_argument('--budget-gb', type=float, help="Disk budget per scan for the whole set, in GB")
+    parser.add_argument('--max-t-res', type=float, default=60.0, help="Longest time resolution considered, in s (default: 60)")
+    parser.add_argument('--max-front', type=int, default=12, help="Candidates kept per requirement before combining (default: 12)")
+    parser.add_argument('--top', type=int, default=10, help="Sets to print (default: 10)")
+
     args = parser.parse_args()
     
+    if args.plan:
+        if not args.require:
+            parser.error("--plan needs at least one --require")
+        print_plan(args)
+        return
+    if args.fine_channels is None or args.integrations is None:
+        parser.error("-f and -t are required unless --plan is given")
+
     f_res, t_res = calculate_resolutions(args.integrations, args.fine_channels, args.bandwidth, args.coarse_channels, args.block_channels)
     
     # Output the results
     print(f"Frequency Resolution: {f_res:.6f} Hz")
     print(f"Time Resolution: {t_res:.6f} seconds")
 
+    if args.duration:
+        raw = rawspec_utils.raw_bytes(args.duration, args.coarse_channels, args.block_channels)
+        fil = rawspec_utils.product_bytes(args.fine_channels, args.integrations, args.npol, args.duration,
+                                          args.coarse_channels, args.block_channels)
+        print(f"GUPPI RAW size: {raw/1e9:.2f} GB")
+        print(f"Filterbank size: {fil/1e9:.2f} GB")
+
 if __name__ == "__main__":
     main()
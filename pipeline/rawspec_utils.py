@@ -0,0 +1,165 @@
+"""
+Code Purpose: GUPPI RAW block geometry and rawspec product sizes for LOFTS.
+Shared by rawspec-calculator.py and the filterbank pipeline so resolution and disk-usage
+predictions come from the same numbers. product_grid() and plan_products() evaluate every valid
+(-f, -t, -p) at once with numpy to size new product sets before anything is run.
+"""
+
+import itertools
+import numpy as np
+
+SAMPLE_TIME = 5.12e-6       # s per coarse-channel sample
+BANDWIDTH = 90.0            # MHz (default used by rawspec-calculator.py)
+COARSE_CHANS = 412          # lofar_udp_extractor -b 0,412
+BLOCK_SAMPLES = 65536       # time samples per GUPPI RAW block
+NPOL = 2
+BYTES_PER_SAMPLE = 2        # 8-bit complex
+GUPPI_HEADER_BYTES = 6400   # allowance for the 80-char header cards of each block
+SIGPROC_HEADER_BYTES = 512  # allowance for a rawspec .fil header
+SKIP_START = 20             # s skipped at the start of each scan (lofar_udp_extractor -t)
+SCAN_DURATION = 4800        # s, a standard 80-minute LOFTS scan
+
+# product suffix: (-f, -t, -p) as run by the pipeline (rawspec -f 65536,8,64 -t 54,16,3072 -p 1,1,4)
+FILGEN_PRODUCTS = {'0000': (65536, 54, 1),
+                   '0001': (8, 16, 1),
+                   '0002': (64, 3072, 4)}
+
+def block_seconds(block_samples=BLOCK_SAMPLES):
+    return block_samples * SAMPLE_TIME
+
+def block_bytes(coarse_channels=COARSE_CHANS, block_samples=BLOCK_SAMPLES):
+    return coarse_channels * block_samples * NPOL * BYTES_PER_SAMPLE + GUPPI_HEADER_BYTES
+
+def n_blocks(duration, block_samples=BLOCK_SAMPLES):
+    return int(duration // block_seconds(block_samples))
+
+def raw_bytes(duration, coarse_channels=COARSE_CHANS, block_samples=BLOCK_SAMPLES):
+    '''Bytes of GUPPI RAW written by lofar_udp_extractor for a voltage duration in seconds.'''
+    return n_blocks(duration, block_samples) * block_bytes(coarse_channels, block_samples)
+
+def product_nspectra(f, t, duration, block_samples=BLOCK_SAMPLES):
+    return nspectra_from_blocks(f, t, n_blocks(duration, block_samples), block_samples)
+
+def nspectra_from_blocks(f, t, nblocks, block_samples=BLOCK_SAMPLES):
+    # every f samples make one fine spectrum; t of those are integrated; runt integrations are dropped
+    return (nblocks * block_samples // f) // t
+
+def blocks_for_nspectra(f, t, nspectra, block_samples=BLOCK_SAMPLES):
+    '''(min, max) number of RAW blocks that rawspec turns into exactly nspectra spectra.'''
+    samples = f * t
+    lo = -(-nspectra * samples // block_samples)
+    hi = -(-(nspectra + 1) * samples // block_samples) - 1
+    return lo, hi
+
+def product_bytes(f, t, npol_out, duration, coarse_channels=COARSE_CHANS, block_samples=BLOCK_SAMPLES, nbits=32):
+    '''Bytes of the .fil rawspec writes for one -f/-t/-p product.'''
+    nchans = coarse_channels * f
+    return product_nspectra(f, t, duration, block_samples) * nchans * npol_out * nbits // 8 + SIGPROC_HEADER_BYTES
+
+def filgen_bytes(duration):
+    '''{'raw': bytes, '0000': bytes, ...} for the standard LOFTS products.'''
+    sizes = {'raw': raw_bytes(duration)}
+    for suffix, (f, t, p) in FILGEN_PRODUCTS.items():
+        sizes[suffix] = product_bytes(f, t, p, duration)
+    return sizes
+
+# ===== Product planning =====
+def channeliser_flops(f, npol_out, nsamples, coarse_channels=COARSE_CHANS):
+    '''
+    Estimated FLOPs to channelise nsamples coarse samples: a 5 f log2(f) complex FFT per pol per
+    f samples, detection (4 per pol for Stokes I, 16 for full Stokes) and one add per output product
+    per fine sample for integration.
+    '''
+    f = np.asarray(f, dtype=np.float64)
+    npol_out = np.asarray(npol_out, dtype=np.float64)
+    fft = NPOL * 5 * np.log2(np.maximum(f, 1))
+    detect = np.where(npol_out > 1, 16, 4 * NPOL) + npol_out
+    return coarse_channels * nsamples * (fft + detect)
+
+def product_grid(duration=SCAN_DURATION, npols=(1, 4), max_t_res=60.0, bandwidth=BANDWIDTH,
+                 coarse_channels=COARSE_CHANS, block_samples=BLOCK_SAMPLES, nbits=32):
+    '''
+    Every valid (f, t, npol) for the block geometry, as a dict of equal-length arrays:
+    f, t, npol, f_res [Hz], t_res [s], rate [bytes/s], bytes (per scan of `duration` s of voltages)
+    and flops (per scan). f runs over the power-of-two divisors of the block; t over the divisors
+    of the spectra per block and its multiples up to max_t_res.
+    '''
+    exps = np.arange(int(np.log2(block_samples)) + 1)
+    f = 2 ** exps
+    f = f[block_samples % f == 0]
+    per_block = block_samples // f
+
+    # divisors of each per_block (powers of two) and multiples k * per_block
+    t_div = 2 ** exps[None, :] * np.ones_like(f)[:, None]
+    k_max = int(max_t_res / (SAMPLE_TIME * block_samples)) + 1
+    t_mul = per_block[:, None] * np.arange(2, k_max + 1)[None, :]
+    t = np.concatenate([t_div, t_mul], axis=1)
+    f = np.broadcast_to(f[:, None], t.shape)
+    keep = ((per_block[:, None] % t == 0) & (t <= per_block[:, None])) | (t % per_block[:, None] == 0)
+    keep &= SAMPLE_TIME * f * t <= max_t_res
+    # a t can be both a power-of-two divisor and a multiple of per_block (e.g. t=2, 4 at f=block_samples)
+    f, t = np.unique(np.column_stack([f[keep], t[keep]]), axis=0).T
+
+    npols = np.asarray(npols)
+    f, t, npol = (np.repeat(f, len(npols)), np.repeat(t, len(npols)), np.tile(npols, len(t)))
+    nblocks = n_blocks(duration, block_samples)
+    nspectra = (nblocks * block_samples // f) // t
+    spectrum_bytes = coarse_channels * f * npol * nbits // 8
+
+    return {'f': f, 't': t, 'npol': npol,
+            'f_res': bandwidth * 1e6 / coarse_channels / f,
+            't_res': SAMPLE_TIME * f * t,
+            'rate': spectrum_bytes / (SAMPLE_TIME * f * t),
+            'bytes': nspectra * spectrum_bytes + SIGPROC_HEADER_BYTES,
+            'flops': channeliser_flops(f, npol, nblocks * block_samples, coarse_channels)}
+
+def pareto_mask(objectives):
+    '''Rows of an (n, k) array not dominated by any other row (all objectives minimised).'''
+    objectives = np.asarray(objectives, dtype=np.float64)
+    if len(objectives) == 0:
+        return np.zeros(0, dtype=bool)
+    le = (objectives[:, None, :] <= objectives[None, :, :]).all(axis=2)
+    lt = (objectives[:, None, :] < objectives[None, :, :]).any(axis=2)
+    dominated = (le & lt).any(axis=0)
+    return ~dominated
+
+def select(grid, mask):
+    return {key: value[mask] for key, value in grid.items()}
+
+def plan_products(requirements, budget_bytes=None, grid=None, max_front=12, **grid_kwargs):
+    '''
+    Pareto-optimal product sets. Each requirement is a dict with optional max f_res [Hz],
+    max t_res [s] and npol, and gets one product. Candidates for each requirement are reduced to
+    their Pareto front over (f_res, t_res, bytes, flops), thinned to max_front evenly spaced by
+    size, then combined. Returns the sets within budget_bytes that are Pareto-optimal over total
+    bytes, total FLOPs and each product's resolutions, cheapest first, as lists of row dicts.
+    '''
+    grid = grid or product_grid(**grid_kwargs)
+    fronts = []
+    for req in requirements:
+        ok = np.ones(len(grid['f']), dtype=bool)
+        if 'f_res' in req:
+            ok &= grid['f_res'] <= req['f_res']
+        if 't_res' in req:
+            ok &= grid['t_res'] <= req['t_res']
+        if 'npol' in req:
+            ok &= grid['npol'] == req['npol']
+        if budget_bytes is not None:
+            ok &= grid['bytes'] <= budget_bytes
+        cand = select(grid, ok)
+        cand = select(cand, pareto_mask(np.column_stack([cand[k] for k in ('f_res', 't_res', 'bytes', 'flops')])))
+        order = np.argsort(cand['bytes'])
+        if len(order) > max_front:
+            order = order[np.unique(np.linspace(0, len(order) - 1, max_front).round().astype(int))]
+        fronts.append([{k: v[i].item() for k, v in cand.items()} for i in order])
+
+    if not all(fronts):
+        return []
+
+    sets = [list(combo) for combo in itertools.product(*fronts)]
+    objectives = np.array([[sum(p['bytes'] for p in s), sum(p['flops'] for p in s)] +
+                           [x for p in s for x in (p['f_res'], p['t_res'])] for s in sets])
+    keep = pareto_mask(objectives)
+    if budget_bytes is not None:
+        keep &= objectives[:, 0] <= budget_bytes
+    return sorted((s for s, k in zip(sets, keep) if k), key=lambda s: sum(p['bytes'] for p in s))
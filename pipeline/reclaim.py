@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Plan and execute space reclamation of voltages (.zst) and GUPPI RAW (.raw) across
+every session under /datax and /datax2 in one pass.
+
+    reclaim.py plan [--roots /datax /datax2] [-o manifest.json] [--free-gb 500]
+    reclaim.py execute manifest.json [-w 8] [--yes]
+
+plan finds every scan_* folder of every sess_* directory, works out its lanes and filterbank
+output directory the same way voltage-cleaner.sh does, and classes each target:
+    safe        ledger says channelised and fil_validate.py gives an ok verdict against the RAW
+                block count the ledger recorded (and checked against the .zst span) at extraction
+    unverified  products exist but the ledger or validator does not vouch for them, or no
+                checked block count was recorded
+    no_products no filterbank products found
+Files are ranked safe first, then oldest first, and written to a JSON manifest for review. Only
+safe files are marked "delete"; the rest are listed with action "keep" and the reason.
+
+execute re-checks each file's size and mtime and re-validates each target before deleting, then
+removes files on a thread pool and reports bytes freed per lane and per station.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import fil_validate
+from ledger import LEDGER_PATH, Ledger
+
+PROJECT_DIR = '/datax2/projects/LOFTS'
+ROOTS = ['/datax', '/datax2']
+STATION_PREFIXES = {'IE613': 'IE613_16130', 'SE607': 'SE607_16070'}
+N_LANES = 4
+SAFETY_RANK = {'safe': 0, 'unverified': 1, 'no_products': 2}
+
+# ===== Discovery =====
+def find_sessions(roots, max_depth=4):
+    '''sess_* directories below the roots; does not descend into a session or PROJECT_DIR.'''
+    sessions = []
+    stack = [(root, 0) for root in roots]
+    while stack:
+        path, depth = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name.startswith('sess_'):
+                sessions.append(entry.path)
+            elif depth < max_depth and os.path.abspath(entry.path) != PROJECT_DIR:
+                stack.append((entry.path, depth + 1))
+    return sorted(sessions)
+
+def first_match(directory, pattern):
+    try:
+        return next((e.path for e in sorted(os.scandir(directory), key=lambda e: e.name)
+                     if e.is_file() and fnmatch.fnmatchcase(e.name, pattern)), '')
+    except OSError:
+        return ''
+
+def describe_scan(session, folder):
+    '''Target, station, date, lane dirs and candidate output dirs of one scan, as voltage-cleaner.sh finds them.'''
+    h_file = first_match(folder, '*.h')
+    log_file = first_match(folder, '*.log')
+    if not h_file or not log_file:
+        return None
+
+    with open(h_file, errors='replace') as f:
+        station = 'IE613' if 'IE613' in f.read() else 'SE607'
+    with open(log_file, errors='replace') as f:
+        lines = f.read().splitlines()
+    fields = lines[3].split() if len(lines) > 3 else []
+    if len(fields) < 2:
+        return None
+
+    zst_scan_path = fields[1]
+    prefix = STATION_PREFIXES[station]
+    template = zst_scan_path.replace('lane0', 'lane__PORT__', 1).replace(prefix, prefix[:-1] + '__PORT__', 1)
+    obs_date = template.split('.')[-3].split('T')[0]
+    parts = template.split('/')
+    target = (parts[8] if len(parts) > 8 else os.path.basename(folder)).removeprefix('scan_')
+    try:
+        prev_day = (datetime.strptime(obs_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+    scan_dirs = [d for d in (os.path.join(session, f'scan_{target}'), os.path.join(session, target)) if os.path.isdir(d)]
+    return {'session': session, 'target': target, 'station': station, 'obs_date': obs_date,
+            'lanes': {f'lane{port}': os.path.dirname(template.replace('__PORT__', str(port))) for port in range(N_LANES)},
+            'scan_dir': scan_dirs[0] if scan_dirs else None,
+            'output_dirs': [os.path.join(PROJECT_DIR, obs_date, target), os.path.join(PROJECT_DIR, prev_day, target)]}
+
+def classify(scan, ledger):
+    '''(safety, output_dir, nblocks, reason) using the ledger and validator.'''
+    for output_dir in scan['output_dirs']:
+        fils = [os.path.join(output_dir, f"{scan['target']}.rawspec.{p}.fil") for p in fil_validate.PRODUCTS]
+        if not any(os.path.isfile(f) for f in fils):
+            continue
+        if ledger is None or not ledger.is_done(output_dir, 'channelised'):
+            return 'unverified', output_dir, None, 'not channelised in ledger'
+        # products from an extractor that stopped early are uniformly short and pass on their own
+        blocks = ledger.extracted_blocks(output_dir)
+        if 'blocks' not in blocks or 'expected' not in blocks:
+            return 'unverified', output_dir, None, 'no RAW block count checked against the .zst span'
+        verdict = fil_validate.validate_target(output_dir, scan['target'], nblocks=blocks['blocks'])
+        if verdict['verdict'] != 'ok':
+            return 'unverified', output_dir, blocks['blocks'], 'validator: ' + ' '.join(verdict['problems'])
+        return 'safe', output_dir, blocks['blocks'], 'ledger channelised, validator ok'
+    return 'no_products', None, None, 'no filterbank products found'
+
+def files_in(directory, suffix):
+    out = []
+    try:
+        for entry in os.scandir(directory):
+            if entry.is_file(follow_symlinks=False) and entry.name.endswith(suffix):
+                st = entry.stat(follow_symlinks=False)
+                out.append((entry.path, st.st_size, st.st_mtime))
+    except OSError:
+        pass
+    return out
+
+def plan_scan(session, folder, ledger):
+    scan = describe_scan(session, folder)
+    if scan is None:
+        return []
+    safety, output_dir, nblocks, reason = classify(scan, ledger)
+
+    found = []
+    for lane, lane_dir in scan['lanes'].items():
+        found += [(lane, f) for f in files_in(lane_dir, '.zst')]
+    if scan['scan_dir']:
+        found += [('scan', f) for f in files_in(scan['scan_dir'], '.zst')]
+    if output_dir:
+        found += [('raw', f) for f in files_in(output_dir, '.raw')]
+
+    return [{'path': path, 'size': size, 'mtime': mtime, 'kind': os.path.splitext(path)[1].lstrip('.'),
+             'lane': lane, 'station': scan['station'], 'target': scan['target'], 'session': session,
+             'output_dir': output_dir, 'nblocks': nblocks, 'safety': safety, 'reason': reason,
+             'action': 'delete' if safety == 'safe' else 'keep',
+             'scans': [{'output_dir': output_dir, 'target': scan['target'], 'nblocks': nblocks}]}
+            for lane, (path, size, mtime) in found]
+
+def caution(entry):
+    return (SAFETY_RANK[entry['safety']], entry['action'] == 'keep')
+
+def merge_entries(entries):
+    '''
+    One entry per path. A lane shared by several scan folders keeps its most cautious entry
+    (least safe, 'keep' over 'delete'), with the other scans' reasons appended and every
+    scan's target listed under 'scans' so execute re-validates all of them.
+    '''
+    merged = {}
+    for e in entries:
+        prev = merged.get(e['path'])
+        if prev is None:
+            merged[e['path']] = e
+            continue
+        kept, other = (e, prev) if caution(e) > caution(prev) else (prev, e)
+        merged[e['path']] = dict(kept, reason=f"{kept['reason']}; {other['target']}: {other['reason']}",
+                                 scans=kept['scans'] + [s for s in other['scans'] if s not in kept['scans']])
+    return list(merged.values())
+
+def build_plan(roots, ledger, workers=8, free_bytes=None):
+    sessions = find_sessions(roots)
+    jobs = [(s, f) for s in sessions for f in sorted(e.path for e in os.scandir(s)
+                                                     if e.is_dir() and e.name.startswith('scan_'))]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        entries = [e for es in pool.map(lambda job: plan_scan(*job, ledger), jobs) for e in es]
+
+    # de-duplicate lanes shared between scan folders, then rank: safest, oldest, largest
+    entries = merge_entries(entries)
+    entries.sort(key=lambda e: (SAFETY_RANK[e['safety']], e['mtime'], -e['size']))
+
+    if free_bytes is not None:
+        planned = 0
+        for e in entries:
+            if e['action'] == 'delete' and planned >= free_bytes:
+                e['action'], e['reason'] = 'keep', e['reason'] + '; beyond --free-gb'
+            elif e['action'] == 'delete':
+                planned += e['size']
+
+    return {'created': datetime.now().isoformat(timespec='seconds'), 'roots': roots,
+            'sessions': len(sessions), 'scans': len(jobs), 'entries': entries}
+
+# ===== Reporting =====
+def tally(entries, key, field='size'):
+    table = defaultdict(int)
+    for e in entries:
+        table[e[key]] += e[field]
+    return dict(sorted(table.items()))
+
+def print_plan(plan):
+    deletes = [e for e in plan['entries'] if e['action'] == 'delete']
+    print(f"{plan['sessions']} session(s), {plan['scans']} scan(s), {len(plan['entries'])} reclaimable file(s)")
+    for safety in SAFETY_RANK:
+        group = [e for e in plan['entries'] if e['safety'] == safety]
+        if group:
+            print(f"  {safety:<12} {len(group):>6} file(s) {sum(e['size'] for e in group)/1e12:>8.2f} TB")
+    print(f"Planned for deletion: {len(deletes)} file(s), {sum(e['size'] for e in deletes)/1e12:.2f} TB")
+    for name, table in (('station', tally(deletes, 'station')), ('lane', tally(deletes, 'lane'))):
+        print(f"  by {name}: " + ', '.join(f"{k} {v/1e12:.2f} TB" for k, v in table.items()))
+
+# ===== Execution =====
+def execute(manifest, workers=8, ledger=None):
+    deletes = [e for e in manifest['entries'] if e['action'] == 'delete']
+
+    # re-validate every target a file belongs to, once each, against its planned block count
+    def scans_of(e):
+        return e.get('scans') or [{'output_dir': e['output_dir'], 'target': e['target'], 'nblocks': e.get('nblocks')}]
+
+    verdicts = {}
+    for e in deletes:
+        for scan in scans_of(e):
+            key = (scan['output_dir'], scan['target'])
+            if key not in verdicts:
+                verdicts[key] = (scan['nblocks'] is not None and
+                                 fil_validate.validate_target(*key, nblocks=scan['nblocks'])['verdict'] == 'ok')
+
+    def delete_one(e):
+        try:
+            st = os.stat(e['path'])
+        except FileNotFoundError:
+            return e, 'gone', 0
+        if st.st_size != e['size'] or st.st_mtime != e['mtime']:
+            return e, 'changed', 0
+        if not all(verdicts[(scan['output_dir'], scan['target'])] for scan in scans_of(e)):
+            return e, 'unsafe', 0
+        try:
+            os.remove(e['path'])
+        except OSError as err:
+            return e, f'error: {err}', 0
+        return e, 'deleted', st.st_size
+
+    strt = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(delete_one, deletes))
+
+    freed = [dict(e, freed=n) for e, status, n in results if status == 'deleted']
+    counts = defaultdict(int)
+    for _, status, _ in results:
+        counts[status.split(':')[0]] += 1
+
+    if ledger is not None:
+        for output_dir, target in {(e['output_dir'], e['target']) for e in freed}:
+            ledger.mark(output_dir, 'cleaned', detail='reclaim', target=target)
+
+    report = {'executed': datetime.now().isoformat(timespec='seconds'), 'elapsed_s': round(time.time() - strt, 1),
+              'counts': dict(counts), 'freed_bytes': sum(e['freed'] for e in freed),
+              'freed_by_station': tally(freed, 'station', 'freed'), 'freed_by_lane': tally(freed, 'lane', 'freed'),
+              'not_deleted': [{'path': e['path'], 'status': status} for e, status, _ in results if status != 'deleted']}
+    return report
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Plan and execute voltage/RAW space reclamation.')
+    parser.add_argument('--ledger', type=str, default=LEDGER_PATH, help=f'State ledger (default: {LEDGER_PATH}).')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='Parallel scanners / deleters (default: 8).')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    plan_p = sub.add_parser('plan', help='Scan all sessions and write a deletion manifest.')
+    plan_p.add_argument('--roots', type=str, nargs='+', default=ROOTS, help=f'Where to look for sess_* dirs (default: {" ".join(ROOTS)}).')
+    plan_p.add_argument('-o', '--manifest', type=str, default=None, help='Manifest path (default: reclaim_<timestamp>.json in the current dir).')
+    plan_p.add_argument('--free-gb', type=float, default=None, help='Only plan deletions until this much is freed.')
+
+    exec_p = sub.add_parser('execute', help='Delete the files marked "delete" in a reviewed manifest.')
+    exec_p.add_argument('manifest', type=str, help='Manifest written by plan.')
+    exec_p.add_argument('--yes', action='store_true', help='Do not ask for confirmation.')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    ledger = Ledger(args.ledger) if os.path.isfile(args.ledger) else None
+
+    if args.cmd == 'plan':
+        if ledger is None:
+            print(f"No ledger at {args.ledger}; nothing can be classed safe.")
+        plan = build_plan(args.roots, ledger, args.workers, None if args.free_gb is None else args.free_gb * 1e9)
+        manifest_path = args.manifest or f"reclaim_{datetime.now().strftime('%Y%m%dT%H%M%S')}.json"
+        with open(manifest_path, 'w') as f:
+            json.dump(plan, f, indent=2)
+        print_plan(plan)
+        print(f"Manifest written to {manifest_path}. Review it, then run: reclaim.py execute {manifest_path}")
+        return
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    print_plan(manifest)
+    if not args.yes and input("Type 'delete' to delete the planned files: ").strip() != 'delete':
+        print("Aborted.")
+        sys.exit(1)
+
+    report = execute(manifest, args.workers, ledger)
+    report_path = os.path.splitext(args.manifest)[0] + '.report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Freed {report['freed_bytes']/1e12:.2f} TB in {report['elapsed_s']} s ({dict(report['counts'])})")
+    for name in ('station', 'lane'):
+        print(f"  by {name}: " + ', '.join(f"{k} {v/1e9:.1f} GB" for k, v in report[f'freed_by_{name}'].items()))
+    print(f"Report written to {report_path}")
+
+if __name__ == "__main__":
+    main()
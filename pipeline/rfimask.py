@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: rfifind-style RFI mask for LOFTS 0001 products, written natively in place of a
+PRESTO docker container (rfifind -time 10 -noclip -freqsig 8 -timesig 8 -chanfrac 0.6 -intfrac 0.6).
+
+The product is streamed in fixed intervals of --time seconds. For every interval and channel a
+worker process computes the mean, the standard deviation and the peak of the normalised power
+spectrum (rfifind's three statistics), reading its own slice of the memmap so nothing but the
+statistics crosses the process pool. The flags then follow rfifind:
+    - power: the peak power is less likely than --freqsig sigma for the number of powers searched
+    - mean/std: more than --timesig trimmed standard deviations from the channel's trimmed median
+      (trimmed to the central 80%, as rfifind's calc_avgmedstd), or a channel that is all zeros
+    - a channel is zapped entirely if more than --chanfrac of its intervals are bad, and an
+      interval if more than --intfrac of its channels are bad
+The mask is written in PRESTO's binary .mask format (channel 0 = lowest frequency), so it can be
+passed to PRESTO and transientX as before.
+
+    rfimask.py <file.0001.fil> [-o <dir>/<name>] [-t 10] [-w 8]       writes <name>_rfifind.mask
+"""
+
+import argparse
+import math
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import sigproc_utils
+
+TRIM_FRACTION = 0.8
+CHAN_BLOCK = 256
+
+def layout(hdr, inttime):
+    '''
+    (points per interval, number of intervals). As in rfifind, only whole intervals are counted
+    and the samples after the last one are not examined; a product shorter than one interval
+    gets a single short interval.
+    '''
+    ptsperint = max(2, int(round(inttime / hdr['tsamp'])))
+    return ptsperint, max(1, hdr['nspectra'] // ptsperint)
+
+def interval_stats(fil_path, first, last, ptsperint):
+    '''(avg, std, maxpow) of shape (last - first, nchans) for intervals first..last-1.'''
+    hdr = sigproc_utils.read_header(fil_path)
+    data = sigproc_utils.open_memmap(fil_path, hdr)
+    nchans = hdr['nchans']
+    avg = np.zeros((last - first, nchans), dtype=np.float32)
+    std = np.zeros_like(avg)
+    maxpow = np.zeros_like(avg)
+
+    for k, interval in enumerate(range(first, last)):
+        block = np.asarray(data[interval * ptsperint:(interval + 1) * ptsperint, 0, :], dtype=np.float32)
+        n = len(block)
+        avg[k] = block.mean(axis=0)
+        std[k] = block.std(axis=0)
+        for c0 in range(0, nchans, CHAN_BLOCK):
+            c1 = min(nchans, c0 + CHAN_BLOCK)
+            spec = np.fft.rfft(block[:, c0:c1] - avg[k, c0:c1], axis=0)[1:n // 2 + (n % 2)]
+            pw = spec.real ** 2 + spec.imag ** 2
+            norm = std[k, c0:c1].astype(np.float64) ** 2 * n
+            # white noise gives powers distributed as exp(-p) with this normalisation
+            maxpow[k, c0:c1] = np.where(norm > 0, pw.max(axis=0) / np.where(norm > 0, norm, 1), 0)
+    return avg, std, maxpow
+
+def power_threshold(npows, sigma):
+    '''Normalised power whose chance of being exceeded by the peak of npows powers is that of a sigma Gaussian event.'''
+    prob = 0.5 * math.erfc(sigma / math.sqrt(2))
+    # P(max > p) = 1 - (1 - exp(-p))**npows, solved for p
+    return -math.log(-math.expm1(math.log1p(-prob) / npows))
+
+def trimmed_stats(arr, fraction=TRIM_FRACTION):
+    '''Median and standard deviation of the central fraction of arr along axis 0.'''
+    srt = np.sort(arr, axis=0)
+    cut = int(len(srt) * (1 - fraction) / 2)
+    central = srt[cut:len(srt) - cut] if len(srt) - 2 * cut > 0 else srt
+    return np.median(central, axis=0), central.std(axis=0)
+
+def flag(avg, std, maxpow, npows, timesig=8.0, freqsig=8.0):
+    '''Boolean (numint, nchans) array of bad interval/channel cells.'''
+    thresholds = np.array([power_threshold(n, freqsig) for n in npows])
+    bad = maxpow > thresholds[:, None]
+    for stat in (avg, std):
+        med, sd = trimmed_stats(stat)
+        bad |= np.abs(stat - med) > timesig * sd
+    bad |= std == 0
+    return bad
+
+def build_mask(bad, chanfrac=0.6, intfrac=0.6):
+    '''(zap_chans, zap_ints, per-interval channel lists) as rfifind derives them from the bad cells.'''
+    numint, nchans = bad.shape
+    zap_chans = np.flatnonzero(bad.mean(axis=0) > chanfrac)
+    zap_ints = np.flatnonzero(bad.mean(axis=1) > intfrac)
+    masked = bad.copy()
+    masked[:, zap_chans] = True
+    masked[zap_ints, :] = True
+    return zap_chans, zap_ints, [np.flatnonzero(row) for row in masked]
+
+def write_mask(path, hdr, ptsperint, timesig, freqsig, zap_chans, zap_ints, chans):
+    '''PRESTO .mask (mask.c write_mask) with channels numbered from the lowest frequency.'''
+    nchans = hdr['nchans']
+    flip = hdr['foff'] < 0
+    renum = (lambda c: np.sort(nchans - 1 - c)) if flip else (lambda c: c)
+    lofreq = hdr['fch1'] + (nchans - 1) * hdr['foff'] if flip else hdr['fch1']
+
+    tmp_path = path + '.partial'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<6d', timesig, freqsig, hdr['tstart'], ptsperint * hdr['tsamp'], lofreq, abs(hdr['foff'])))
+        f.write(struct.pack('<4i', nchans, len(chans), ptsperint, len(zap_chans)))
+        f.write(renum(zap_chans).astype('<i4').tobytes())
+        f.write(struct.pack('<i', len(zap_ints)))
+        f.write(np.asarray(zap_ints).astype('<i4').tobytes())
+        f.write(np.array([len(c) for c in chans], dtype='<i4').tobytes())
+        for c in chans:
+            # fully masked intervals are implied by their count, as in PRESTO
+            if 0 < len(c) < nchans:
+                f.write(renum(c).astype('<i4').tobytes())
+    os.replace(tmp_path, path)
+
+def read_mask(path):
+    '''Parses a PRESTO .mask into a dict (channels as written, lowest frequency first).'''
+    with open(path, 'rb') as f:
+        timesig, freqsig, mjd, dtint, lofreq, dfreq = struct.unpack('<6d', f.read(48))
+        numchan, numint, ptsperint, n_zap_chans = struct.unpack('<4i', f.read(16))
+        zap_chans = np.frombuffer(f.read(4 * n_zap_chans), dtype='<i4')
+        n_zap_ints = struct.unpack('<i', f.read(4))[0]
+        zap_ints = np.frombuffer(f.read(4 * n_zap_ints), dtype='<i4')
+        counts = np.frombuffer(f.read(4 * numint), dtype='<i4')
+        chans = [np.frombuffer(f.read(4 * n), dtype='<i4') if 0 < n < numchan else
+                 np.arange(n, dtype='<i4') for n in counts]
+    return {'timesig': timesig, 'freqsig': freqsig, 'mjd': mjd, 'dtint': dtint, 'lofreq': lofreq, 'dfreq': dfreq,
+            'numchan': numchan, 'numint': numint, 'ptsperint': ptsperint,
+            'zap_chans': zap_chans, 'zap_ints': zap_ints, 'chans': chans}
+
+def rfimask(fil_path, out_base, inttime=10.0, timesig=8.0, freqsig=8.0, chanfrac=0.6, intfrac=0.6, workers=8):
+    hdr = sigproc_utils.read_header(fil_path)
+    ptsperint, numint = layout(hdr, inttime)
+
+    stats = [None] * numint
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(interval_stats, fil_path, i, i + 1, ptsperint): i for i in range(numint)}
+        for fut, i in futures.items():
+            stats[i] = fut.result()
+    avg, std, maxpow = (np.concatenate([s[k] for s in stats]) for k in range(3))
+
+    npts = [min(ptsperint, hdr['nspectra'] - i * ptsperint) for i in range(numint)]
+    bad = flag(avg, std, maxpow, [max(1, n // 2) for n in npts], timesig, freqsig)
+    zap_chans, zap_ints, chans = build_mask(bad, chanfrac, intfrac)
+
+    mask_path = out_base + '_rfifind.mask'
+    write_mask(mask_path, hdr, ptsperint, timesig, freqsig, zap_chans, zap_ints, chans)
+    return {'mask': mask_path, 'numint': numint, 'ptsperint': ptsperint, 'bad_fraction': float(bad.mean()),
+            'masked_fraction': sum(len(c) for c in chans) / (numint * hdr['nchans']),
+            'zap_chans': len(zap_chans), 'zap_ints': len(zap_ints)}
+
+def get_args():
+    parser = argparse.ArgumentParser(description='rfifind-style RFI mask of a filterbank, written as a PRESTO .mask.')
+    parser.add_argument('fil', type=str, help='Filterbank (normally the 0001 product).')
+    parser.add_argument('-o', '--out', type=str, default=None,
+                        help='Output base, writes <out>_rfifind.mask (default: <dir>/<target>_prestomask/<target>).')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='Interval length in seconds (default: 10).')
+    parser.add_argument('--timesig', type=float, default=8.0, help='Mean/std threshold in sigma (default: 8).')
+    parser.add_argument('--freqsig', type=float, default=8.0, help='FFT peak threshold in sigma (default: 8).')
+    parser.add_argument('--chanfrac', type=float, default=0.6, help='Bad interval fraction that zaps a channel (default: 0.6).')
+    parser.add_argument('--intfrac', type=float, default=0.6, help='Bad channel fraction that zaps an interval (default: 0.6).')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='Worker processes (default: 8).')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    out = args.out
+    if out is None:
+        target = os.path.basename(args.fil).split('.')[0]
+        out = os.path.join(os.path.dirname(os.path.abspath(args.fil)), f"{target}_prestomask", target)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+
+    strt = time.time()
+    res = rfimask(args.fil, out, args.time, args.timesig, args.freqsig, args.chanfrac, args.intfrac, args.workers)
+    print(f"{res['mask']}: {res['numint']} interval(s) of {res['ptsperint']} samples, "
+          f"{res['bad_fraction']:.2%} flagged, {res['masked_fraction']:.2%} masked "
+          f"({res['zap_chans']} channel(s), {res['zap_ints']} interval(s) zapped) in {time.time() - strt:.1f} s")
+
+if __name__ == "__main__":
+    main()
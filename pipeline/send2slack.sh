@@ -1,8 +1,6 @@
 directory=$1
 station=$2
 
-for fil in $(ls $directory/*.fil); do
-    plot-bandpass.py -f $fil -s $station
-done
+plot-bandpass.py -d $directory -s $station
 
 slack-bandpass.py $directory 
\ No newline at end of file
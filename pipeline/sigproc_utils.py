@@ -0,0 +1,104 @@
+"""
+Code Purpose: Lightweight sigproc filterbank helpers shared by the LOFTS pipeline scripts.
+Reads the header bytes directly and exposes the data block as a read-only numpy memmap,
+so scripts can walk rawspec products without loading them into memory.
+"""
+
+import os
+import struct
+import numpy as np
+
+# Keyword types as written by rawspec / sigproc
+INT_KEYS = ['telescope_id', 'machine_id', 'data_type', 'barycentric', 'pulsarcentric',
+            'nbits', 'nsamples', 'nchans', 'nifs', 'nbeams', 'ibeam']
+DOUBLE_KEYS = ['fch1', 'foff', 'tstart', 'tsamp', 'src_raj', 'src_dej', 'az_start',
+               'za_start', 'refdm', 'period']
+STRING_KEYS = ['source_name', 'rawdatafile']
+
+NBITS_DTYPE = {8: np.uint8, 16: np.uint16, 32: np.float32}
+
+def _read(f, nbytes):
+    # a short read means the header is truncated (e.g. an empty or partly copied .fil)
+    data = f.read(nbytes)
+    if len(data) < nbytes:
+        raise ValueError(f"Truncated sigproc header in {f.name} (at byte {f.tell()})")
+    return data
+
+def _read_string(f):
+    nbytes = struct.unpack('<i', _read(f, 4))[0]
+    if nbytes < 0 or nbytes > 80:
+        raise ValueError(f"Corrupt sigproc header string length ({nbytes}) in {f.name}")
+    return _read(f, nbytes).decode('ascii', errors='replace')
+
+def read_header(fil_path):
+    '''
+    Parses a sigproc header, reading only the header bytes.
+    Returns a dict of keywords plus header_size, file_size and nspectra.
+    Raises ValueError if the header is truncated, corrupt or describes no data.
+    '''
+    hdr = {}
+    with open(fil_path, 'rb') as f:
+        if _read_string(f) != 'HEADER_START':
+            raise ValueError(f"{fil_path} is not a sigproc filterbank (no HEADER_START).")
+
+        while True:
+            key = _read_string(f)
+            if key == 'HEADER_END':
+                break
+            elif key in INT_KEYS:
+                hdr[key] = struct.unpack('<i', _read(f, 4))[0]
+            elif key in DOUBLE_KEYS:
+                hdr[key] = struct.unpack('<d', _read(f, 8))[0]
+            elif key in STRING_KEYS:
+                hdr[key] = _read_string(f)
+            else:
+                raise ValueError(f"Unknown sigproc header keyword '{key}' in {fil_path}")
+
+        hdr['header_size'] = f.tell()
+
+    hdr.setdefault('nifs', 1)
+    hdr['file_size'] = os.path.getsize(fil_path)
+    if hdr.get('nchans', 0) <= 0 or hdr.get('nbits', 0) <= 0 or hdr['nifs'] <= 0:
+        raise ValueError(f"{fil_path} has no nchans/nbits/nifs in its header")
+    hdr['nspectra'] = (hdr['file_size'] - hdr['header_size']) // bytes_per_spectrum(hdr)
+
+    return hdr
+
+def _write_string(f, text):
+    data = text.encode('ascii')
+    f.write(struct.pack('<i', len(data)) + data)
+
+def write_header(f, hdr):
+    '''
+    Writes a sigproc header for the known keywords present in hdr (others are ignored)
+    to an open binary file. Returns the header size in bytes.
+    '''
+    strt = f.tell()
+    _write_string(f, 'HEADER_START')
+    for key, value in hdr.items():
+        if key in INT_KEYS:
+            _write_string(f, key); f.write(struct.pack('<i', int(value)))
+        elif key in DOUBLE_KEYS:
+            _write_string(f, key); f.write(struct.pack('<d', float(value)))
+        elif key in STRING_KEYS:
+            _write_string(f, key); _write_string(f, str(value))
+    _write_string(f, 'HEADER_END')
+    return f.tell() - strt
+
+def bytes_per_spectrum(hdr):
+    return hdr['nchans'] * hdr['nifs'] * hdr['nbits'] // 8
+
+def open_memmap(fil_path, hdr=None):
+    '''
+    Read-only memmap of the data block with shape (nspectra, nifs, nchans).
+    Nothing is read from disk until the returned array is sliced.
+    '''
+    if hdr is None:
+        hdr = read_header(fil_path)
+
+    if hdr['nbits'] not in NBITS_DTYPE:
+        raise ValueError(f"Unsupported nbits ({hdr['nbits']}) in {fil_path}")
+
+    return np.memmap(fil_path, dtype=NBITS_DTYPE[hdr['nbits']], mode='r',
+                     offset=hdr['header_size'],
+                     shape=(hdr['nspectra'], hdr['nifs'], hdr['nchans']))
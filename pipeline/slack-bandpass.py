@@ -1,46 +1,260 @@
 #!/usr/bin/env python3
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-import sys
+import argparse
+import hashlib
+import json
+import os
 import pathlib
-import os 
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
 
-SLACK_TOKEN = os.environ["SLACK_API_TOKEN"].strip()
 CHANNEL_ID = 'C096N2DQ6R5'
+MANIFEST_NAME = '.slack-manifest.json'
+
+def get_args():
+    # --- Parser ---
+    parser = argparse.ArgumentParser(description='Upload LOFTS quick-look plots to Slack.')
+    parser.add_argument('png_dirs', type=str, nargs='+', help='Directory (or directories) of PNGs to upload.')
+    parser.add_argument('--digest', action='store_true', help='Tile all plots into downscaled contact sheets and upload those instead.')
+    parser.add_argument('-o', '--digest-dir', type=str, help='Where to write contact sheets and index (default: <common parent>/digest).', required = False)
+    parser.add_argument('--tile-size', type=int, help='Longest side of each tile in px (default: 600).', required = False, default=600)
+    parser.add_argument('--targets-per-sheet', type=int, help='Target rows per contact sheet (default: 8).', required = False, default=8)
+    parser.add_argument('-w', '--workers', type=int, help='Concurrent uploads (default: 3).', required = False, default=3)
+    parser.add_argument('-r', '--max-retries', type=int, help='Retries per file on rate limiting (default: 6).', required = False, default=6)
+    parser.add_argument('--dry-run', nargs='?', const='', default=None, metavar='OUT_DIR',
+                        help='Use the local stand-in transport instead of Slack; optionally copy "uploads" to OUT_DIR.')
+    parser.add_argument('--simulate-ratelimit', type=int, help='Dry-run only: rate limit every Nth call.', required = False, default=0)
+    return parser.parse_args()
+
+class RateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__(f"ratelimited (retry after {retry_after} s)")
+        self.retry_after = retry_after
+
+class SlackTransport:
+    '''files_upload_v2 against the real Slack API; ratelimited errors are raised as RateLimited.'''
+
+    def __init__(self, channel=CHANNEL_ID):
+        from slack_sdk import WebClient
+        from slack_sdk.errors import SlackApiError
+        self.client = WebClient(token=os.environ["SLACK_API_TOKEN"].strip())
+        self.error_type = SlackApiError
+        self.channel = channel
+
+    def upload(self, file_path, title):
+        try:
+            response = self.client.files_upload_v2(channel=self.channel, file=str(file_path),
+                                                   title=title, initial_comment=f"")
+        except self.error_type as e:
+            if e.response.get('error') == 'ratelimited':
+                retry_after = e.response.headers.get('Retry-After')
+                raise RateLimited(float(retry_after) if retry_after else None)
+            raise RuntimeError(f"Slack API error: {e.response['error']}")
+
+        if not response.get("ok", False):
+            raise RuntimeError(f"Upload failed: {title} — {response}")
+        return response.get("file", {}).get("id")
+
+    def manifest(self, png_dir):
+        return Manifest(png_dir)
+
+class LocalTransport:
+    '''Stand-in for dry runs and testing: optionally copies files to out_dir and can simulate rate limits.'''
+
+    def __init__(self, out_dir=None, ratelimit_every=0):
+        self.out_dir = pathlib.Path(out_dir) if out_dir else None
+        self.ratelimit_every = ratelimit_every
+        self.calls = 0
+        self.lock = threading.Lock()
+        if self.out_dir:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    def upload(self, file_path, title):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        if self.ratelimit_every and call % self.ratelimit_every == 0:
+            raise RateLimited(retry_after=0.1)
+        if self.out_dir:
+            shutil.copy2(file_path, self.out_dir / title)
+        print(f"[DRY-RUN] Uploaded: {title}")
+        return f"LOCAL{call:06d}"
+
+    def manifest(self, png_dir):
+        # Never touch the real manifest: fake LOCAL ids there would make the next real run skip everything
+        if not self.out_dir:
+            return Manifest(png_dir, path=False)
+        key = hashlib.sha256(str(pathlib.Path(png_dir).resolve()).encode()).hexdigest()[:8]
+        return Manifest(png_dir, path=self.out_dir / f".dry-run-manifest-{pathlib.Path(png_dir).name}-{key}.json")
+
+class Manifest:
+    '''
+    Per-directory record of uploaded file hashes, rewritten atomically after every upload.
+    path overrides <png_dir>/.slack-manifest.json; path=False keeps the record in memory only.
+    '''
+
+    def __init__(self, png_dir, path=None):
+        self.path = pathlib.Path(png_dir) / MANIFEST_NAME if path is None else path
+        self.lock = threading.Lock()
+        self.entries = json.loads(self.path.read_text()) if self.path and self.path.is_file() else {}
+
+    def __contains__(self, digest):
+        return digest in self.entries
+
+    def record(self, digest, file_name, file_id):
+        with self.lock:
+            self.entries[digest] = {'file': file_name, 'file_id': file_id,
+                                    'uploaded': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            if not self.path:
+                return
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self.entries, indent=2))
+            os.replace(tmp_path, self.path)
+
+def file_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def upload_with_backoff(transport, file_path, title, max_retries=6, base_delay=1.0, max_delay=60.0):
+    # Exponential backoff with jitter; Slack's Retry-After takes precedence when given
+    for attempt in range(max_retries + 1):
+        try:
+            return transport.upload(file_path, title)
+        except RateLimited as e:
+            if attempt == max_retries:
+                raise
+            delay = e.retry_after if e.retry_after is not None else min(max_delay, base_delay * 2**attempt)
+            delay += random.uniform(0, 0.1 * delay)
+            print(f"Rate limited on {title}; retrying in {delay:.1f} s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
 
-client = WebClient(token=SLACK_TOKEN)
-
-def upload_file_v2(file_path: pathlib.Path, title: str):
-    try:
-        response = client.files_upload_v2(
-            channel=CHANNEL_ID,
-            file=str(file_path),
-            title=title,
-            initial_comment=f""
-        )
-        if response.get("ok", False):
-            print(f"Uploaded: {title}")
+def upload_dir(png_dir, transport, workers=3, max_retries=6, paths=None):
+    '''
+    Uploads every PNG (or the given paths) not already in the directory manifest.
+    Returns (uploaded, skipped, failed) counts.
+    '''
+    manifest = transport.manifest(png_dir)
+    paths = sorted(pathlib.Path(png_dir).glob("*.png")) if paths is None else paths
+
+    pending = []
+    for img_path in paths:
+        digest = file_hash(img_path)
+        if digest in manifest:
+            print(f"Already uploaded: {img_path.name}")
         else:
-            print(f"Upload failed: {title} — {response}")
-    except SlackApiError as e:
-        print(f"Slack API error: {e.response['error']}")
+            pending.append((img_path, digest))
+
+    def upload_one(item):
+        img_path, digest = item
+        try:
+            file_id = upload_with_backoff(transport, img_path, img_path.name, max_retries=max_retries)
+        except Exception as e:
+            print(f"Upload failed: {img_path.name} — {e}")
+            return False
+        manifest.record(digest, img_path.name, file_id)
+        print(f"Uploaded: {img_path.name}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(upload_one, pending))
+
+    return sum(results), len(paths) - len(pending), len(results) - sum(results)
+
+def collect_targets(png_dirs):
+    '''{target: [png paths]} from target dirs, or from the target sub-dirs of a session dir.'''
+    targets = {}
+    for png_dir in map(pathlib.Path, png_dirs):
+        pngs = sorted(png_dir.glob("*.png"))
+        if pngs:
+            targets[png_dir.name] = pngs
+            continue
+        for sub_dir in sorted(p for p in png_dir.iterdir() if p.is_dir()):
+            pngs = sorted(sub_dir.glob("*.png"))
+            if pngs:
+                targets[sub_dir.name] = pngs
+    return targets
+
+def build_digest(targets, digest_dir, tile_size=600, targets_per_sheet=8, quality=80):
+    '''
+    One row per target, one column per plot, each plot downscaled to fit tile_size and
+    labelled with its file name. Sheets are saved as optimised JPEGs with digest_index.json
+    mapping every tile box back to its full-resolution source PNG. Returns the sheet paths.
+    '''
+    digest_dir = pathlib.Path(digest_dir)
+    digest_dir.mkdir(parents=True, exist_ok=True)
+
+    label_h = 20
+    names = list(targets)
+    sheets, index = [], {}
+
+    for n, strt in enumerate(range(0, len(names), targets_per_sheet)):
+        sheet_targets = names[strt:strt + targets_per_sheet]
+        ncols = max(len(targets[name]) for name in sheet_targets)
+        sheet = Image.new('RGB', (ncols * tile_size, len(sheet_targets) * (tile_size + label_h)), 'white')
+        draw = ImageDraw.Draw(sheet)
+        sheet_name = f"digest_{n + 1:02d}.jpg"
+        index[sheet_name] = []
+
+        for row, name in enumerate(sheet_targets):
+            for col, png_path in enumerate(targets[name]):
+                with Image.open(png_path) as img:
+                    img = img.convert('RGB')
+                    img.thumbnail((tile_size, tile_size))
+                    x0 = col * tile_size
+                    y0 = row * (tile_size + label_h)
+                    sheet.paste(img, (x0, y0 + label_h))
+                    draw.text((x0 + 4, y0 + 4), png_path.name, fill='black')
+                    index[sheet_name].append({'target': name, 'file': str(png_path), 'row': row, 'col': col,
+                                              'box': [x0, y0 + label_h, x0 + img.width, y0 + label_h + img.height]})
+
+        sheet_path = digest_dir / sheet_name
+        sheet.save(sheet_path, 'JPEG', quality=quality, optimize=True)
+        sheets.append(sheet_path)
+
+    with open(digest_dir / 'digest_index.json', 'w') as f:
+        json.dump(index, f, indent=2)
+
+    return sheets
 
 def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <png_directory>")
-        sys.exit(1)
+    args = get_args()
 
-    png_dir = pathlib.Path(sys.argv[1])
+    for png_dir in args.png_dirs:
+        if not pathlib.Path(png_dir).is_dir():
+            print(f"Error: {png_dir} is not a directory.")
+            sys.exit(1)
 
-    if not png_dir.is_dir():
-        print(f"Error: {png_dir} is not a directory.")
-        sys.exit(1)
+    if args.dry_run is not None:
+        transport = LocalTransport(args.dry_run or None, ratelimit_every=args.simulate_ratelimit)
+    else:
+        transport = SlackTransport()
 
-    for img_path in sorted(png_dir.glob("*.png")):
-        upload_file_v2(img_path, img_path.name)
+    if args.digest:
+        targets = collect_targets(args.png_dirs)
+        n_pngs = sum(len(pngs) for pngs in targets.values())
+        digest_dir = args.digest_dir or os.path.join(os.path.commonpath([os.path.abspath(d) for d in args.png_dirs]), 'digest')
+        sheets = build_digest(targets, digest_dir, tile_size=args.tile_size, targets_per_sheet=args.targets_per_sheet)
+        print(f"Tiled {n_pngs} plot(s) from {len(targets)} target(s) into {len(sheets)} contact sheet(s) in {digest_dir}")
+        uploaded, skipped, failed = upload_dir(digest_dir, transport, workers=args.workers,
+                                               max_retries=args.max_retries, paths=sheets)
+    else:
+        uploaded, skipped, failed = 0, 0, 0
+        for png_dir in args.png_dirs:
+            counts = upload_dir(png_dir, transport, workers=args.workers, max_retries=args.max_retries)
+            uploaded += counts[0]; skipped += counts[1]; failed += counts[2]
 
-if __name__ == "__main__":
-    main()
+    print(f"Uploaded {uploaded}, already uploaded {skipped}, failed {failed}.")
 
+    if failed:
+        sys.exit(1)
 
+if __name__ == "__main__":
+    main()
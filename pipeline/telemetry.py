@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Structured per-stage telemetry for the LOFTS pipeline.
+Every stage appends one JSON line: wall and CPU time, bytes read/written, peak RSS, MB/s and
+exit status. Records go to $LOFTS_TELEMETRY if set, else to TELEMETRY_DIR/<session>.jsonl.
+
+From bash, wrap a command (its exit status is passed through):
+    python telemetry.py run --session S --scan T --stage rawspec -- rawspec -f ...
+From Python, use record() with wait_usage() for subprocesses.
+Summaries:
+    python telemetry.py summary [--by session|week] [--prom /var/lib/node_exporter/lofts.prom]
+
+I/O is taken from rusage block counts, so reads served from the page cache are not counted.
+"""
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+TELEMETRY_DIR = '/datax2/projects/LOFTS/logs/telemetry'
+BLOCK_BYTES = 512  # ru_inblock / ru_oublock units
+
+def telemetry_path(session):
+    return os.environ.get('LOFTS_TELEMETRY') or os.path.join(TELEMETRY_DIR, f"{session or 'unknown'}.jsonl")
+
+def record(session, stage, wall_s, cpu_s=0.0, read_bytes=0, write_bytes=0, peak_rss_kb=0,
+           exit_status=0, path=None, **extra):
+    '''Appends one stage record; flock keeps concurrent writers from interleaving lines.'''
+    rec = {'ts': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+           'session': session, 'stage': stage,
+           'wall_s': round(wall_s, 3), 'cpu_s': round(cpu_s, 3),
+           'read_bytes': int(read_bytes), 'write_bytes': int(write_bytes),
+           'peak_rss_kb': int(peak_rss_kb),
+           'mb_per_s': round((read_bytes + write_bytes) / 1e6 / wall_s, 3) if wall_s > 0 else 0.0,
+           'exit_status': int(exit_status), 'status': 'ok' if exit_status == 0 else 'failed'}
+    rec.update(extra)
+
+    path = path or telemetry_path(session)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(rec) + '\n')
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+    return rec
+
+def usage_from_rusage(ru):
+    return {'cpu_s': ru.ru_utime + ru.ru_stime,
+            'read_bytes': ru.ru_inblock * BLOCK_BYTES,
+            'write_bytes': ru.ru_oublock * BLOCK_BYTES,
+            'peak_rss_kb': ru.ru_maxrss}
+
+def wait_usage(proc):
+    '''Reaps a Popen child with wait4 and returns (exit status, usage dict) for it and its waited-for descendants.'''
+    _, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage_from_rusage(ru)
+
+def merge_usage(total, usage):
+    for key in ('cpu_s', 'read_bytes', 'write_bytes'):
+        total[key] = total.get(key, 0) + usage[key]
+    total['peak_rss_kb'] = max(total.get('peak_rss_kb', 0), usage['peak_rss_kb'])
+    return total
+
+# ===== Summaries =====
+def load_records(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        print(f"Skipping malformed record in {path}", file=sys.stderr)
+    return records
+
+def group_key(rec, by):
+    if by == 'all':
+        return 'all'
+    if by == 'week':
+        year, week, _ = datetime.fromisoformat(rec['ts']).isocalendar()
+        return f"{year}-W{week:02d}"
+    return rec.get('session') or 'unknown'
+
+def summarise(records, by='session'):
+    '''{(group, stage): totals} with run/failure counts, wall/CPU time and bytes moved.'''
+    table = defaultdict(lambda: {'runs': 0, 'failed': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                 'read_bytes': 0, 'write_bytes': 0, 'peak_rss_kb': 0})
+    for rec in records:
+        row = table[(group_key(rec, by), rec['stage'])]
+        row['runs'] += 1
+        row['failed'] += rec.get('exit_status', 0) != 0
+        row['wall_s'] += rec.get('wall_s', 0.0)
+        row['cpu_s'] += rec.get('cpu_s', 0.0)
+        row['read_bytes'] += rec.get('read_bytes', 0)
+        row['write_bytes'] += rec.get('write_bytes', 0)
+        row['peak_rss_kb'] = max(row['peak_rss_kb'], rec.get('peak_rss_kb', 0))
+    return dict(sorted(table.items()))
+
+def print_table(table, by):
+    print(f"{by:<40} {'stage':<10} {'runs':>5} {'fail':>5} {'wall [h]':>9} {'cpu [h]':>8} "
+          f"{'read [GB]':>10} {'write [GB]':>11} {'MB/s':>8} {'RSS [GB]':>9}")
+    for (group, stage), row in table.items():
+        moved = row['read_bytes'] + row['write_bytes']
+        mbps = moved / 1e6 / row['wall_s'] if row['wall_s'] > 0 else 0.0
+        print(f"{group:<40} {stage:<10} {row['runs']:>5} {row['failed']:>5} {row['wall_s']/3600:>9.2f} "
+              f"{row['cpu_s']/3600:>8.2f} {row['read_bytes']/1e9:>10.1f} {row['write_bytes']/1e9:>11.1f} "
+              f"{mbps:>8.1f} {row['peak_rss_kb']/1024**2:>9.2f}")
+
+def write_prometheus(records, prom_path):
+    '''node_exporter textfile-collector output, written atomically.'''
+    stages = summarise(records, by='all')
+    lines = ['# HELP lofts_stage_runs_total Pipeline stage runs by status.',
+             '# TYPE lofts_stage_runs_total counter']
+    for (_, stage), row in stages.items():
+        lines.append(f'lofts_stage_runs_total{{stage="{stage}",status="ok"}} {row["runs"] - row["failed"]}')
+        lines.append(f'lofts_stage_runs_total{{stage="{stage}",status="failed"}} {row["failed"]}')
+
+    for metric, key, help_text in [('lofts_stage_wall_seconds_total', 'wall_s', 'Wall time spent in each stage.'),
+                                   ('lofts_stage_cpu_seconds_total', 'cpu_s', 'CPU time spent in each stage.'),
+                                   ('lofts_stage_read_bytes_total', 'read_bytes', 'Bytes read by each stage.'),
+                                   ('lofts_stage_written_bytes_total', 'write_bytes', 'Bytes written by each stage.')]:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        lines += [f'{metric}{{stage="{stage}"}} {row[key]}' for (_, stage), row in stages.items()]
+
+    # Throughput and RSS of the most recent run per stage
+    latest = {}
+    for rec in records:
+        if rec['stage'] not in latest or rec['ts'] >= latest[rec['stage']]['ts']:
+            latest[rec['stage']] = rec
+    lines += ['# HELP lofts_stage_last_mb_per_second Throughput of the latest run of each stage.',
+              '# TYPE lofts_stage_last_mb_per_second gauge']
+    lines += [f'lofts_stage_last_mb_per_second{{stage="{s}"}} {r.get("mb_per_s", 0)}' for s, r in sorted(latest.items())]
+    lines += ['# HELP lofts_stage_last_peak_rss_bytes Peak RSS of the latest run of each stage.',
+              '# TYPE lofts_stage_last_peak_rss_bytes gauge']
+    lines += [f'lofts_stage_last_peak_rss_bytes{{stage="{s}"}} {r.get("peak_rss_kb", 0) * 1024}' for s, r in sorted(latest.items())]
+
+    tmp_path = prom_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, prom_path)
+
+# ===== CLI =====
+def get_args():
+    parser = argparse.ArgumentParser(description='LOFTS pipeline telemetry.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    run_p = sub.add_parser('run', help='Run a command and record its telemetry.')
+    run_p.add_argument('--session', type=str, required=True, help='Session name (e.g. sess_sid20240723T200200_SE607).')
+    run_p.add_argument('--stage', type=str, required=True, help='Stage name (e.g. rawspec, turboseti).')
+    run_p.add_argument('--scan', type=str, help='Scan / target name.', default=None)
+    run_p.add_argument('--station', type=str, help='Station.', default=None)
+    run_p.add_argument('command', nargs=argparse.REMAINDER, help='Command to run, after --.')
+
+    sum_p = sub.add_parser('summary', help='Throughput tables from telemetry records.')
+    sum_p.add_argument('files', nargs='*', help=f'.jsonl files (default: {TELEMETRY_DIR}/*.jsonl).')
+    sum_p.add_argument('--by', choices=['session', 'week'], default='session', help='Grouping (default: session).')
+    sum_p.add_argument('--prom', type=str, help='Also write a Prometheus textfile-collector file.', default=None)
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+
+    if args.cmd == 'run':
+        command = args.command[1:] if args.command[:1] == ['--'] else args.command
+        if not command:
+            print("No command given.", file=sys.stderr)
+            sys.exit(2)
+        strt = time.time()
+        try:
+            proc = subprocess.Popen(command)
+            exit_status, usage = wait_usage(proc)
+        except FileNotFoundError:
+            exit_status, usage = 127, {}
+        record(args.session, args.stage, time.time() - strt, exit_status=exit_status,
+               scan=args.scan, station=args.station, cmd=os.path.basename(command[0]), **usage)
+        sys.exit(exit_status)
+
+    files = args.files or sorted(glob.glob(os.path.join(TELEMETRY_DIR, '*.jsonl')))
+    records = load_records(files)
+    print(f"{len(records)} record(s) from {len(files)} file(s)")
+    print_table(summarise(records, by=args.by), args.by)
+    if args.prom:
+        write_prometheus(records, args.prom)
+        print(f"Wrote {args.prom}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reclaim
+
+def entry(target, safety, path='/datax/lane0/udp_16130.zst'):
+    output_dir = f'/datax2/projects/LOFTS/2024-07-23/{target}'
+    return {'path': path, 'size': 10, 'mtime': 1.0, 'kind': 'zst', 'lane': 'lane0', 'station': 'IE613',
+            'target': target, 'session': 'sess', 'output_dir': output_dir, 'nblocks': 100, 'safety': safety,
+            'reason': f'{target} reason', 'action': 'delete' if safety == 'safe' else 'keep',
+            'scans': [{'output_dir': output_dir, 'target': target, 'nblocks': 100}]}
+
+def test_shared_lane_keeps_most_cautious_entry_in_either_order():
+    for order in ([entry('A', 'safe'), entry('B', 'unverified')], [entry('B', 'unverified'), entry('A', 'safe')]):
+        (merged,) = reclaim.merge_entries(order)
+        assert merged['safety'] == 'unverified'
+        assert merged['action'] == 'keep'
+        assert 'A reason' in merged['reason'] and 'B reason' in merged['reason']
+
+def test_shared_safe_lane_is_revalidated_for_both_scans():
+    (merged,) = reclaim.merge_entries([entry('A', 'safe'), entry('B', 'safe')])
+    assert merged['action'] == 'delete'
+    assert sorted(s['target'] for s in merged['scans']) == ['A', 'B']
+
+def test_distinct_paths_are_not_merged():
+    merged = reclaim.merge_entries([entry('A', 'safe'), entry('B', 'unverified', path='/datax/lane1/x.zst')])
+    assert len(merged) == 2
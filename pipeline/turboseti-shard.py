@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Run turboSETI on 0000 products in coarse-channel shards, with the
+shards of every target in a session sharing one pool of turboSETI processes.
+
+For each <name>.0000.fil:
+  1. fil2h5 converts it once into <out_dir>/.turboseti_<target>/ (turboSETI would otherwise
+     convert it again in every shard);
+  2. the coarse channels are split into contiguous ranges of --shard-size and each range is
+     searched by its own `turboSETI -c <chans>` into shard_NNN/;
+  3. when every shard has succeeded, the shard .dat files are merged into <out_dir>/<name>.dat
+     (hits ordered by coarse channel, index and drift rate, then renumbered) and the shard .log
+     files are concatenated in shard order into <out_dir>/<name>.log.
+With -s/--station the products are topocentric and the merged hits get their Corrected_Frequency
+from barycentre.py (one Doppler factor per observation, computed before the search starts).
+A target with a failed shard gets no merged output. Each shard is recorded in telemetry as
+stage turboseti_shard (with its shard number and channel range) and a scaling table is printed.
+
+    turboseti-shard.py <0000.fil>... [-w 16] [--shard-size 26] [-s IE613|SE607] [--session S]
+                       [--turboseti-args '-s 10 -M 4']
+"""
+
+import argparse
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import barycentre
+import telemetry
+
+N_COARSE = 412
+TURBOSETI_ARGS = '-g -s 10 -M 4'  # as narrowband.sh ran it
+
+def shard_ranges(n_coarse, shard_size):
+    return [(c0, min(c0 + shard_size, n_coarse)) for c0 in range(0, n_coarse, shard_size)]
+
+def run_logged(cmd, log_path):
+    '''Runs cmd with output to log_path. Returns (exit status, usage, wall seconds).'''
+    strt = time.time()
+    with open(log_path, 'w') as log:
+        try:
+            proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        except FileNotFoundError:
+            log.write(f"{cmd[0]} not found\n")
+            return 127, {}, time.time() - strt
+        exit_status, usage = telemetry.wait_usage(proc)
+    return exit_status, usage, time.time() - strt
+
+# ===== Merging =====
+def read_dat(dat_path):
+    '''(header lines, hit rows as lists of tab-separated fields).'''
+    header, hits = [], []
+    with open(dat_path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                header.append(line)
+            else:
+                hits.append([field.strip() for field in line.rstrip('\n').rstrip('\t').split('\t')])
+    return header, hits
+
+def hit_key(fields):
+    # Top_Hit_#, Drift_Rate, SNR, Uncorrected_Frequency, Corrected_Frequency, Index, freq_start,
+    # freq_end, SEFD, SEFD_freq, Coarse_Channel_Number, Full_number_of_hits
+    return int(fields[10]), int(fields[5]), float(fields[1]), -float(fields[2])
+
+def merge_dats(dat_paths, out_path):
+    '''Merges shard .dat files into out_path. Returns the number of hits.'''
+    header, hits = None, []
+    for path in dat_paths:
+        shard_header, shard_hits = read_dat(path)
+        header = header or shard_header
+        hits += shard_hits
+    hits.sort(key=hit_key)
+    width = max([len(h[0]) for h in hits] + [6])
+
+    tmp_path = out_path + '.partial'
+    with open(tmp_path, 'w') as f:
+        f.writelines(header or [])
+        for n, fields in enumerate(hits, start=1):
+            f.write('\t'.join([f"{n:0{width}d}"] + fields[1:]) + '\t\n')
+    os.replace(tmp_path, out_path)
+    return len(hits)
+
+def merge_logs(shards, out_path):
+    with open(out_path, 'w') as out:
+        for shard in shards:
+            out.write(f"# ===== shard {shard['n']:03d}: coarse channels {shard['c0']}-{shard['c1'] - 1} =====\n")
+            for path in (shard['log'], shard['turboseti_log']):
+                if path and os.path.isfile(path):
+                    with open(path) as f:
+                        shutil.copyfileobj(f, out)
+
+# ===== Driver =====
+class Target:
+    def __init__(self, fil_path, out_dir, shard_size, n_coarse=N_COARSE):
+        self.fil = os.path.abspath(fil_path)
+        self.name = os.path.basename(fil_path)[:-len('.fil')]
+        self.target = self.name.split('.')[0]
+        self.out_dir = os.path.abspath(out_dir or os.path.dirname(self.fil))
+        self.work_dir = os.path.join(self.out_dir, f".turboseti_{self.target}")
+        self.h5 = os.path.join(self.work_dir, self.name + '.h5')
+        self.shards = [{'n': n, 'c0': c0, 'c1': c1, 'dir': os.path.join(self.work_dir, f"shard_{n:03d}")}
+                       for n, (c0, c1) in enumerate(shard_ranges(n_coarse, shard_size))]
+        self.strt = None
+        self.wall = None
+        self.failed = []
+        self.bary = None
+
+def convert(target, args):
+    os.makedirs(target.work_dir, exist_ok=True)
+    if os.path.isfile(target.h5) and os.path.getmtime(target.h5) >= os.path.getmtime(target.fil):
+        return 0  # from an earlier run
+    cmd = ['fil2h5', target.fil, '-o', target.work_dir]
+    exit_status, usage, wall = run_logged(cmd, os.path.join(target.work_dir, 'fil2h5.log'))
+    telemetry.record(args.session, 'fil2h5', wall, exit_status=exit_status, scan=target.target, **usage)
+    return exit_status
+
+def search_shard(target, shard, args):
+    os.makedirs(shard['dir'], exist_ok=True)
+    chans = ','.join(str(c) for c in range(shard['c0'], shard['c1']))
+    cmd = ['turboSETI', target.h5, '-n', str(args.n_coarse), '-c', chans, '-o', shard['dir']] + shlex.split(args.turboseti_args)
+    shard['log'] = os.path.join(shard['dir'], 'driver.log')
+    shard['dat'] = os.path.join(shard['dir'], target.name + '.dat')
+    shard['turboseti_log'] = os.path.join(shard['dir'], target.name + '.log')
+
+    exit_status, usage, wall = run_logged(cmd, shard['log'])
+    if exit_status == 0 and not os.path.isfile(shard['dat']):
+        exit_status = 1  # turboSETI exited cleanly without writing hits
+    shard['wall'] = wall
+    shard['status'] = exit_status
+    telemetry.record(args.session, 'turboseti_shard', wall, exit_status=exit_status, scan=target.target,
+                     shard=shard['n'], n_shards=len(target.shards), coarse_chans=f"{shard['c0']}-{shard['c1'] - 1}",
+                     **usage)
+    return exit_status
+
+def finish(target, args):
+    '''Merges a target whose shards all succeeded.'''
+    target.wall = time.time() - target.strt
+    if target.failed:
+        print(f"{target.target}: {len(target.failed)} shard(s) failed ({', '.join(str(n) for n in target.failed)}); "
+              f"no merged output. Shard logs are in {target.work_dir}")
+        return False
+    n_hits = merge_dats([s['dat'] for s in target.shards], os.path.join(target.out_dir, target.name + '.dat'))
+    if target.bary:
+        barycentre.correct_dat(os.path.join(target.out_dir, target.name + '.dat'), target.bary)
+    merge_logs(target.shards, os.path.join(target.out_dir, target.name + '.log'))
+    telemetry.record(args.session, 'turboseti', target.wall, scan=target.target, n_shards=len(target.shards), hits=n_hits)
+    print(f"{target.target}: {n_hits} hit(s) from {len(target.shards)} shard(s) in {target.wall:.0f} s")
+    if not args.keep_shards:
+        shutil.rmtree(target.work_dir)
+    return True
+
+def run(targets, args):
+    '''Converts each target, then searches all shards of all targets on one pool.'''
+    lock = threading.Lock()
+    remaining = {t.name: len(t.shards) for t in targets}
+    ok = {}
+
+    def shard_job(target, shard):
+        status = search_shard(target, shard, args)
+        with lock:
+            if status != 0:
+                target.failed.append(shard['n'])
+            remaining[target.name] -= 1
+            last = remaining[target.name] == 0
+        if last:
+            ok[target.name] = finish(target, args)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        converts = {}
+        for target in targets:
+            target.strt = time.time()
+            converts[pool.submit(convert, target, args)] = target
+        shard_futures = []
+        for future in as_completed(converts):
+            target = converts[future]
+            if future.result() != 0:
+                print(f"{target.target}: fil2h5 failed, see {os.path.join(target.work_dir, 'fil2h5.log')}")
+                ok[target.name] = False
+                continue
+            shard_futures += [pool.submit(shard_job, target, shard) for shard in target.shards]
+        for future in shard_futures:
+            future.result()
+    return ok
+
+def print_scaling(targets):
+    print(f"\n{'target':<24} {'shards':>6} {'wall s':>8} {'sum shard s':>12} {'max shard s':>12} {'speed-up':>9}")
+    for t in targets:
+        walls = [s['wall'] for s in t.shards if 'wall' in s]
+        if not walls or not t.wall:
+            continue
+        print(f"{t.target:<24} {len(t.shards):>6} {t.wall:>8.0f} {sum(walls):>12.0f} {max(walls):>12.0f} "
+              f"{sum(walls) / t.wall:>8.1f}x")
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Coarse-channel sharded turboSETI over a pool of processes.')
+    parser.add_argument('fils', nargs='+', help='0000 products (barycentred, or topocentric with -s).')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 4, help='Concurrent turboSETI processes (default: all CPUs).')
+    parser.add_argument('--shard-size', type=int, default=26, help='Coarse channels per shard (default: 26, 16 shards of 412).')
+    parser.add_argument('-o', '--out-dir', type=str, default=None, help='Where merged .dat/.log go (default: next to each product).')
+    parser.add_argument('--session', type=str, default=None, help='Telemetry session name (default: the products\' directory name).')
+    parser.add_argument('-s', '--station', type=str, default=None, help='IE613 or SE607: barycentre the hits of topocentric products.')
+    parser.add_argument('--keep-shards', action='store_true', help='Keep the .h5 and per-shard outputs after merging.')
+    parser.add_argument('-n', '--n-coarse', type=int, default=N_COARSE, help=f'Coarse channels per product (default: {N_COARSE}).')
+    parser.add_argument('--turboseti-args', type=str, default=TURBOSETI_ARGS, help=f"Other turboSETI options (default: '{TURBOSETI_ARGS}').")
+    args = parser.parse_args()
+    args.session = args.session or os.path.basename(os.path.dirname(os.path.abspath(args.fils[0])))
+    return args
+
+def main():
+    args = get_args()
+    targets = [Target(path, args.out_dir, args.shard_size, args.n_coarse) for path in args.fils]
+    if args.station:
+        for target in targets:
+            target.bary = barycentre.load_or_compute(target.fil, args.station)
+    print(f"Number of filterbanks found: {len(targets)}; {sum(len(t.shards) for t in targets)} shard(s) "
+          f"on {args.workers} worker(s)")
+    ok = run(targets, args)
+    print_scaling(targets)
+    sys.exit(0 if ok and all(ok.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,31 @@
 #!/bin/bash
 
 # Code Purpose: Verify presence of filterbank files and then clean voltage and .raw files. 
+# A target is only cleaned once the state ledger (ledger.py) records it as channelised and
+# fil_validate.py finds its three products complete (header-derived sizes, no zero-padded tail).
+# The expected length comes from the RAW block count the ledger recorded and checked against the
+# .zst span at extraction, or from -d; without either a target is never cleaned.
 
 # Arguments:
-# -f : Force cleanup without checking filterbank file sizes
+# -f : Force cleanup of any target with all three filterbank files, without asking the ledger or validator
+# -d : Voltage seconds fed to rawspec, used instead of the ledger's block count
 # $1 : Directory path to scan
 
 # -----------------------------
 # PARSE ARGS
 # -----------------------------
 force=0
+duration=""
 while [[ "$1" == -* ]]; do
     case "$1" in
         -f|--force)
             force=1
             shift
             ;;
+        -d|--duration)
+            duration=$2
+            shift 2
+            ;;
         *)
             echo "Unknown option: $1"
             exit 1
@@ -28,7 +38,7 @@ done
 # -----------------------------
 path=$1
 if [ -z "$path" ]; then
-    echo "Usage: $0 [-f|--force] <scan-path>"
+    echo "Usage: $0 [-f|--force] [-d|--duration <seconds>] <scan-path>"
     exit 1
 fi
 
@@ -45,8 +55,11 @@ touch "$error_file"
 exec > >(tee -a "$log_file") 2> >(tee -a "$error_file" >&2)
 
 raw_data_path="/datax2/projects/LOFTS"
+script_dir=$(dirname "$(readlink -f "$0")")
+ledger="python3 $script_dir/ledger.py"
+validate="python3 $script_dir/fil_validate.py --json"
 echo "Running voltage cleaner on $path"
-[ "$force" -eq 1 ] && echo "Force mode: skipping file size checks"
+[ "$force" -eq 1 ] && echo "Force mode: skipping ledger and validator checks"
 
 # -----------------------------
 # FIND SCAN FOLDERS
@@ -82,75 +95,85 @@ for folder in $header_folders; do
     echo
     echo "TARGET : $target"
     echo "--------------------------------------------------"
-    echo "Checking for filterbank files in:"
+    echo "Checking the ledger for filterbank files in:"
     echo " - $output_dir1"
     echo " - $alt_output_dir1"
 
     check_dir=""
     for dir in "$output_dir1" "$alt_output_dir1"; do
-        if [ -f "$dir/${target}.rawspec.0000.fil" ]; then
+        if $ledger check "$dir" channelised; then
+            # Machine-readable verdict goes to the log; only an ok verdict allows cleaning
+            if [ -n "$duration" ]; then
+                verdict=$($validate --duration "$duration" "$dir"); status=$?
+            elif nblocks=$($ledger blocks "$dir"); then
+                verdict=$($validate --nblocks "$nblocks" "$dir"); status=$?
+            else
+                echo "No RAW block count checked against the .zst span for $dir. Refusing to clean (pass -d <seconds>)."
+                continue
+            fi
+            echo "Validator: $verdict"
+            if [ "$status" -eq 0 ]; then
+                check_dir="$dir"
+                break
+            fi
+            echo "Filterbank products in $dir failed validation."
+        elif [ "$force" -eq 1 ] && [ -f "$dir/${target}.rawspec.0000.fil" ] &&
+             [ -f "$dir/${target}.rawspec.0001.fil" ] && [ -f "$dir/${target}.rawspec.0002.fil" ]; then
             check_dir="$dir"
             break
         fi
     done
 
     if [ -n "$check_dir" ]; then
-        if [ -f "$check_dir/${target}.rawspec.0001.fil" ] && [ -f "$check_dir/${target}.rawspec.0002.fil" ]; then
-            if [ "$force" -eq 1 ] || (
-                [ $(stat -c %s "$check_dir/${target}.rawspec.0000.fil") -gt 9000000000 ] &&
-                [ $(stat -c %s "$check_dir/${target}.rawspec.0001.fil") -gt 30000000000 ] &&
-                [ $(stat -c %s "$check_dir/${target}.rawspec.0002.fil") -gt 500000000 ]
-            ); then
-
-                echo "Filterbank files exist in $check_dir."
-
-                # Remove .raw files
-                raw_files=$(find "$check_dir" -name "*.raw" 2>/dev/null)
-                if [ -n "$raw_files" ]; then
-                    echo "Cleaning .raw files in $check_dir"
-                    find "$check_dir" -name "*.raw" -print0 | xargs -0 rm
-                else
-                    echo "No .raw files found."
-                fi
-
-                # Remove .zst files from scan or target dir
-                zst_folder_path=""
-                if [ -d "$path/scan_${target}" ]; then
-                    zst_folder_path="$path/scan_${target}"
-                elif [ -d "$path/${target}" ]; then
-                    zst_folder_path="$path/${target}"
-                fi
-
-                if [ -n "$zst_folder_path" ]; then
-                    zst_files=$(find "$zst_folder_path" -name "*.zst" 2>/dev/null)
-                    if [ -n "$zst_files" ]; then
-                        echo "Cleaning .zst files in $zst_folder_path"
-                        find "$zst_folder_path" -name "*.zst" -print0 | xargs -0 rm
-                    else
-                        echo "No .zst files found in $zst_folder_path"
-                    fi
-                fi
-
-                # Clean .zst from all lanes
-                for port in {0..3}; do 
-                    lane_path=$(dirname "$(echo "$zst_scan_path" | sed "s/__PORT__/$port/")")
-                    # echo "Checking lane$port at path: $lane_path"
-                    zst_files=$(find "$lane_path" -name "*.zst" 2>/dev/null)
-                    if [ -n "$zst_files" ]; then
-                        echo "Cleaning .zst files in lane$port"
-                        find "$lane_path" -name "*.zst" -print0 | xargs -0 rm
-                    else
-                        echo "No .zst files found in lane$port"
-                    fi
-                done
+        echo "Filterbank files exist in $check_dir."
+
+        # Remove .raw files recorded by the extractor
+        raw_files=$($ledger outputs "$check_dir" --kind raw)
+        if [ -z "$raw_files" ] && [ "$force" -eq 1 ]; then
+            raw_files=$(find "$check_dir" -name "*.raw" 2>/dev/null)
+        fi
+        if [ -n "$raw_files" ]; then
+            echo "Cleaning .raw files in $check_dir"
+            echo "$raw_files" | xargs -d '\n' rm -f
+            # Block-index sidecars written by guppi_raw.py
+            echo "$raw_files" | sed 's/$/.blkidx.npy/; p; s/\.npy$/.json/' | xargs -d '\n' rm -f
+        else
+            echo "No .raw files found."
+        fi
 
+        # Remove .zst files from scan or target dir
+        zst_folder_path=""
+        if [ -d "$path/scan_${target}" ]; then
+            zst_folder_path="$path/scan_${target}"
+        elif [ -d "$path/${target}" ]; then
+            zst_folder_path="$path/${target}"
+        fi
+
+        if [ -n "$zst_folder_path" ]; then
+            zst_files=$(find "$zst_folder_path" -name "*.zst" 2>/dev/null)
+            if [ -n "$zst_files" ]; then
+                echo "Cleaning .zst files in $zst_folder_path"
+                find "$zst_folder_path" -name "*.zst" -print0 | xargs -0 rm
             else
-                echo "Filterbank files exist but are too small. Skipping (use -f to override)."
+                echo "No .zst files found in $zst_folder_path"
             fi
-        else
-            echo "Missing one or more filterbank files. Skipping."
         fi
+
+        # Clean .zst from all lanes
+        for port in {0..3}; do 
+            lane_path=$(dirname "$(echo "$zst_scan_path" | sed "s/__PORT__/$port/")")
+            # echo "Checking lane$port at path: $lane_path"
+            zst_files=$(find "$lane_path" -name "*.zst" 2>/dev/null)
+            if [ -n "$zst_files" ]; then
+                echo "Cleaning .zst files in lane$port"
+                find "$lane_path" -name "*.zst" -print0 | xargs -0 rm
+            else
+                echo "No .zst files found in lane$port"
+            fi
+        done
+
+        $ledger mark "$check_dir" cleaned --detail raw+zst --target "$target"
     else
-        echo "Filterbank files not found in any expected folders. Skipping voltage_cleaner..."
+        echo "No verified filterbank products in any expected folder. Skipping (use -f to override)."
     fi
 done
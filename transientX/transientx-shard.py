@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Code Purpose: Run transientX single-pulse searches with the DM plan split into balanced shards,
+so the 427-trial high-DM row of ddplan.txt no longer runs on its own while the other cores idle.
+
+For each filterbank:
+  1. each row of the DM plan is costed as ndm * nsamples / td and cut into contiguous DM pieces
+     of at most a quarter of an even share, and the pieces are dealt into --shards shards
+     (largest first, each to the least loaded shard; neighbouring pieces that land in the same
+     shard are joined again);
+  2. every shard is searched by its own transientx_fil with its own ddplan into
+     <target>_singlepulse/.transientx_shards/shard_NN/, the shards of all files sharing one
+     pool of --jobs searches (longest first);
+  3. when every shard of a file has succeeded, the shard .cands are merged into
+     <target>_singlepulse/<target>.cands (time order, candidates renumbered) and the plots of
+     the kept candidates are moved next to it.
+A pulse found just either side of a DM boundary between two shards is reported by both. In the
+merge, candidates from the two shards of a boundary that are within --boundary-trials DM trials
+of it and overlap in time (within the wider of their two widths) are one pulse, and only the
+brightest is kept. Each shard is recorded in telemetry as stage transientx_shard.
+
+    transientx-shard.py <fil>... [-j 8] [-t 4] [--shards N] [--ddplan ddplan.txt] [--session S]
+"""
+
+import argparse
+import bisect
+import heapq
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
+import sigproc_utils
+import telemetry
+
+DDPLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ddplan.txt')
+SIF = '/datax2/projects/LOFTS/software/dockers/transientx_lofar_v1.sif'
+BINDS = '/datax,/datax2'
+TRANSIENTX_ARGS = '--zapthre 3.0 --fd 1 --overlap 0.1 --thre 7 --drop -z kadaneF 8 4 zdot'  # as transientx_singlefil.sh ran it
+PLAN_COLUMNS = ['td', 'fd', 'dms', 'ddm', 'ndm', 'snrloss', 'maxwidth']
+PIECES_PER_SHARE = 4
+
+# ===== DM plan =====
+
+def read_ddplan(path):
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            row = dict(zip(PLAN_COLUMNS, line.split()))
+            for key in PLAN_COLUMNS:
+                row[key] = int(row[key]) if key in ('td', 'fd', 'ndm') else float(row[key])
+            rows.append(row)
+    return rows
+
+def write_ddplan(path, rows):
+    with open(path, 'w') as f:
+        f.write('# ' + ' '.join(PLAN_COLUMNS[:-1]) + ' maxwidth(s)\n')
+        for row in rows:
+            f.write(f"{row['td']} {row['fd']} {round(row['dms'], 6)} {row['ddm']} {row['ndm']} {row['snrloss']} {row['maxwidth']}\n")
+
+def row_cost(row, nsamples):
+    return row['ndm'] * nsamples / row['td']
+
+def split_plan(rows, n_shards, nsamples):
+    '''
+    Deals the plan into at most n_shards lists of rows of near-equal cost. Returns
+    [(cost, rows sorted by DM)], most expensive first.
+    '''
+    # pieces of a quarter share leave the greedy deal room to even out the shards
+    piece_cost = sum(row_cost(row, nsamples) for row in rows) / max(1, n_shards) / PIECES_PER_SHARE
+    pieces = []
+    for n_row, row in enumerate(rows):
+        n_pieces = min(row['ndm'], max(1, math.ceil(row_cost(row, nsamples) / piece_cost - 1e-9)))
+        strt = 0
+        for k in range(n_pieces):
+            ndm = row['ndm'] // n_pieces + (k < row['ndm'] % n_pieces)
+            pieces.append(dict(row, dms=row['dms'] + strt * row['ddm'], ndm=ndm, row=n_row))
+            strt += ndm
+
+    loads = [(0.0, n, []) for n in range(n_shards)]
+    for piece in sorted(pieces, key=lambda p: -row_cost(p, nsamples)):
+        cost, n, shard = heapq.heappop(loads)
+        shard.append(piece)
+        heapq.heappush(loads, (cost + row_cost(piece, nsamples), n, shard))
+    shards = [(cost, join_pieces(sorted(shard, key=lambda p: p['dms']))) for cost, _, shard in loads if shard]
+    return sorted(shards, key=lambda s: -s[0])
+
+def join_pieces(rows):
+    '''Joins DM-contiguous pieces of one plan row that were dealt to the same shard.'''
+    joined = []
+    for row in rows:
+        prev = joined[-1] if joined else None
+        if (prev and prev['row'] == row['row']
+                and math.isclose(prev['dms'] + prev['ndm'] * prev['ddm'], row['dms'], abs_tol=1e-9)):
+            prev['ndm'] += row['ndm']
+        else:
+            joined.append(dict(row))
+    return joined
+
+def boundary_zones(shards, n_trials):
+    '''
+    DM zones either side of every boundary between pieces of different shards, as
+    (dm_lo, dm_hi, shard_a, shard_b). Overlapping plan rows count as adjacent.
+    '''
+    pieces = sorted((p['dms'], p['dms'] + (p['ndm'] - 1) * p['ddm'], p['ddm'], n)
+                    for n, (_, rows) in enumerate(shards) for p in rows)
+    zones = []
+    for (lo_a, hi_a, ddm_a, a), (lo_b, hi_b, ddm_b, b) in zip(pieces, pieces[1:]):
+        if a != b:
+            zones.append((min(hi_a, lo_b) - n_trials * ddm_a, max(hi_a, lo_b) + n_trials * ddm_b, a, b))
+    return zones
+
+# ===== Candidates =====
+
+def read_cands(path, shard):
+    '''transientX .cands rows as dicts (fields kept as text for rewriting).'''
+    cands = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 11 or line.startswith('#'):
+                continue
+            cands.append({'fields': fields, 'mjd': float(fields[2]), 'dm': float(fields[3]),
+                          'width_s': float(fields[4]) / 1e3, 'snr': float(fields[5]), 'shard': shard})
+    return cands
+
+def is_boundary_pair(a, b, zones):
+    pair = {a['shard'], b['shard']}
+    return any(lo <= a['dm'] <= hi and lo <= b['dm'] <= hi and pair == {za, zb} for lo, hi, za, zb in zones)
+
+def drop_boundary_duplicates(cands, zones):
+    '''Keeps the brightest candidate of each pulse reported by two shards across a DM boundary.'''
+    if not cands:
+        return []
+    window = max(c['width_s'] for c in cands)
+    kept, kept_s = [], []
+    for cand in sorted(cands, key=lambda c: -c['snr']):
+        t = cand['mjd'] * 86400
+        lo, hi = bisect.bisect_left(kept_s, t - window), bisect.bisect_right(kept_s, t + window)
+        if any(kept[k]['shard'] != cand['shard']
+               and abs(kept_s[k] - t) <= max(kept[k]['width_s'], cand['width_s'])
+               and is_boundary_pair(kept[k], cand, zones) for k in range(lo, hi)):
+            continue
+        k = bisect.bisect_right(kept_s, t)
+        kept_s.insert(k, t)
+        kept.insert(k, cand)
+    return kept
+
+def write_cands(path, cands):
+    '''Writes cands in time order with Candidate_ID renumbered. Atomic.'''
+    tmp_path = path + '.partial'
+    with open(tmp_path, 'w') as f:
+        for n, cand in enumerate(sorted(cands, key=lambda c: (c['mjd'], c['dm'])), start=1):
+            fields = list(cand['fields'])
+            fields[1] = str(n)
+            f.write('\t'.join(fields) + '\n')
+    os.replace(tmp_path, path)
+
+# ===== Searching =====
+
+def run_logged(cmd, log_path, cwd):
+    '''Runs cmd in cwd with output to log_path. Returns (exit status, usage, wall seconds).'''
+    strt = time.time()
+    with open(log_path, 'w') as log:
+        try:
+            proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+        except FileNotFoundError:
+            log.write(f"{cmd[0]} not found\n")
+            return 127, {}, time.time() - strt
+        exit_status, usage = telemetry.wait_usage(proc)
+    return exit_status, usage, time.time() - strt
+
+class Target:
+
+    def __init__(self, fil_path, plan, n_shards, boundary_trials):
+        self.fil = os.path.abspath(fil_path)
+        self.target = os.path.basename(fil_path).split('.')[0]
+        self.out_dir = os.path.join(os.path.dirname(self.fil), f"{self.target}_singlepulse")
+        self.work_dir = os.path.join(self.out_dir, '.transientx_shards')
+        self.nsamples = sigproc_utils.read_header(self.fil)['nspectra']
+        split = split_plan(plan, n_shards, self.nsamples)
+        self.shards = [{'n': n, 'cost': cost, 'rows': rows, 'dir': os.path.join(self.work_dir, f"shard_{n:02d}")}
+                       for n, (cost, rows) in enumerate(split)]
+        self.zones = boundary_zones(split, boundary_trials)
+        self.strt = None
+        self.wall = None
+        self.failed = []
+
+def search_shard(target, shard, args):
+    os.makedirs(shard['dir'], exist_ok=True)
+    plan_path = os.path.join(shard['dir'], 'ddplan.txt')
+    write_ddplan(plan_path, shard['rows'])
+    cmd = (['transientx_fil', '-v', '-o', target.target, '-t', str(args.threads)] + shlex.split(args.transientx_args)
+           + ['--ddplan', plan_path, '-f', target.fil])
+    if not args.no_container:
+        cmd = ['singularity', 'exec', '--bind', BINDS, args.sif, 'bash', '-c', shlex.join(cmd)]
+
+    exit_status, usage, wall = run_logged(cmd, os.path.join(shard['dir'], 'driver.log'), shard['dir'])
+    shard['wall'] = wall
+    shard['status'] = exit_status
+    dms = f"{shard['rows'][0]['dms']:.3f}-{max(r['dms'] + (r['ndm'] - 1) * r['ddm'] for r in shard['rows']):.3f}"
+    telemetry.record(args.session, 'transientx_shard', wall, exit_status=exit_status, scan=target.target,
+                     shard=shard['n'], n_shards=len(target.shards), dms=dms,
+                     ndm=sum(r['ndm'] for r in shard['rows']), est_cost=round(shard['cost']), **usage)
+    return exit_status
+
+def finish(target, args):
+    '''Merges a target whose shards all succeeded.'''
+    target.wall = time.time() - target.strt
+    if target.failed:
+        print(f"{target.target}: {len(target.failed)} shard(s) failed ({', '.join(str(n) for n in target.failed)}); "
+              f"no merged output. Shard logs are in {target.work_dir}")
+        return False
+
+    cands = []
+    for shard in target.shards:
+        for name in sorted(os.listdir(shard['dir'])):
+            if name.endswith('.cands'):
+                cands += read_cands(os.path.join(shard['dir'], name), shard['n'])
+    kept = drop_boundary_duplicates(cands, target.zones)
+    for cand in kept:
+        png = os.path.join(target.shards[cand['shard']]['dir'], os.path.basename(cand['fields'][8]))
+        if os.path.isfile(png):
+            os.replace(png, os.path.join(target.out_dir, os.path.basename(png)))
+    write_cands(os.path.join(target.out_dir, target.target + '.cands'), kept)
+
+    telemetry.record(args.session, 'transientx', target.wall, scan=target.target, n_shards=len(target.shards),
+                     cands=len(kept), boundary_duplicates=len(cands) - len(kept))
+    print(f"{target.target}: {len(kept)} candidate(s) from {len(target.shards)} shard(s) "
+          f"({len(cands) - len(kept)} DM-boundary duplicate(s) dropped) in {target.wall:.0f} s")
+    if not args.keep_shards:
+        shutil.rmtree(target.work_dir)
+    return True
+
+def run(targets, args):
+    '''Searches the shards of all targets on one pool, most expensive first.'''
+    lock = threading.Lock()
+    remaining = {t.fil: len(t.shards) for t in targets}
+    ok = {}
+
+    def shard_job(target, shard):
+        with lock:
+            if target.strt is None:
+                target.strt = time.time()
+        status = search_shard(target, shard, args)
+        with lock:
+            if status != 0:
+                target.failed.append(shard['n'])
+            remaining[target.fil] -= 1
+            last = remaining[target.fil] == 0
+        if last:
+            ok[target.fil] = finish(target, args)
+
+    jobs = sorted(((t, s) for t in targets for s in t.shards), key=lambda job: -job[1]['cost'])
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for future in [pool.submit(shard_job, t, s) for t, s in jobs]:
+            future.result()
+    return ok
+
+def print_scaling(targets):
+    print(f"\n{'target':<24} {'shards':>6} {'wall s':>8} {'sum shard s':>12} {'max shard s':>12} {'balance':>8}")
+    for t in targets:
+        walls = [s['wall'] for s in t.shards if 'wall' in s]
+        if not walls or not t.wall:
+            continue
+        print(f"{t.target:<24} {len(t.shards):>6} {t.wall:>8.0f} {sum(walls):>12.0f} {max(walls):>12.0f} "
+              f"{sum(walls) / len(walls) / max(walls):>8.2f}")
+
+def get_args():
+    parser = argparse.ArgumentParser(description='DM-plan sharded transientX over a pool of searches.')
+    parser.add_argument('fils', nargs='+', help='Filterbanks to search (normally 0001 products).')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Concurrent transientx_fil runs (default: CPUs / --threads).')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Threads per transientx_fil (default: 4).')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='Shards per file (default: enough to fill --jobs over the files, at least 1).')
+    parser.add_argument('--ddplan', type=str, default=DDPLAN, help=f'DM plan (default: {DDPLAN}).')
+    parser.add_argument('--boundary-trials', type=int, default=5,
+                        help='DM trials either side of a shard boundary checked for duplicates (default: 5).')
+    parser.add_argument('--session', type=str, default=None, help='Telemetry session name (default: the files\' directory name).')
+    parser.add_argument('--transientx-args', type=str, default=TRANSIENTX_ARGS, help=f"Other transientx_fil options (default: '{TRANSIENTX_ARGS}').")
+    parser.add_argument('--sif', type=str, default=SIF, help=f'transientX singularity image (default: {SIF}).')
+    parser.add_argument('--no-container', action='store_true', help='Run transientx_fil from PATH instead of the image.')
+    parser.add_argument('--keep-shards', action='store_true', help='Keep the per-shard outputs after merging.')
+    args = parser.parse_args()
+    args.jobs = args.jobs or max(1, (os.cpu_count() or 4) // args.threads)
+    args.shards = args.shards or max(1, math.ceil(args.jobs / len(args.fils)))
+    args.session = args.session or os.path.basename(os.path.dirname(os.path.abspath(args.fils[0])))
+    return args
+
+def main():
+    args = get_args()
+    plan = read_ddplan(args.ddplan)
+    targets = [Target(path, plan, args.shards, args.boundary_trials) for path in args.fils]
+    for t in targets:
+        os.makedirs(t.out_dir, exist_ok=True)
+    print(f"Number of filterbanks found: {len(targets)}; {sum(len(t.shards) for t in targets)} shard(s) "
+          f"of {len(plan)} DM plan row(s) on {args.jobs} job(s) of {args.threads} thread(s)")
+    ok = run(targets, args)
+    print_scaling(targets)
+    sys.exit(0 if ok and all(ok.values()) else 1)
+
+if __name__ == "__main__":
+    main()
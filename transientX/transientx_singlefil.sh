@@ -23,12 +23,12 @@ echo " Target: $target"
 echo " Output directory: $output_dir"
 echo " ======================== "
 
-cd "$output_dir"
-command="transientx_fil -v -o \"${target}\" -t 4 --zapthre 3.0 --fd 1 --overlap 0.1 --ddplan /datax2/projects/LOFTS/LOFTS-Scripts/transientX/ddplan.txt --thre 7 --drop -z kadaneF 8 4 zdot -f \"${file_path}\""
-
 # start time measurement
 start_time=$(date +%s)
-singularity exec --bind /datax,/datax2 /datax2/projects/LOFTS/software/dockers/transientx_lofar_v1.sif bash -c "$command"
+# The DM plan is split into balanced shards searched in parallel, and the shard .cands are merged into
+# ${output_dir}/${target}.cands without DM-boundary duplicates (see transientx-shard.py)
+python3 $(dirname "$(readlink -f "$0")")/transientx-shard.py -t 4 \
+    --ddplan /datax2/projects/LOFTS/LOFTS-Scripts/transientX/ddplan.txt "$file_path"
 
 end_time=$(date +%s)
 elapsed_time=$((end_time - start_time))